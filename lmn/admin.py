@@ -1,8 +1,11 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.template.response import TemplateResponse
+from django.urls import path
 
 # Register your models here.
 
-from .models import Venue, Artist, Note, Show, Badge, Profile, ShowRating
+from .models import Venue, Artist, Note, Show, Badge, Profile, ShowRating, ScrapeJob, DuplicateCandidate
+from .ingest import dedupe
 
 admin.site.register(Venue)
 admin.site.register(Artist)
@@ -11,3 +14,93 @@ admin.site.register(Show)
 admin.site.register(Badge)
 admin.site.register(Profile)
 admin.site.register(ShowRating)
+
+
+class ScrapeJobAdmin(admin.ModelAdmin):
+    """ Scrape runs, plus a chart of how long recent runs took at history/ """
+    change_list_template = 'admin/lmn/scrapejob/change_list.html'
+    list_display = ('pk', 'status', 'started', 'elapsed', 'pages_fetched', 'pages_skipped', 'shows_inserted', 'shows_skipped', 'backfill')
+    list_filter = ('status', 'backfill')
+
+    HISTORY_RUNS = 100
+    CHART_WIDTH = 800
+    CHART_HEIGHT = 240
+
+    def get_urls(self):
+        history = path('history/', self.admin_site.admin_view(self.history_view), name='lmn_scrapejob_history')
+        return [history] + super().get_urls()
+
+
+    def history_view(self, request):
+        runs = list(ScrapeJob.objects.filter(status=ScrapeJob.FINISHED, started__isnull=False)
+                    .order_by('-finished')[:self.HISTORY_RUNS])
+        runs.reverse()
+        context = dict(self.admin_site.each_context(request), 
+                       opts=self.model._meta, 
+                       title='Scrape run duration',
+                       runs=runs,
+                       bars=self.chart_bars(runs),
+                       chart_width=self.CHART_WIDTH,
+                       chart_height=self.CHART_HEIGHT)
+        return TemplateResponse(request, 'admin/lmn/scrapejob/history.html', context)
+
+
+    def chart_bars(self, runs):
+        """ One bar per run, oldest on the left, scaled so the slowest run fills the chart's height """
+        longest = max((run.elapsed for run in runs), default=0) or 1
+        width = self.CHART_WIDTH / max(len(runs), 1)
+        bars = []
+        for index, run in enumerate(runs):
+            height = run.elapsed / longest * self.CHART_HEIGHT
+            bars.append({'run': run, 'x': round(index * width, 1), 'y': round(self.CHART_HEIGHT - height, 1), 
+                         'width': round(max(width - 2, 1), 1), 'height': round(height, 1)})
+        return bars
+
+
+admin.site.register(ScrapeJob, ScrapeJobAdmin)
+
+
+class DuplicateCandidateAdmin(admin.ModelAdmin):
+    """ Pairs found by manage.py find_duplicates. Approve the real duplicates, then merge them. """
+    list_display = ('kind', 'keep_name', 'merge_name', 'score', 'status', 'found')
+    list_filter = ('status', 'kind')
+    search_fields = ('keep_name', 'merge_name')
+    ordering = ('-score',)
+    actions = ['approve', 'reject', 'merge_approved']
+
+    def approve(self, request, queryset):
+        updated = queryset.filter(status=DuplicateCandidate.PENDING).update(status=DuplicateCandidate.APPROVED)
+        self.message_user(request, f'{updated} pairs approved')
+    approve.short_description = 'Approve selected pairs'
+
+
+    def reject(self, request, queryset):
+        updated = queryset.filter(status__in=[DuplicateCandidate.PENDING, DuplicateCandidate.APPROVED]).update(status=DuplicateCandidate.REJECTED)
+        self.message_user(request, f'{updated} pairs rejected')
+    reject.short_description = 'Reject selected pairs'
+
+
+    def merge_approved(self, request, queryset):
+        selected = queryset.count()
+        merged = shows_moved = shows_folded = notes_dropped = ratings_dropped = 0
+        for candidate in queryset.order_by('-score'):
+            # An earlier merge in this batch may have deleted a row this pair refers to, and the pair with it
+            candidate = DuplicateCandidate.objects.filter(pk=candidate.pk, status=DuplicateCandidate.APPROVED).first()
+            if candidate is None:
+                continue
+            counts = dedupe.merge(candidate)
+            merged += 1
+            shows_moved += counts['shows_moved']
+            shows_folded += counts['shows_folded']
+            notes_dropped += counts['notes_dropped']
+            ratings_dropped += counts['ratings_dropped']
+
+        skipped = selected - merged
+        self.message_user(request, f'{merged} pairs merged, {shows_moved} shows moved and {shows_folded} duplicate shows combined. '
+                                   f'{notes_dropped} notes and {ratings_dropped} ratings were dropped, their user had one on both shows')
+        if skipped:
+            self.message_user(request, f'{skipped} selected pairs weren\'t approved, or were already merged, and were skipped', messages.WARNING)
+    merge_approved.short_description = 'Merge selected approved pairs'
+
+
+admin.site.register(DuplicateCandidate, DuplicateCandidateAdmin)
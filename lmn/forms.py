@@ -1,5 +1,5 @@
 from django import forms
-from .models import Note, ShowRating
+from .models import Note, ShowRating, Profile, Show
 
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
@@ -12,6 +12,18 @@ class UserForm(forms.ModelForm):
         fields = ['first_name', 'last_name', 'email']
 
 
+class ProfileForm(forms.ModelForm):
+    class Meta:
+        model = Profile
+        fields = ('profile_image', 'shows_seen', 'bio', 'badges')
+
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Each show's label names its artist and venue, so load them with the shows, not two more queries per show
+        self.fields['shows_seen'].queryset = Show.objects.select_related('artist', 'venue')
+
+
 class VenueSearchForm(forms.Form):
     search_name = forms.CharField(label='Venue Name', max_length=200)
 
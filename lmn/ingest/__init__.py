@@ -0,0 +1 @@
+"""Building blocks for getting show data into the database - fetching pages, parsing them, and writing the results."""
@@ -0,0 +1,119 @@
+"""An archive of every listing page fetched, so pages can be parsed again without the network.
+
+The archive is off unless settings.PAGE_ARCHIVE_DIR is set.
+Pages are gzipped and stored in files under that directory, named by the sha256 of
+their content - a page fetched again unchanged doesn't take any more space. Each fetch is
+recorded as an ArchivedPage row: source, url, fetch time and content hash.
+
+reparse() runs a source's current parser over its archived pages and writes the results with
+ShowWriter, so after a parser fix the show tables can be rebuilt in seconds (manage.py reparse).
+"""
+import gzip
+import os
+import tempfile
+
+from django.conf import settings
+from django.utils import timezone
+
+from lmn.models import ArchivedPage
+from lmn.ingest.cache import content_hash
+from lmn.ingest.writer import ShowWriter
+
+
+REPARSE_BATCH_SIZE = 500  # records written at once
+
+
+class PageArchive:
+    """
+    :param root: directory holding the archived pages, defaults to settings.PAGE_ARCHIVE_DIR
+    :type root: str
+    """
+
+    def __init__(self, root=None):
+        self.root = root or settings.PAGE_ARCHIVE_DIR
+
+
+    def path(self, page_hash):
+        return os.path.join(self.root, page_hash[:2], page_hash[2:] + '.gz')
+
+
+    def put(self, content):
+        """Store content, if it isn't stored already. Doesn't touch the database.
+
+        :param content: page body
+        :type content: bytes
+        :returns: the content hash it's stored under
+        :rtype: str
+        """
+        page_hash = content_hash(content)
+        path = self.path(page_hash)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Written to a temporary file and renamed, so a half written page is never found under its hash
+            with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), delete=False) as f:
+                f.write(gzip.compress(content))
+            os.replace(f.name, path)
+        return page_hash
+
+
+    def get(self, page_hash):
+        with open(self.path(page_hash), 'rb') as f:
+            return gzip.decompress(f.read())
+
+
+    def record(self, source_name, url, page_hash, size, fetched=None):
+        """ Add the row for one fetch of a page already put() in the archive """
+        return ArchivedPage.objects.create(source=source_name, url=url, content_hash=page_hash, size=size, 
+                                           fetched=fetched or timezone.now())
+
+
+    def pages(self, source_name, latest_only=True):
+        """The archived fetches of a source's pages
+
+        :param latest_only: only the most recent fetch of each url
+        :type latest_only: bool
+        :rtype: iterator of ArchivedPage
+        """
+        fetches = ArchivedPage.objects.filter(source=source_name).order_by('url', '-fetched')
+        last_url = None
+        for page in fetches.iterator():
+            if latest_only and page.url == last_url:
+                continue
+            last_url = page.url
+            yield page
+
+
+def reparse(source, archive=None, latest_only=True, batch_size=REPARSE_BATCH_SIZE):
+    """Parse a source's archived pages again with its current parser, and insert any shows, artists
+    and venues that aren't in the database yet. Nothing is fetched.
+
+    :param source: source whose pages to parse
+    :type source: Source
+    :param archive: archive to read, defaults to PageArchive()
+    :type archive: PageArchive
+    :param latest_only: parse only the latest fetch of each url, not every version ever fetched
+    :type latest_only: bool
+    :param batch_size: records to collect before writing them
+    :type batch_size: int
+    :returns: pages parsed, and the writer's totals
+    :rtype: dict
+    """
+    archive = archive or PageArchive()
+    writer = ShowWriter(city=source.city, state=source.state)
+    pages_parsed = 0
+    seen_hashes = set()
+    batch = []
+
+    for page in archive.pages(source.name, latest_only):
+        if page.content_hash in seen_hashes:
+            continue  # the same content fetched from another url, or at another time
+        seen_hashes.add(page.content_hash)
+        batch.extend(source.parse(archive.get(page.content_hash)))
+        pages_parsed += 1
+        if len(batch) >= batch_size:
+            writer.write(batch)
+            batch = []
+
+    if batch:
+        writer.write(batch)
+    return dict(writer.counts, pages_parsed=pages_parsed)
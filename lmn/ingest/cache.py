@@ -0,0 +1,69 @@
+"""Skip listing pages that haven't changed since the last run.
+
+Requests are sent with If-None-Match / If-Modified-Since from the previous
+fetch of the same url. A 304, or a 200 whose body hashes the same as last
+time, means the page can be skipped without parsing it or touching the
+show tables.
+"""
+import hashlib
+
+from lmn.models import PageCacheEntry
+
+
+class PageCache:
+    """Cached validators for a set of urls, loaded with one query
+
+    :param urls: urls this run will fetch
+    :type urls: iterable of str
+    """
+
+    def __init__(self, urls):
+        self.entries = {entry.url: entry for entry in PageCacheEntry.objects.filter(url__in=list(urls))}
+
+
+    def request_headers(self):
+        """Conditional request headers for every url that has been fetched before
+
+        :rtype: dict of url to headers dict
+        """
+        headers = {}
+        for url, entry in self.entries.items():
+            url_headers = {}
+            if entry.etag:
+                url_headers['If-None-Match'] = entry.etag
+            if entry.last_modified:
+                url_headers['If-Modified-Since'] = entry.last_modified
+            if url_headers:
+                headers[url] = url_headers
+        return headers
+
+
+    def is_unchanged(self, url, response):
+        """True if the page is the same as the last time it was stored
+
+        :param url: url requested
+        :param response: response for url
+        :type response: requests.Response
+        """
+        # Reads only what was loaded up front, so this is safe to call away from the database
+        if response.status_code == 304:
+            return True
+
+        entry = self.entries.get(url)
+        return entry is not None and entry.content_hash == content_hash(response.content)
+
+
+    def store(self, url, response):
+        """Remember response as the latest version of url. Call this after the page has been written,
+        so a page that failed part way through is parsed again next time. 
+        Unchanged pages can be stored too, in case the site sent new validators."""
+        entry, created = PageCacheEntry.objects.update_or_create(url=url, defaults={
+            'etag': response.headers.get('ETag', ''),
+            'last_modified': response.headers.get('Last-Modified', ''),
+            'content_hash': content_hash(response.content),
+        })
+        self.entries[url] = entry
+
+
+def content_hash(content):
+    return hashlib.sha256(content).hexdigest()
@@ -0,0 +1,168 @@
+"""Find artists and venues that are probably the same, and merge them.
+
+Comparing every row with every other is O(n²), so rows are first split into blocks - every
+row in a block shares a word of its name key - and only pairs within a block are scored.
+Words shared by more than max_block rows ('band', 'club') say little about a match and would
+make huge blocks, so they're skipped. Pairs are scored by the similarity of their names'
+character trigrams and words (see similarity), and the ones scoring at least the threshold
+are saved as DuplicateCandidates, for someone to approve or reject in the admin site.
+
+merge() folds an approved pair into one row with a handful of set-based updates.
+"""
+import itertools
+import unicodedata
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, Q
+
+from lmn.models import Artist, Venue, Show, Note, ShowRating, Profile, DuplicateCandidate, name_key, recount_ratings, recount_notes
+
+
+DEFAULT_THRESHOLD = 0.6
+DEFAULT_MAX_BLOCK = 200
+
+MODELS = {DuplicateCandidate.ARTIST: Artist, DuplicateCandidate.VENUE: Venue}
+SHOW_FIELD = {DuplicateCandidate.ARTIST: 'artist', DuplicateCandidate.VENUE: 'venue'}
+
+
+def fold_accents(key):
+    """ 'hüsker dü' to 'husker du' """
+    return ''.join(char for char in unicodedata.normalize('NFKD', key) if not unicodedata.combining(char))
+
+
+def trigrams(key):
+    padded = f'  {key} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def similarity(first_key, second_key):
+    """How alike two name keys are, from 0 to 1, ignoring accents: the mean of the Dice coefficient
+    of their character trigrams - good at spelling differences - and the share of the shorter name's
+    words found in the other - good at words added, like 'Prince' and 'Prince & The Revolution'
+
+    :rtype: float
+    """
+    first_key, second_key = fold_accents(first_key), fold_accents(second_key)
+    first_grams, second_grams = trigrams(first_key), trigrams(second_key)
+    grams = 2 * len(first_grams & second_grams) / (len(first_grams) + len(second_grams))
+    first_words, second_words = set(first_key.split()), set(second_key.split())
+    words = len(first_words & second_words) / min(len(first_words), len(second_words))
+    return (grams + words) / 2
+
+
+def candidate_pairs(keys, max_block=DEFAULT_MAX_BLOCK):
+    """Pairs of ids that share a block
+
+    :param keys: name key by row id
+    :type keys: dict
+    :param max_block: skip words shared by more rows than this
+    :type max_block: int
+    :rtype: set of (smaller id, larger id)
+    """
+    blocks = defaultdict(list)
+    for row_id, key in keys.items():
+        for word in set(key.split()):
+            blocks[word].append(row_id)
+
+    pairs = set()
+    for ids in blocks.values():
+        if 1 < len(ids) <= max_block:
+            pairs.update(itertools.combinations(sorted(ids), 2))
+    return pairs
+
+
+def find_duplicates(kind, threshold=DEFAULT_THRESHOLD, max_block=DEFAULT_MAX_BLOCK):
+    """Score likely duplicate artists or venues and save the ones at or above threshold for review.
+    Pairs already in the review table, whatever was decided about them, are left alone.
+
+    :param kind: DuplicateCandidate.ARTIST or DuplicateCandidate.VENUE
+    :param threshold: lowest similarity saved
+    :type threshold: float
+    :param max_block: skip words shared by more rows than this
+    :type max_block: int
+    :returns: pairs compared, and candidates saved
+    :rtype: dict
+    """
+    model = MODELS[kind]
+    rows = list(model.objects.annotate(show_count=Count('show')).values_list('id', 'name', 'show_count'))
+    names = {row_id: name for row_id, name, show_count in rows}
+    show_counts = {row_id: show_count for row_id, name, show_count in rows}
+    # Computed, not read from name_key, which is empty for rows whose key was already taken. 
+    # Accents are dropped so 'Hüsker Dü' and 'Husker Du' share a block.
+    keys = {row_id: fold_accents(name_key(name)) for row_id, name in names.items()}
+
+    candidates = []
+    pairs = candidate_pairs(keys, max_block)
+    for first, second in pairs:
+        score = similarity(keys[first], keys[second])
+        if score >= threshold:
+            # Keep whichever has more shows, so fewer rows are moved
+            keep, merge = sorted((first, second), key=lambda row_id: (-show_counts[row_id], row_id))
+            candidates.append(DuplicateCandidate(kind=kind, keep_id=keep, merge_id=merge, keep_name=names[keep],
+                                                 merge_name=names[merge], score=round(score, 3)))
+
+    existing = DuplicateCandidate.objects.filter(kind=kind).count()
+    DuplicateCandidate.objects.bulk_create(candidates, ignore_conflicts=True)
+    return {'rows': len(names), 'pairs_compared': len(pairs),
+            'candidates_saved': DuplicateCandidate.objects.filter(kind=kind).count() - existing}
+
+
+def merge(candidate):
+    """Fold candidate's merge row into its keep row: its shows are moved to the keep row, and it's deleted.
+
+    A moved show can be the same show as one the keep row already has - same date and the other of
+    artist or venue. Then the duplicate show's notes, ratings and profiles' shows seen are moved to
+    the kept show, except where the same user already has one there, and the duplicate show is deleted.
+    The notes and ratings left behind are deleted with it, and counted.
+
+    :param candidate: an approved DuplicateCandidate
+    :type candidate: DuplicateCandidate
+    :returns: shows moved, duplicate shows folded into the kept row's shows, and notes and ratings
+        dropped because their user had one on the kept show too
+    :rtype: dict
+    """
+    field = SHOW_FIELD[candidate.kind]
+    other_field = 'venue' if field == 'artist' else 'artist'
+
+    with transaction.atomic():
+        kept_shows = {(show_date, other_id): show_id for show_id, show_date, other_id in
+                      Show.objects.filter(**{field: candidate.keep_id}).values_list('id', 'show_date', other_field)}
+        clashes = {}  # duplicate show id to kept show id
+        notes_dropped = ratings_dropped = 0
+        for show_id, show_date, other_id in Show.objects.filter(**{field: candidate.merge_id}).values_list('id', 'show_date', other_field):
+            if (show_date, other_id) in kept_shows:
+                clashes[show_id] = kept_shows[(show_date, other_id)]
+
+        for duplicate, kept in clashes.items():
+            notes, ratings = _move_show_references(duplicate, kept)
+            notes_dropped += notes
+            ratings_dropped += ratings
+        Show.objects.filter(id__in=clashes.keys()).delete()
+        # The notes and ratings were moved by update(), which sends no signals
+        recount_ratings(Show.objects.filter(id__in=clashes.values()))
+        recount_notes(Show.objects.filter(id__in=clashes.values()), Profile.objects.none())
+
+        moved = Show.objects.filter(**{field: candidate.merge_id}).update(**{field: candidate.keep_id})
+        MODELS[candidate.kind].objects.filter(pk=candidate.merge_id).delete()
+
+        candidate.status = DuplicateCandidate.MERGED
+        candidate.save(update_fields=['status'])
+        # Other pairs involving the deleted row are out of date now, approved or not. The next find_duplicates redoes them.
+        DuplicateCandidate.objects.filter(Q(keep_id=candidate.merge_id) | Q(merge_id=candidate.merge_id), kind=candidate.kind,
+                                          status__in=[DuplicateCandidate.PENDING, DuplicateCandidate.APPROVED]).delete()
+
+    return {'shows_moved': moved, 'shows_folded': len(clashes), 'notes_dropped': notes_dropped, 'ratings_dropped': ratings_dropped}
+
+
+def _move_show_references(duplicate, kept):
+    """Point what refers to the duplicate show at the kept show, where that doesn't give a user two of something
+
+    :returns: the notes and ratings left on the duplicate show, which are deleted with it
+    :rtype: tuple(int, int)
+    """
+    Note.objects.filter(show=duplicate).exclude(user__in=Note.objects.filter(show=kept).values('user')).update(show=kept)
+    ShowRating.objects.filter(show=duplicate).exclude(user__in=ShowRating.objects.filter(show=kept).values('user')).update(show=kept)
+    seen = Profile.shows_seen.through.objects
+    seen.filter(show=duplicate).exclude(profile__in=seen.filter(show=kept).values('profile')).update(show=kept)
+    return Note.objects.filter(show=duplicate).count(), ShowRating.objects.filter(show=duplicate).count()
@@ -0,0 +1,108 @@
+"""Concurrent page fetching.
+
+All requests in a run share one requests.Session, so connections to the
+same host are kept alive and reused instead of paying a new TCP/TLS
+handshake for every page.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+DEFAULT_CONCURRENCY = 8
+REQUEST_TIMEOUT = 30  # seconds
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """Spaces out calls to wait() so there are at most per_second of them a second, across all threads
+
+    :param per_second: calls allowed per second, None or 0 for no limit
+    :type per_second: float
+    """
+
+    def __init__(self, per_second):
+        self.interval = 1 / per_second if per_second else 0
+        self.next_time = 0
+        self.lock = threading.Lock()
+
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_time)
+            self.next_time = start + self.interval
+        time.sleep(start - now)
+
+
+def make_session(pool_size=DEFAULT_CONCURRENCY):
+    """Create a keep-alive session with a connection pool big enough for pool_size threads
+
+    :param pool_size: number of connections to keep open per host
+    :type pool_size: int
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def fetch_page(session, url, headers=None):
+    """Get one page. If it can't be fetched the error is logged and None is returned.
+
+    :param session: session to fetch with
+    :type session: requests.Session
+    :param headers: extra request headers
+    :type headers: dict
+    :rtype: requests.Response
+    """
+    try:
+        response = session.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
+        response.raise_for_status()
+        return response
+    except requests.RequestException as e:
+        logger.warning('%s', e, extra={'ingest': {'url': url}})
+        return None
+
+
+def fetch_pages(urls, concurrency=DEFAULT_CONCURRENCY, session=None, headers=None):
+    """Fetch urls concurrently, yielding (url, response) pairs in the order the pages arrive,
+    so the caller can start parsing the first page while the rest are still downloading.
+
+    If a page can't be fetched the error is logged and (url, None) is yielded.
+
+    :param urls: urls to fetch
+    :type urls: iterable of str
+    :param concurrency: maximum number of requests in flight at once
+    :type concurrency: int
+    :param session: session to use, one is created for this call if not provided
+    :type session: requests.Session
+    :param headers: extra request headers for some urls, such as conditional GET headers
+    :type headers: dict of url to headers dict
+    """
+    own_session = session is None
+    if own_session:
+        session = make_session(concurrency)
+
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    headers = headers or {}
+    futures = {executor.submit(fetch_page, session, url, headers.get(url)): url for url in urls}
+
+    try:
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+    finally:
+        # If the caller stops early, don't start any requests that haven't begun yet
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=True)
+        if own_session:
+            session.close()
@@ -0,0 +1,233 @@
+"""Scrape runs as background jobs.
+
+The web app only queues a ScrapeJob; a worker (manage.py scrape) runs it.
+A job scrapes every registered source, side by side. Each finished page is
+recorded on the job as "source:page", so if the worker is stopped part way
+through, the next run of the same job skips the pages already done.
+
+Only one run at a time: a run holds the RUN_LOCK lease (see locks.py), and a
+second run started meanwhile raises LockHeld straight away. A big backfill can
+instead be sharded - several workers, maybe on different machines, each
+claiming ranges of shard_size pages with a lease per range, until none are left.
+A page that fails MAX_PAGE_ATTEMPTS times - a 404 past a site's last page, say -
+isn't claimed again, so the job can finish without it.
+"""
+import logging
+import time
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from lmn.models import ScrapeJob, IngestLock
+from lmn.ingest.locks import RunLock, LockHeld, acquire, release, holder, make_owner
+from lmn.ingest.run import run_sources
+from lmn.ingest.sources import load_sources
+
+
+logger = logging.getLogger(__name__)
+
+UNFINISHED = [ScrapeJob.QUEUED, ScrapeJob.RUNNING]
+
+RUN_LOCK = 'scrape'
+
+MAX_PAGE_ATTEMPTS = 3  # tries at a failing page before sharded runs give up on it
+
+
+def enqueue_scrape(backfill=False):
+    """Queue a scrape, unless one is already waiting or running - cron retries shouldn't pile up jobs
+
+    :param backfill: walk every page, not just the ones newer than the watermark. 
+        An unfinished job is switched to a backfill.
+    :type backfill: bool
+    :returns: the queued or running job, and whether it was created by this call
+    :rtype: tuple(ScrapeJob, bool)
+    """
+    job = ScrapeJob.objects.filter(status__in=UNFINISHED).order_by('created').first()
+    if job:
+        if backfill and not job.backfill:
+            job.backfill = True
+            job.save(update_fields=['backfill'])
+        return job, False
+    return ScrapeJob.objects.create(pages_total=total_pages(load_sources()), backfill=backfill), True
+
+
+def total_pages(sources):
+    return sum(source.pages for source in sources)
+
+
+def page_key(source_name, page_number):
+    """ How a finished page is recorded in ScrapeJob.pages_completed """
+    return f'{source_name}:{page_number}'
+
+
+def given_up(job):
+    """ Pages of job that have failed MAX_PAGE_ATTEMPTS times and haven't been done since """
+    done = set(job.pages_completed)
+    return {key for key in set(job.page_failures) if key not in done and job.page_failures.count(key) >= MAX_PAGE_ATTEMPTS}
+
+
+def next_job():
+    """The oldest job that still has work to do. A job left RUNNING was interrupted, so it's picked up again."""
+    return ScrapeJob.objects.filter(status__in=UNFINISHED).order_by('created').first()
+
+
+def run_job(job, sources=None, shard_size=None, owner=None):
+    """Scrape the pages of job that haven't been done yet, checkpointing after each one
+
+    :param job: job to run or resume
+    :type job: ScrapeJob
+    :param sources: sources to scrape, defaults to every registered source
+    :type sources: list of Source
+    :param shard_size: work through the job shard_size pages at a time, alongside any other workers 
+        doing the same, instead of doing all of it. Meant for backfills - see run_shards.
+    :type shard_size: int
+    :param owner: name for this worker's leases, defaults to make_owner()
+    :type owner: str
+    :raises LockHeld: if another run is going, or shards of this job are being worked on
+    :raises Exception: anything that stops the scrape. The job is marked failed first.
+    """
+    if sources is None:
+        sources = load_sources()
+    owner = owner or make_owner()
+    if shard_size:
+        return run_shards(job, sources, shard_size, owner)
+
+    with RunLock(RUN_LOCK, owner=owner) as lock:
+        if IngestLock.objects.filter(name__startswith=shard_lock_prefix(job), expires__gte=timezone.now()).exists():
+            raise LockHeld(f'Shards of job {job.pk} are being worked on')
+
+        start_job(job, sources)
+        done = set(job.pages_completed)
+        remaining = {source.name: [page for page in range(source.pages) if page_key(source.name, page) not in done] 
+                     for source in sources}
+        results = scrape_pages(job, sources, remaining, lock.renew)
+
+    return finish_job(job, any(result['stopped_early'] for result in results.values()))
+
+
+def run_shards(job, sources, shard_size, owner):
+    """Claim unfinished ranges of job's pages and scrape them, until there are none left to claim. 
+    Several workers can run this on one job at once; the last one to finish a range finishes the job.
+
+    :returns: the job, finished if this worker did the last of it
+    :rtype: ScrapeJob
+    :raises LockHeld: if a run of the whole job is going
+    """
+    start_job(job, sources)
+    stopped_early = False
+    while True:
+        if holder(RUN_LOCK):
+            raise LockHeld(f'{holder(RUN_LOCK)}')
+        job.refresh_from_db()
+        if job.status == ScrapeJob.FAILED:
+            return job  # another worker's shard failed
+
+        shard = claim_shard(job, sources, shard_size, owner)
+        if shard is None:
+            break
+        source, pages, lock_name = shard
+        try:
+            result = scrape_pages(job, [source], {source.name: pages}, lambda: acquire(lock_name, owner))[source.name]
+        finally:
+            release(lock_name, owner)
+        stopped_early = stopped_early or result['stopped_early']
+
+    job.refresh_from_db()
+    if len(set(job.pages_completed) | given_up(job)) < job.pages_total:
+        return job  # other workers are still on their shards
+    return finish_job(job, stopped_early)
+
+
+def shard_lock_prefix(job):
+    return f'{RUN_LOCK}:{job.pk}:'
+
+
+def claim_shard(job, sources, shard_size, owner):
+    """The first range of shard_size pages with pages still to do that nobody else has claimed
+
+    :returns: (source, page numbers to do, name of the lock claimed), or None if there's nothing left to claim
+    """
+    done = set(job.pages_completed) | given_up(job)
+    for source in sources:
+        for first in range(0, source.pages, shard_size):
+            pages = [page for page in range(first, min(first + shard_size, source.pages)) if page_key(source.name, page) not in done]
+            lock_name = f'{shard_lock_prefix(job)}{source.name}:{first}'
+            if pages and acquire(lock_name, owner):
+                return source, pages, lock_name
+    return None
+
+
+def start_job(job, sources):
+    if not job.pages_total:
+        job.pages_total = total_pages(sources)
+    job.status = ScrapeJob.RUNNING
+    job.started = job.started or timezone.now()
+    job.save(update_fields=['status', 'started', 'pages_total'])
+
+
+def scrape_pages(job, sources, pages, renew_lease):
+    """Scrape pages, by source name, for job. Each finished page is added to the job, and renews the worker's lease."""
+
+    def checkpoint(source_name, page_number, counts):
+        # Other workers may be adding pages too, so add to what's in the database, not to this copy
+        with transaction.atomic():
+            pages_completed = ScrapeJob.objects.select_for_update().values_list('pages_completed', flat=True).get(pk=job.pk)
+            ScrapeJob.objects.filter(pk=job.pk).update(
+                pages_completed=pages_completed + [page_key(source_name, page_number)],
+                **{name: F(name) + count for name, count in counts.items()})
+        if not renew_lease():
+            logger.warning('Lost the lease on job %s to another worker', job.pk, extra={'ingest': {'job': job.pk}})
+
+    def record_failure(source_name, page_number):
+        with transaction.atomic():
+            page_failures = ScrapeJob.objects.select_for_update().values_list('page_failures', flat=True).get(pk=job.pk)
+            ScrapeJob.objects.filter(pk=job.pk).update(page_failures=page_failures + [page_key(source_name, page_number)])
+
+    try:
+        return run_sources(sources, pages=pages, on_page=checkpoint, on_page_failed=record_failure, backfill=job.backfill)
+    except Exception as e:
+        job.refresh_from_db()
+        job.status = ScrapeJob.FAILED
+        job.error = repr(e)
+        job.finished = timezone.now()
+        job.save()
+        raise
+
+
+def finish_job(job, stopped_early):
+    job.refresh_from_db()
+    job.status = ScrapeJob.FINISHED
+    job.finished = timezone.now()
+    job.stopped_early = stopped_early
+    skipped = given_up(job)
+    if skipped:
+        job.error = f'Gave up on {len(skipped)} pages after {MAX_PAGE_ATTEMPTS} attempts: {", ".join(sorted(skipped))}'
+    job.save(update_fields=['status', 'finished', 'stopped_early', 'error'])
+    return job
+
+
+def run_worker(poll_interval=30, stop_when_idle=False, shard_size=None):
+    """Run queued jobs as they appear. Failures are logged and the worker moves on to the next job.
+    While the job is held by another worker, or all of its shards are, this one waits.
+
+    :param shard_size: work on shards of this many pages, alongside other workers, see run_shards
+    :type shard_size: int
+    """
+    owner = make_owner()
+    while True:
+        job = next_job()
+        if job is not None:
+            try:
+                job = run_job(job, shard_size=shard_size, owner=owner)
+                if job.status != ScrapeJob.RUNNING:
+                    continue  # straight on to the next job
+            except LockHeld as e:
+                logger.info('Scrape job %s is held by %s', job.pk, e, extra={'ingest': {'job': job.pk}})
+            except Exception:
+                logger.exception('Scrape job %s failed', job.pk, extra={'ingest': {'job': job.pk}})
+                continue
+
+        if stop_when_idle:
+            return
+        time.sleep(poll_interval)
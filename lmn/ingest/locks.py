@@ -0,0 +1,92 @@
+"""Leases in the IngestLock table, so scrape runs on different processes or machines don't overlap.
+
+A lease is a row: whoever inserts it holds it, until they delete it or it expires. A holder
+that dies without releasing only blocks the work until the lease runs out, so holders renew
+their lease as they make progress. Everything is plain inserts and conditional updates, so it
+works the same on SQLite and Postgres.
+"""
+import datetime
+import os
+import socket
+import uuid
+
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from lmn.models import IngestLock
+
+
+DEFAULT_LEASE = 15 * 60  # seconds
+
+
+class LockHeld(Exception):
+    """ Raised when work is already being done by someone else """
+
+
+def make_owner():
+    """ A name for this process, unique even across machines """
+    return f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+
+def acquire(name, owner, lease=DEFAULT_LEASE):
+    """Take the lock called name, if it's free, expired, or already owner's - then the lease is renewed
+
+    :param name: lock name
+    :type name: str
+    :param owner: who is taking it, see make_owner
+    :type owner: str
+    :param lease: seconds until the lock expires, unless renewed
+    :type lease: int
+    :returns: whether owner now holds the lock
+    :rtype: bool
+    """
+    now = timezone.now()
+    expires = now + datetime.timedelta(seconds=lease)
+    if IngestLock.objects.filter(Q(expires__lt=now) | Q(owner=owner), name=name).update(owner=owner, acquired=now, expires=expires):
+        return True
+    try:
+        with transaction.atomic():
+            IngestLock.objects.create(name=name, owner=owner, acquired=now, expires=expires)
+        return True
+    except IntegrityError:
+        return False  # someone else holds it
+
+
+def release(name, owner):
+    IngestLock.objects.filter(name=name, owner=owner).delete()
+
+
+def holder(name):
+    """ The unexpired lock called name, or None """
+    return IngestLock.objects.filter(name=name, expires__gte=timezone.now()).first()
+
+
+class RunLock:
+    """Holds a lock for the length of a with block
+
+    :param name: lock name
+    :param lease: seconds the lock is held for without a renew()
+    :param owner: defaults to a new make_owner()
+    :raises LockHeld: on entering, if someone else holds the lock
+    """
+
+    def __init__(self, name, lease=DEFAULT_LEASE, owner=None):
+        self.name = name
+        self.lease = lease
+        self.owner = owner or make_owner()
+
+
+    def __enter__(self):
+        if not acquire(self.name, self.owner, self.lease):
+            raise LockHeld(f'{holder(self.name) or self.name}')
+        return self
+
+
+    def renew(self):
+        """ Push the expiry back. False if the lease ran out and someone else has taken the lock. """
+        return acquire(self.name, self.owner, self.lease)
+
+
+    def __exit__(self, *exc_info):
+        release(self.name, self.owner)
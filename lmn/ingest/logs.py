@@ -0,0 +1,25 @@
+"""Structured logging for the ingest package.
+
+Log calls put their fields in extra={'ingest': {...}}, for example every page
+written by a scrape logs its source, page number, url, status, bytes fetched,
+fetch/parse/database seconds and rows inserted and skipped. JsonFormatter
+writes each record as one JSON object per line, with those fields at the top
+level, so they can be filtered and summed by a log viewer.
+"""
+import json
+import logging
+
+
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update(getattr(record, 'ingest', {}))
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
@@ -0,0 +1,195 @@
+"""A small staged pipeline: each stage runs in its own worker threads, and stages are joined by
+bounded queues, so a slow stage makes the ones before it wait instead of piling up work in memory.
+
+Stages that use the database share the calling thread's connection, one at a time. That keeps all
+the writes in the caller's transaction (and on SQLite, only one writer can work at once anyway),
+while fetching and parsing carry on around them.
+"""
+import queue
+import threading
+import time
+
+from django.db import connections, DEFAULT_DB_ALIAS
+
+
+DEFAULT_QUEUE_SIZE = 4
+
+_DONE = object()  # end of input marker, one per worker
+
+
+class StageStats:
+    """Counters for one stage. Throughput is items handled per second of the whole run."""
+
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.items_in = 0
+        self.items_out = 0
+        self.busy_seconds = 0.0
+        self.max_queue_depth = 0
+        self._depth_total = 0
+        self._lock = threading.Lock()
+
+
+    def record(self, queue_depth, items_out, busy_seconds):
+        with self._lock:
+            self.items_in += 1
+            self.items_out += items_out
+            self.busy_seconds += busy_seconds
+            self._depth_total += queue_depth
+            self.max_queue_depth = max(self.max_queue_depth, queue_depth)
+
+
+    def as_dict(self, elapsed):
+        return {
+            'stage': self.name,
+            'workers': self.workers,
+            'items_in': self.items_in,
+            'items_out': self.items_out,
+            'busy_seconds': round(self.busy_seconds, 3),
+            'per_second': round(self.items_in / elapsed, 1) if elapsed else 0,
+            'max_queue_depth': self.max_queue_depth,
+            'avg_queue_depth': round(self._depth_total / self.items_in, 2) if self.items_in else 0,
+        }
+
+
+class Pipeline:
+    """Stages added with add_stage are run in order by run().
+
+    Each stage function takes one item and returns an iterable of items for the next stage -
+    empty to drop the item, several to fan out. The last stage's output is discarded.
+
+    :param queue_size: maximum items waiting in front of each stage
+    :type queue_size: int
+    :param db_lock: lock held while a database stage runs. Pipelines running side by side on one connection must share it.
+    :type db_lock: threading.Lock
+    """
+
+    def __init__(self, queue_size=DEFAULT_QUEUE_SIZE, db_lock=None):
+        self.queue_size = queue_size
+        self.stages = []
+        self.elapsed = 0
+        self._stopping = threading.Event()
+        self._stop_callbacks = []
+        self._error = None
+        self._db_lock = db_lock or threading.Lock()
+
+
+    def add_stage(self, name, func, workers=1, uses_db=False):
+        """
+        :param name: name for the stage's stats
+        :param func: func(item) -> iterable of items for the next stage
+        :param workers: threads running func
+        :param uses_db: func uses the database. It will run on the caller's connection, never at the same time as another database stage.
+        """
+        self.stages.append({'name': name, 'func': func, 'workers': workers, 'uses_db': uses_db, 
+                            'stats': StageStats(name, workers), 'queue': queue.Queue(self.queue_size)})
+        return self
+
+
+    def stop(self):
+        """Stop taking new input. Items already in the pipeline still go through every stage."""
+        self._stopping.set()
+        for callback in self._stop_callbacks:
+            callback()
+
+
+    def on_stop(self, callback):
+        """Call callback() when the pipeline is stopped, or a stage fails - for input that's waiting on the pipeline"""
+        self._stop_callbacks.append(callback)
+
+
+    def stats(self):
+        return [stage['stats'].as_dict(self.elapsed) for stage in self.stages]
+
+
+    def run(self, items):
+        """Push items through every stage, returning when they're all done
+
+        :param items: input for the first stage. Consumed lazily, so it can block to hold input back.
+        :raises Exception: the first exception raised by a stage, after the pipeline has wound down
+        """
+        start = time.perf_counter()
+        connection = connections[DEFAULT_DB_ALIAS]
+        threads = []
+
+        for index, stage in enumerate(self.stages):
+            next_stage = self.stages[index + 1] if index + 1 < len(self.stages) else None
+            remaining = [stage['workers']]
+            for worker in range(stage['workers']):
+                thread = threading.Thread(target=self._work, args=(stage, next_stage, remaining, connection), 
+                                          name=f'{stage["name"]}-{worker}', daemon=True)
+                threads.append(thread)
+
+        if any(stage['uses_db'] for stage in self.stages):
+            connection.inc_thread_sharing()
+        try:
+            for thread in threads:
+                thread.start()
+            self._feed(items)
+            for thread in threads:
+                thread.join()
+        finally:
+            if any(stage['uses_db'] for stage in self.stages):
+                connection.dec_thread_sharing()
+            self.elapsed = time.perf_counter() - start
+
+        if self._error:
+            raise self._error
+
+
+    def _feed(self, items):
+        first = self.stages[0]
+        try:
+            for item in items:
+                if self._stopping.is_set():
+                    break
+                first['queue'].put(item)
+        except Exception as e:
+            self._fail(e)
+        finally:
+            for worker in range(first['workers']):
+                first['queue'].put(_DONE)
+
+
+    def _work(self, stage, next_stage, remaining, connection):
+        if stage['uses_db']:
+            connections[DEFAULT_DB_ALIAS] = connection
+
+        while True:
+            depth = stage['queue'].qsize()
+            item = stage['queue'].get()
+            if item is _DONE:
+                break
+            if self._error:
+                continue  # drain, so earlier stages aren't left blocked on a full queue
+
+            began = time.perf_counter()
+            try:
+                if stage['uses_db']:
+                    with self._db_lock:
+                        outputs = list(stage['func'](item))
+                else:
+                    outputs = list(stage['func'](item))
+            except Exception as e:
+                self._fail(e)
+                continue
+            stage['stats'].record(depth, len(outputs), time.perf_counter() - began)
+
+            if next_stage:
+                for output in outputs:
+                    next_stage['queue'].put(output)
+
+        # The last worker out tells the next stage there's nothing more coming
+        with stage['stats']._lock:
+            remaining[0] -= 1
+            last_worker = remaining[0] == 0
+        if last_worker and next_stage:
+            for worker in range(next_stage['workers']):
+                next_stage['queue'].put(_DONE)
+
+
+    def _fail(self, error):
+        if self._error is None:
+            self._error = error
+        self.stop()
@@ -0,0 +1,6 @@
+"""The plain records parsers produce and writers consume - no models, no soup, just the data."""
+from collections import namedtuple
+
+
+""" One show found on a listing page. show_date is a datetime.date """
+ShowRecord = namedtuple('ShowRecord', ['artist', 'venue', 'show_date'])
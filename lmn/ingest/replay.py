@@ -0,0 +1,166 @@
+"""Replay recorded listing pages, so the scraper can be run, tested and benchmarked without the live site.
+
+Pages can be served over HTTP by ReplayServer, to exercise the fetch code,
+or loaded with load_recorded_pages and handed straight to a parser.
+with_json_ld adds the JSON-LD a site publishing structured data would have.
+"""
+import datetime
+import email.utils
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.utils import timezone
+
+
+RECORDED_PAGES_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'fixtures', 'scraper_pages', 'first_avenue')
+
+PAGE_PATH_RE = re.compile(r'^/shows/page/(\d+)/')
+PAGE_FILE_RE = re.compile(r'^page_\d+\.html$')
+
+SHOW_START = datetime.time(20, 0)  # for the start times in with_json_ld
+
+
+def load_recorded_pages(pages_dir=RECORDED_PAGES_DIR):
+    """The recorded pages, in page order
+
+    :returns: (page_number, html) for each page_<n>.html in pages_dir
+    :rtype: list of tuple(int, bytes)
+    """
+    pages = []
+    for name in os.listdir(pages_dir):
+        if PAGE_FILE_RE.match(name):
+            with open(os.path.join(pages_dir, name), 'rb') as f:
+                pages.append((int(name[len('page_'):-len('.html')]), f.read()))
+    return sorted(pages)
+
+
+def with_json_ld(content, records):
+    """A recorded page, with its shows added as schema.org MusicEvent JSON-LD at the end of its <head>
+
+    :param content: html of a recorded page
+    :type content: bytes
+    :param records: the page's shows
+    :type records: list of ShowRecord
+    :rtype: bytes
+    """
+    events = [{
+        '@context': 'https://schema.org',
+        '@type': 'MusicEvent',
+        'name': record.artist,
+        'startDate': timezone.make_aware(datetime.datetime.combine(record.show_date, SHOW_START)).isoformat(),
+        'performer': {'@type': 'MusicGroup', 'name': record.artist},
+        'location': {'@type': 'MusicVenue', 'name': record.venue, 'address': 'Minneapolis, MN'},
+    } for record in records]
+    script = b'<script type="application/ld+json">' + json.dumps(events).encode() + b'</script>\n'
+    return content.replace(b'</head>', script + b'</head>', 1)
+
+
+class ReplayServer:
+    """A threaded HTTP server on localhost that answers /shows/page/<n>/ with the recorded page_<n>.html.
+
+    Use as a context manager::
+
+        with ReplayServer(latency=0.2) as server:
+            scrape_first(url_template=server.url_template)
+
+    :param pages_dir: directory of recorded page_<n>.html files
+    :type pages_dir: str
+    :param latency: seconds to wait before answering each request, to imitate a remote site
+    :type latency: float
+    :param conditional: send ETag and Last-Modified, and answer matching conditional requests with 304
+    :type conditional: bool
+    """
+
+    def __init__(self, pages_dir=RECORDED_PAGES_DIR, latency=0, conditional=True):
+        self.pages_dir = pages_dir
+        self.latency = latency
+        self.conditional = conditional
+        self.request_count = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+
+    @property
+    def url_template(self):
+        return self.base_url + '/shows/page/{page_number}/?orderby=past_shows'
+
+
+    def page_count(self):
+        return len([name for name in os.listdir(self.pages_dir) if PAGE_FILE_RE.match(name)])
+
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+        self._thread.start()
+        return self
+
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+
+    def __enter__(self):
+        return self.start()
+
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+    def _make_handler(self):
+        replay = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive, like the real site
+
+            def do_GET(self):
+                with replay._lock:
+                    replay.request_count += 1
+                if replay.latency:
+                    time.sleep(replay.latency)
+
+                match = PAGE_PATH_RE.match(self.path)
+                path = os.path.join(replay.pages_dir, f'page_{match.group(1)}.html') if match else None
+                if path is None or not os.path.exists(path):
+                    self.send_error(404)
+                    return
+
+                with open(path, 'rb') as f:
+                    body = f.read()
+                etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+                last_modified = email.utils.formatdate(os.path.getmtime(path), usegmt=True)
+
+                if replay.conditional and (self.headers.get('If-None-Match') == etag or self.headers.get('If-Modified-Since') == last_modified):
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.end_headers()
+                    return
+
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html; charset=UTF-8')
+                self.send_header('Content-Length', str(len(body)))
+                if replay.conditional:
+                    self.send_header('ETag', etag)
+                    self.send_header('Last-Modified', last_modified)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # keep benchmark and test output quiet
+
+        return Handler
@@ -0,0 +1,340 @@
+"""Running sources: each source's pages go through a pipeline of stages - fetch, parse, resolve
+names to ids, write shows - each running alongside the others, so pages are fetched while earlier
+ones are parsed and written. run_sources runs several sources at once, each within its own rate
+limit and concurrency budget.
+
+Pages that haven't changed since the last run are skipped. Once a source has a watermark, only
+its first page is fetched at first, and each page of all-new shows lets two more through, so
+paging stops soon after the first page that reaches shows an earlier run ingested.
+
+Parsing is CPU bound, so backfills, which parse every page, fan it out to a pool of processes.
+The workers send back ShowRecords - small tuples - never parse trees, and the database writes
+stay in this process.
+
+If settings.PAGE_ARCHIVE_DIR is set, every page fetched is kept in the page archive (see archive.py), so it can be parsed again later.
+
+Every page is logged to the lmn.ingest.run logger with its timings, see lmn/ingest/logs.py.
+"""
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.conf import settings
+from django.db import connections, DEFAULT_DB_ALIAS
+
+from lmn.ingest.archive import PageArchive
+from lmn.ingest.cache import PageCache
+from lmn.ingest.fetch import fetch_page, make_session, RateLimiter
+from lmn.ingest.pipeline import Pipeline
+from lmn.ingest.watermark import load_watermark, reached, advance_watermark
+from lmn.ingest.writer import ShowWriter
+
+
+logger = logging.getLogger(__name__)
+
+# Processes parsing pages in a backfill
+PARSE_PROCESSES = os.cpu_count() or 1
+
+
+def run_sources(sources, pages=None, on_page=None, on_page_failed=None, backfill=False, use_cache=True, parse_processes=None, archive=True):
+    """Scrape several sources at once, one thread per source. Each source keeps to its own 
+    rate limit and concurrency; their database work shares the caller's connection.
+
+    :param sources: sources to scrape
+    :type sources: list of Source
+    :param pages: page numbers to scrape for some sources, by source name. Others do all their pages.
+    :type pages: dict
+    :param on_page: called as on_page(source_name, page_number, counts) after each page is written or skipped
+    :type on_page: callable
+    :param on_page_failed: called as on_page_failed(source_name, page_number) for each page that couldn't be fetched
+    :type on_page_failed: callable
+    :param backfill: walk every page, ignoring watermarks and the page cache
+    :type backfill: bool
+    :param use_cache: skip pages that are unchanged since they were last fetched
+    :type use_cache: bool
+    :param parse_processes: processes parsing each source's pages, see SourceRun
+    :type parse_processes: int
+    :param archive: keep every page fetched in the page archive, if settings.PAGE_ARCHIVE_DIR is set
+    :type archive: bool
+    :returns: each source's result from SourceRun.run, by source name
+    :rtype: dict
+    :raises Exception: the first error from any source, after all of them have finished
+    """
+    pages = pages or {}
+    db_lock = threading.Lock()
+    connection = connections[DEFAULT_DB_ALIAS]
+    results = {}
+    errors = []
+
+    def page_callback(source, callback):
+        if callback is None:
+            return None
+        return lambda page_number, *args: callback(source.name, page_number, *args)
+
+    runs = [SourceRun(source, pages=pages.get(source.name), on_page=page_callback(source, on_page), 
+                      on_page_failed=page_callback(source, on_page_failed), backfill=backfill, 
+                      use_cache=use_cache, parse_processes=parse_processes, archive=archive, db_lock=db_lock) 
+            for source in sources]
+
+    def run(source_run):
+        connections[DEFAULT_DB_ALIAS] = connection
+        try:
+            results[source_run.source.name] = source_run.run()
+        except Exception as e:
+            errors.append(e)
+
+    connection.inc_thread_sharing()
+    try:
+        threads = [threading.Thread(target=run, args=(source_run,), name=f'source-{source_run.source}', daemon=True) for source_run in runs]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        connection.dec_thread_sharing()
+
+    if errors:
+        raise errors[0]
+    return results
+
+
+class ListingPage:
+    """ One page on its way through the pipeline """
+    __slots__ = ('number', 'url', 'response', 'content_hash', 'unchanged', 'records', 'shows', 'counts', 'timings')
+
+    def __init__(self, number, url):
+        self.number = number
+        self.url = url
+        self.response = None
+        self.content_hash = None  # set once the page is in the archive
+        self.unchanged = False
+        self.records = []
+        self.shows = []
+        self.counts = {}
+        self.timings = {'fetch_seconds': 0.0, 'parse_seconds': 0.0, 'db_seconds': 0.0}
+
+
+class PageGate:
+    """Hands page numbers to the pipeline as they're released, holding the rest back
+
+    :param pages: page numbers, in order
+    :param released: how many can go straight away
+    """
+
+    def __init__(self, pages, released):
+        self.pages = pages
+        self.released = released
+        self.closed = False
+        self.condition = threading.Condition()
+
+
+    def release(self, count):
+        with self.condition:
+            self.released += count
+            self.condition.notify_all()
+
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+    def __iter__(self):
+        for index, page_number in enumerate(self.pages):
+            with self.condition:
+                self.condition.wait_for(lambda: self.closed or index < self.released)
+                if self.closed:
+                    return
+            yield page_number
+
+
+class SourceRun:
+    """One scrape of one source: its state, and its pipeline's stage functions
+
+    :param source: the source to scrape
+    :type source: Source
+    :param pages: page numbers to scrape, defaults to all of the source's pages
+    :type pages: iterable of int
+    :param on_page: called as on_page(page_number, counts) after each page is written or skipped
+    :type on_page: callable
+    :param on_page_failed: called as on_page_failed(page_number) for each page that couldn't be fetched
+    :type on_page_failed: callable
+    :param backfill: walk every page, ignoring the watermark and the page cache
+    :type backfill: bool
+    :param use_cache: skip pages that are unchanged since they were last fetched
+    :type use_cache: bool
+    :param parse_processes: processes to parse pages in, 0 to parse in a thread of this process.
+        Defaults to PARSE_PROCESSES for a backfill, otherwise 0 - a few pages aren't worth starting processes for.
+    :type parse_processes: int
+    :param archive: keep every page fetched in the page archive, if settings.PAGE_ARCHIVE_DIR is set
+    :type archive: bool
+    :param db_lock: shared with the other runs, when several run side by side on one connection
+    :type db_lock: threading.Lock
+    """
+
+    def __init__(self, source, pages=None, on_page=None, on_page_failed=None, backfill=False, use_cache=True, parse_processes=None, archive=True, 
+                 db_lock=None):
+        if pages is None:
+            pages = range(source.pages)
+        pages = sorted(pages)
+        self.source = source
+        self.urls = {page_number: source.page_url(page_number) for page_number in pages}
+        self.on_page = on_page
+        self.on_page_failed = on_page_failed
+        self.cache = PageCache(self.urls.values()) if use_cache and not backfill else None
+        self.request_headers = self.cache.request_headers() if self.cache else {}
+        self.watermark = None if backfill else load_watermark(source.name)
+        self.writer = ShowWriter(city=source.city, state=source.state)
+        self.session = make_session(source.concurrency)
+        self.rate_limiter = RateLimiter(source.requests_per_second)
+        self.archive = PageArchive() if archive and settings.PAGE_ARCHIVE_DIR else None
+        self.db_lock = db_lock or threading.Lock()
+        if parse_processes is None:
+            parse_processes = PARSE_PROCESSES if backfill else 0
+        self.parse_processes = parse_processes
+        self.parse_pool = None
+        self.failed_lock = threading.Lock()
+        self.pages_skipped = 0
+        self.pages_failed = 0
+        self.stopped_early = False
+        self.newest = None  # ((show_date, -page_number, -position), record) of the newest show seen
+        self.totals = {'pages_fetched': 0, 'bytes_fetched': 0, 'fetch_seconds': 0.0, 'parse_seconds': 0.0, 'db_seconds': 0.0}
+
+        # Before there's a watermark every page is wanted
+        self.gate = PageGate(pages, released=1 if self.watermark else len(pages))
+        self.pipeline = Pipeline(db_lock=self.db_lock)
+        self.pipeline.add_stage('fetch', self.fetch, workers=source.concurrency)
+        # With a process pool, each parse thread just waits on one page's worker process
+        self.pipeline.add_stage('parse', self.parse, workers=max(parse_processes, 1))
+        self.pipeline.add_stage('resolve', self.resolve, uses_db=True)
+        self.pipeline.add_stage('write', self.write, uses_db=True)
+        self.pipeline.on_stop(self.gate.close)
+
+
+    def run(self):
+        try:
+            if self.parse_processes:
+                # spawn, not fork: the pipeline's threads may be holding locks when a worker starts
+                with ProcessPoolExecutor(self.parse_processes, mp_context=multiprocessing.get_context('spawn'), 
+                                         initializer=django.setup) as self.parse_pool:
+                    self.pipeline.run(self.gate)
+            else:
+                self.pipeline.run(self.gate)
+        finally:
+            self.parse_pool = None
+            self.session.close()
+
+        # Only move the watermark past pages that were all read, otherwise a failed page would never be retried
+        if self.newest and not self.pages_failed:
+            with self.db_lock:
+                advance_watermark(self.source.name, self.newest[1])
+
+        stages = self.pipeline.stats()
+        for stage in stages:
+            logger.info('%s %s stage', self.source, stage['stage'], extra={'ingest': dict(stage, source=self.source.name)})
+        return dict(self.writer.counts, **self.totals, pages_skipped=self.pages_skipped, stopped_early=self.stopped_early, stages=stages)
+
+
+    def fetch(self, page_number):
+        page = ListingPage(page_number, self.urls[page_number])
+        self.rate_limiter.wait()
+        start = time.perf_counter()
+        page.response = fetch_page(self.session, page.url, self.request_headers.get(page.url))
+        page.timings['fetch_seconds'] = time.perf_counter() - start
+        yield page
+
+
+    def parse(self, page):
+        if page.response is None:
+            with self.failed_lock:
+                self.pages_failed += 1
+            logger.warning('%s failed', page.url, extra={'ingest': self.page_fields(page)})
+            self.gate.release(1)  # try the next page instead
+            yield page  # on to write, to be recorded as failed
+            return
+
+        if self.archive and page.response.status_code == 200:
+            page.content_hash = self.archive.put(page.response.content)
+
+        start = time.perf_counter()
+        if self.cache and self.cache.is_unchanged(page.url, page.response):
+            page.unchanged = True
+        else:
+            page.records = self.parse_content(page.response.content)
+        page.timings['parse_seconds'] = time.perf_counter() - start
+
+        if self.watermark and (page.unchanged or reached(self.watermark, page.records)):
+            # An unchanged page means nothing new has pushed its shows along, so nothing is new after it either
+            self.stopped_early = True
+            self.pipeline.stop()
+        else:
+            self.gate.release(2)
+        yield page
+
+
+    def parse_content(self, content):
+        if self.parse_pool:
+            return self.parse_pool.submit(parse_in_process, self.source, content).result()
+        return self.source.parse(content)
+
+
+    def resolve(self, page):
+        if page.response is None:
+            yield page
+            return
+        start = time.perf_counter()
+        if not page.unchanged:
+            page.shows, page.counts = self.writer.resolve(page.records)
+        page.timings['db_seconds'] += time.perf_counter() - start
+        yield page
+
+
+    def write(self, page):
+        if page.response is None:
+            if self.on_page_failed:
+                self.on_page_failed(page.number)
+            return ()
+        start = time.perf_counter()
+        if page.unchanged:
+            self.pages_skipped += 1
+            page.counts = {'pages_skipped': 1}
+            if page.response.status_code == 200:
+                self.cache.store(page.url, page.response)  # same body, maybe new validators
+        else:
+            page.counts.update(self.writer.write_shows(page.shows))
+            if self.cache:
+                self.cache.store(page.url, page.response)
+        if page.content_hash:
+            self.archive.record(self.source.name, page.url, page.content_hash, len(page.response.content))
+        page.timings['db_seconds'] += time.perf_counter() - start
+
+        page.counts.update(page.timings, pages_fetched=1, bytes_fetched=len(page.response.content))
+        for name in self.totals:
+            self.totals[name] += page.counts[name]
+
+        for position, record in enumerate(page.records):
+            key = (record.show_date, -page.number, -position)
+            if self.newest is None or key > self.newest[0]:
+                self.newest = (key, record)
+
+        logger.info('%s %s', page.url, 'unchanged' if page.unchanged else 'written', 
+                    extra={'ingest': dict(self.page_fields(page), **page.counts)})
+        if self.on_page:
+            self.on_page(page.number, page.counts)
+        return ()
+
+
+    def page_fields(self, page):
+        """ What every log line about a page carries """
+        return {'source': self.source.name, 'page': page.number, 'url': page.url, 
+                'status': page.response.status_code if page.response is not None else None}
+
+
+def parse_in_process(source, content):
+    """ Runs in a parse worker process. The source is pickled over, so it must be an instance of a module-level class. """
+    return source.parse(content)
@@ -0,0 +1,105 @@
+"""Sources of show listings.
+
+A source is a Source subclass that knows how to build its listing page
+urls and parse one page's HTML into ShowRecords. Everything else - fetching,
+rate limiting, caching, watermarks, writing - is shared, see run.py.
+
+iCal feeds are read from their events (see structured.py), so a source whose
+url_template points at an iCal feed needs no parser of its own. Pages with
+schema.org Event JSON-LD are read from it, plus any shows in the HTML that
+the JSON-LD leaves out.
+
+To add a source, subclass Source in a module, decorate it with @register,
+and add the module to SOURCE_MODULES.
+"""
+import importlib
+
+from lmn.ingest.structured import is_ical, parse_structured
+
+
+SOURCE_MODULES = ['lmn.scraping']
+
+SOURCES = {}
+
+
+def register(source_class):
+    """Class decorator adding a Source to SOURCES, under its name"""
+    SOURCES[source_class.name] = source_class
+    return source_class
+
+
+def load_sources(names=None, **overrides):
+    """An instance of every registered source, or of the ones named
+
+    :param names: source names, default all
+    :type names: list of str
+    :param overrides: attributes to set on every instance, such as url_template for testing
+    :raises KeyError: for a name that isn't registered
+    :rtype: list of Source
+    """
+    for module in SOURCE_MODULES:
+        importlib.import_module(module)
+    return [SOURCES[name](**overrides) for name in (names or sorted(SOURCES))]
+
+
+class Source:
+    """One site's show listings. Listing pages must be in newest-first order, for the watermark.
+
+    Any attribute can be overridden for one instance by passing it to the constructor.
+    """
+
+    name = None                  # unique, used as the watermark key
+    url_template = None          # listing page url, with a {page_number} placeholder
+    pages = 1                    # listing pages to walk on a full run
+    city = 'Minneapolis'         # for venues created from this source
+    state = 'MN'
+    requests_per_second = 1.0    # politeness limit for this site, None for no limit
+    concurrency = 2              # requests in flight at once for this site
+
+    def __init__(self, **overrides):
+        for attribute, value in overrides.items():
+            if not hasattr(self, attribute):
+                raise AttributeError(f'{type(self).__name__} has no attribute {attribute}')
+            setattr(self, attribute, value)
+
+
+    def page_url(self, page_number):
+        return self.url_template.format(page_number=page_number)
+
+
+    def parse(self, content):
+        """Parse one listing page, from its structured data if it has any, otherwise its HTML.
+
+        A page's JSON-LD can list only some of its events (a featured show, say), so the shows
+        in its HTML that the JSON-LD doesn't have are added after the JSON-LD's, in page order.
+
+        :param content: the page's html, or an iCal feed
+        :type content: bytes
+        :rtype: list of ShowRecord
+        """
+        records = parse_structured(content)
+        if records is None:
+            return self.parse_html(content)
+        if is_ical(content):
+            return records
+
+        seen = set(records)
+        for record in self.parse_html(content):
+            if record not in seen:
+                seen.add(record)
+                records.append(record)
+        return records
+
+
+    def parse_html(self, content):
+        """Parse one listing page's HTML
+
+        :param content: the page's html
+        :type content: bytes
+        :rtype: list of ShowRecord
+        """
+        raise NotImplementedError
+
+
+    def __str__(self):
+        return self.name
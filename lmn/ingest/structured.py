@@ -0,0 +1,169 @@
+"""Read shows from structured data - schema.org Event JSON-LD embedded in a page, or an iCal feed -
+instead of walking the page's HTML.
+
+Both carry the artist, venue and start time as data, so they're much cheaper to read than the
+markup and don't break when a site's CSS classes change. parse_structured returns None for content
+that has neither, and Source.parse falls back to the source's HTML parser. A page's JSON-LD may only
+cover some of its events, so Source.parse adds the shows from the page's HTML to it (see is_ical).
+
+Start times with a UTC offset are converted to local time (settings.TIME_ZONE) before the date is
+taken, so a late show isn't filed under the next day.
+"""
+import datetime
+import json
+import re
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from lmn.ingest.records import ShowRecord
+
+
+EVENT_TYPES = {'Event', 'MusicEvent'}
+
+JSON_LD_RE = re.compile(rb'<script[^>]*type\s*=\s*["\']application/ld\+json["\'][^>]*>(.*?)</script>', re.DOTALL | re.IGNORECASE)
+ICAL_DATE_RE = re.compile(r'^(\d{4})(\d{2})(\d{2})(?:T(\d{2})(\d{2})(\d{2})(Z)?)?$')
+ICAL_FIRST_VALUE_RE = re.compile(r'(?:[^\\,]|\\.)*')  # up to the first comma that isn't escaped
+
+
+def parse_structured(content):
+    """Shows from structured data in content, if there is any
+
+    :param content: a listing page, or an iCal feed
+    :type content: bytes
+    :returns: the shows, or None if content has no structured events
+    :rtype: list of ShowRecord
+    """
+    if is_ical(content):
+        return parse_ical(content) or None
+    if b'application/ld+json' in content:
+        return parse_json_ld(content) or None
+    return None
+
+
+def is_ical(content):
+    """ True for an iCal feed, which has no HTML to read shows from """
+    return content.lstrip()[:15].upper() == b'BEGIN:VCALENDAR'
+
+
+def parse_json_ld(content):
+    """ Shows from the schema.org Events in a page's JSON-LD script elements. The rest of the page isn't parsed. """
+    records = []
+    for script in JSON_LD_RE.findall(content):
+        try:
+            data = json.loads(script)
+        except ValueError:
+            continue  # one broken block shouldn't hide the others
+        for item in _json_ld_items(data):
+            record = _event_record(item)
+            if record:
+                records.append(record)
+    return records
+
+
+def _json_ld_items(data):
+    """ Every object in a JSON-LD document: a single object, a list of them, or an @graph """
+    if isinstance(data, list):
+        for item in data:
+            yield from _json_ld_items(item)
+    elif isinstance(data, dict):
+        if '@graph' in data:
+            yield from _json_ld_items(data['@graph'])
+        else:
+            yield data
+
+
+def _event_record(item):
+    types = item.get('@type')
+    types = set(types) if isinstance(types, list) else {types}
+    if not types & EVENT_TYPES:
+        return None
+
+    performer = _first(item.get('performer'))
+    artist = performer.get('name') if isinstance(performer, dict) else performer
+    location = _first(item.get('location'))
+    venue = location.get('name') if isinstance(location, dict) else location
+    show_date = _local_date(item.get('startDate'))
+
+    artist = artist or item.get('name')
+    if not (artist and venue and show_date):
+        return None
+    return ShowRecord(artist=artist.strip(), venue=venue.strip(), show_date=show_date)
+
+
+def _first(value):
+    return value[0] if isinstance(value, list) and value else value
+
+
+def _local_date(value):
+    """ The local date of an ISO 8601 date or date-time, or None if it isn't one """
+    if not isinstance(value, str):
+        return None
+    try:
+        # Not datetime.fromisoformat, which doesn't take a Z before Python 3.11
+        moment = parse_datetime(value.strip())
+        if moment is None:
+            return parse_date(value.strip())
+    except ValueError:
+        return None
+    if timezone.is_aware(moment):
+        moment = timezone.localtime(moment)
+    return moment.date()
+
+
+def parse_ical(content):
+    """ Shows from the VEVENTs of an iCal feed: SUMMARY is the artist, LOCATION up to its first unescaped comma is the venue """
+    records = []
+    event = None
+    for line in _ical_lines(content.decode('utf-8', errors='replace')):
+        name, _, value = line.partition(':')
+        name = name.partition(';')[0].upper()  # drop parameters, like DTSTART;TZID=...
+        if name == 'BEGIN' and value.upper() == 'VEVENT':
+            event = {}
+        elif name == 'END' and value.upper() == 'VEVENT' and event is not None:
+            record = _ical_record(event)
+            if record:
+                records.append(record)
+            event = None
+        elif event is not None and name in ('SUMMARY', 'LOCATION', 'DTSTART'):
+            event[name] = value
+    return records
+
+
+def _ical_lines(text):
+    """ Content lines, with folded lines (continuations starting with a space or tab) joined back up """
+    lines = []
+    for line in text.splitlines():
+        if line[:1] in (' ', '\t') and lines:
+            lines[-1] += line[1:]
+        elif line:
+            lines.append(line)
+    return lines
+
+
+def _ical_record(event):
+    if not all(name in event for name in ('SUMMARY', 'LOCATION', 'DTSTART')):
+        return None
+    artist = _ical_text(event['SUMMARY'])
+    # The venue name, without its address. Split before unescaping, so a comma escaped in the name stays in it.
+    venue = _ical_text(ICAL_FIRST_VALUE_RE.match(event['LOCATION']).group())
+    show_date = _ical_date(event['DTSTART'])
+    if not (artist and venue and show_date):
+        return None
+    return ShowRecord(artist=artist, venue=venue, show_date=show_date)
+
+
+def _ical_text(value):
+    return value.replace('\\n', ' ').replace('\\N', ' ').replace('\\,', ',').replace('\\;', ';').replace('\\\\', '\\').strip()
+
+
+def _ical_date(value):
+    """ DTSTART as a local date. UTC times (ending in Z) are converted; floating and TZID times are taken as written. """
+    match = ICAL_DATE_RE.match(value.strip())
+    if not match:
+        return None
+    year, month, day, hour, minute, second, utc = match.groups()
+    if utc:
+        moment = datetime.datetime(int(year), int(month), int(day), int(hour), int(minute), int(second), tzinfo=datetime.timezone.utc)
+        return timezone.localtime(moment).date()
+    return datetime.date(int(year), int(month), int(day))
@@ -0,0 +1,43 @@
+"""High-water marks, so a steady-state run stops paging once it reaches shows it has already ingested.
+
+Listing pages are newest first. Once a page holds the watermark show, or
+anything older, every later page is older still.
+"""
+from lmn.models import IngestWatermark
+
+
+def load_watermark(source):
+    return IngestWatermark.objects.filter(source=source).first()
+
+
+def reached(watermark, records):
+    """True if records include the watermark show or anything older than it
+
+    :param watermark: the source's watermark, may be None
+    :type watermark: IngestWatermark
+    :param records: shows from one page
+    :type records: list of ShowRecord
+    """
+    if watermark is None:
+        return False
+    for record in records:
+        if record.show_date < watermark.show_date:
+            return True
+        if (record.show_date, record.artist, record.venue) == (watermark.show_date, watermark.artist, watermark.venue):
+            return True
+    return False
+
+
+def advance_watermark(source, record):
+    """Move the source's watermark up to record, if record is newer than it"""
+    watermark = load_watermark(source)
+    if watermark is None:
+        watermark = IngestWatermark(source=source)
+    elif watermark.show_date >= record.show_date:
+        return watermark
+
+    watermark.show_date = record.show_date
+    watermark.artist = record.artist
+    watermark.venue = record.venue
+    watermark.save()
+    return watermark
@@ -0,0 +1,167 @@
+"""Batched, set-based writes of scraped shows.
+
+Each batch of records costs a fixed number of queries however many rows it
+holds: names already seen in this run are resolved from memory, the rest are
+looked up with one IN query per model, missing rows are inserted with one
+bulk insert that ignores conflicts, and foreign keys are resolved by name_key
+(see lmn.models.name_key) through its unique index - never by substring, so
+'REM' can't match 'Remi Wolf', and 'The Replacements' matches 'Replacements'.
+"""
+import datetime
+
+from django.db import transaction
+from django.utils import timezone
+
+from lmn.models import Artist, Venue, Show, name_key
+
+
+DEFAULT_CITY = 'Minneapolis'
+DEFAULT_STATE = 'MN'
+
+
+class ShowWriter:
+    """Writes batches of ShowRecords, remembering the artists, venues and shows it has already
+    resolved so a run never asks the database about the same name twice.
+
+    write() does a whole batch. It's also split into resolve() and write_shows(), which can run
+    in different pipeline stages - resolve() only touches the name maps and write_shows() only
+    touches seen_shows, so one thread can run each.
+
+    Running totals are kept in self.counts.
+
+    :param city: city of the venues it creates
+    :type city: str
+    :param state: state of the venues it creates
+    :type state: str
+    """
+
+    def __init__(self, city=DEFAULT_CITY, state=DEFAULT_STATE):
+        self.city = city
+        self.state = state
+        self.keys = {}  # name to name_key
+        self.artist_ids = {}  # name_key to id
+        self.venue_ids = {}
+        self.seen_shows = set()
+        self.counts = {
+            'artists_inserted': 0,
+            'artists_skipped': 0,
+            'venues_inserted': 0,
+            'venues_skipped': 0,
+            'shows_inserted': 0,
+            'shows_skipped': 0,
+        }
+
+
+    def write(self, records):
+        """Insert the artists, venues and shows in records that aren't in the database yet
+
+        :param records: parsed shows, duplicates are fine
+        :type records: iterable of ShowRecord
+        :returns: counts for this batch
+        :rtype: dict
+        """
+        shows, counts = self.resolve(records)
+        counts.update(self.write_shows(shows))
+        return counts
+
+
+    def resolve(self, records):
+        """First half of write: insert missing artists and venues, and swap names for ids
+
+        :param records: parsed shows, duplicates are fine
+        :type records: iterable of ShowRecord
+        :returns: the distinct (artist_id, venue_id, show_datetime) of the records, and counts for this batch
+        :rtype: tuple(list, dict)
+        """
+        records = list(dict.fromkeys(records))  # de-duplicate, keeping page order
+        counts = {}
+
+        with transaction.atomic():
+            counts['artists_inserted'], counts['artists_skipped'] = self._resolve_names(
+                Artist, self.artist_ids, [record.artist for record in records], lambda name: Artist(name=name))
+            counts['venues_inserted'], counts['venues_skipped'] = self._resolve_names(
+                Venue, self.venue_ids, [record.venue for record in records], 
+                lambda name: Venue(name=name, city=self.city, state=self.state))
+
+        shows = [(self.artist_ids[self.key(record.artist)], self.venue_ids[self.key(record.venue)], show_datetime(record.show_date)) 
+                 for record in records]
+        self._add_counts(counts)
+        return list(dict.fromkeys(shows)), counts
+
+
+    def write_shows(self, shows):
+        """Second half of write: insert the shows that aren't in the database yet
+
+        :param shows: (artist_id, venue_id, show_datetime) from resolve
+        :type shows: list of tuple
+        :returns: counts for this batch
+        :rtype: dict
+        """
+        to_check = set(shows) - self.seen_shows
+        new_shows = to_check - self._existing_shows(to_check)
+        if new_shows:
+            Show.objects.bulk_create(
+                [Show(artist_id=artist_id, venue_id=venue_id, show_date=show_date) for artist_id, venue_id, show_date in new_shows],
+                ignore_conflicts=True)
+        self.seen_shows |= to_check
+
+        counts = {'shows_inserted': len(new_shows), 'shows_skipped': len(shows) - len(new_shows)}
+        self._add_counts(counts)
+        return counts
+
+
+    def _add_counts(self, counts):
+        for name, count in counts.items():
+            self.counts[name] += count
+
+
+    def key(self, name):
+        if name not in self.keys:
+            self.keys[name] = name_key(name)
+        return self.keys[name]
+
+
+    def _resolve_names(self, model, ids_by_key, names, make_instance):
+        """Fill in ids_by_key for the name_key of every name in names, inserting rows for the ones that don't exist. 
+        Returns the number of rows inserted, and the number of names new to this run that were already in the database."""
+        missing = {}  # name_key to the first spelling of it seen, which is the one inserted
+        for name in names:
+            key = self.key(name)
+            if key not in ids_by_key:
+                missing.setdefault(key, name)
+        if not missing:
+            return 0, 0
+
+        ids_by_key.update(model.objects.filter(name_key__in=missing.keys()).values_list('name_key', 'id'))
+        to_insert = {key: name for key, name in missing.items() if key not in ids_by_key}
+        skipped = len(missing) - len(to_insert)
+        if not to_insert:
+            return 0, skipped
+
+        # ignore_conflicts covers a row inserted by someone else since the lookup above; 
+        # it doesn't return ids, so fetch them afterwards. bulk_create doesn't send pre_save, so name_key is set here.
+        instances = [make_instance(name) for name in to_insert.values()]
+        for instance in instances:
+            instance.name_key = self.key(instance.name)
+        model.objects.bulk_create(instances, ignore_conflicts=True)
+        ids_by_key.update(model.objects.filter(name_key__in=to_insert.keys()).values_list('name_key', 'id'))
+
+        # A name can clash with an older row left without a key (see migration 0009), match those by exact name
+        unmatched = {name: key for key, name in to_insert.items() if key not in ids_by_key}
+        for name, row_id in model.objects.filter(name__in=unmatched.keys()).values_list('name', 'id'):
+            ids_by_key[unmatched[name]] = row_id
+        return len(to_insert), skipped
+
+
+    def _existing_shows(self, shows):
+        if not shows:
+            return set()
+        artist_ids = {artist_id for artist_id, venue_id, show_date in shows}
+        show_dates = {show_date for artist_id, venue_id, show_date in shows}
+        existing = Show.objects.filter(artist_id__in=artist_ids, show_date__in=show_dates).values_list('artist_id', 'venue_id', 'show_date')
+        return set(existing) & shows
+
+
+def show_datetime(show_date):
+    """Shows are stored as midnight, local time, on the day of the show"""
+    return timezone.make_aware(datetime.datetime.combine(show_date, datetime.time.min))
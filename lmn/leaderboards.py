@@ -0,0 +1,22 @@
+"""Top-N lists of shows and users, read from the counts stored on Show and Profile 
+(see count_note and count_rating in lmn.models) instead of counting notes and ratings on every view.
+"""
+from .models import Show, Profile, PRIOR_RATINGS
+
+
+BOARD_SIZE = 10
+
+
+def most_noted_shows(count=BOARD_SIZE):
+    """ Shows with the most notes - a range scan of the note_count index """
+    return Show.objects.filter(note_count__gt=0).select_related('artist', 'venue').order_by('-note_count')[:count]
+
+
+def top_rated_shows(count=BOARD_SIZE):
+    """ Rated shows with the highest Bayesian average rating (see rating_score in lmn.models) - a range scan of the rating_score index """
+    return Show.objects.filter(rating_count__gt=0).select_related('artist', 'venue').order_by('-rating_score', '-rating_count')[:count]
+
+
+def most_active_users(count=BOARD_SIZE):
+    """ Profiles of the users who have written the most notes - a range scan of the note_count index """
+    return Profile.objects.filter(note_count__gt=0).select_related('user').order_by('-note_count')[:count]
@@ -0,0 +1,96 @@
+import multiprocessing
+import os
+import resource
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from lmn import scraping
+from lmn.ingest.replay import load_recorded_pages, with_json_ld
+from lmn.ingest.structured import parse_structured
+
+
+def current_rss_kb():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * resource.getpagesize() // 1024
+
+
+def measure(parser, pages, repeat, results):
+    """ Runs in a forked child, so each parser's peak memory is measured on its own """
+    rss_before = current_rss_kb()
+    start = time.perf_counter()
+    items = 0
+    for _ in range(repeat):
+        for content in pages:
+            items += len(scraping.parse_page(content, parser))
+    elapsed = time.perf_counter() - start
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before
+    results.put((items, elapsed, peak_kb))
+
+
+def parse_with_pool(processes, parser, pages):
+    """ Pages per second parsing pages in a pool of processes, the way a backfill does. Starting the pool isn't timed. """
+    with ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context('spawn')) as pool:
+        list(pool.map(scraping.parse_page, pages[:processes], [parser] * processes))  # start every worker
+        start = time.perf_counter()
+        items = sum(len(records) for records in pool.map(scraping.parse_page, pages, [parser] * len(pages), chunksize=4))
+        return items, time.perf_counter() - start
+
+
+class Command(BaseCommand):
+    help = ('Compare the listing page parsers on the recorded First Avenue pages: items per second and peak memory, '
+            'parse cost per event from JSON-LD against HTML, and how parsing scales with worker processes')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=20, help='Times to parse every recorded page')
+        parser.add_argument('--parser', action='append', choices=list(scraping.PARSERS), help='Parser to run, default all of them')
+        parser.add_argument('--processes', type=int, default=os.cpu_count() or 1, help='Largest process pool to time parsing with')
+
+
+    def handle(self, *args, **options):
+        pages = [content for page_number, content in load_recorded_pages()]
+
+        context = multiprocessing.get_context('fork')
+        self.stdout.write(f'{len(pages)} pages x {options["repeat"]}, default parser is {scraping.DEFAULT_PARSER}')
+        self.stdout.write(f'{"parser":<15}{"items/s":>12}{"ms/page":>10}{"peak KB":>10}')
+
+        for parser in options['parser'] or scraping.PARSERS:
+            results = context.Queue()
+            child = context.Process(target=measure, args=(parser, pages, options['repeat'], results))
+            child.start()
+            items, elapsed, peak_kb = results.get()
+            child.join()
+
+            ms_per_page = elapsed * 1000 / (len(pages) * options['repeat'])
+            self.stdout.write(f'{parser:<15}{items / elapsed:>12.0f}{ms_per_page:>10.2f}{peak_kb:>10}')
+
+        # The same pages with their shows as JSON-LD too, read both ways
+        structured_pages = [with_json_ld(content, scraping.parse_page(content)) for content in pages]
+        self.stdout.write(f'\nPages with JSON-LD, {len(structured_pages)} pages x {options["repeat"]}')
+        self.stdout.write(f'{"path":<15}{"events/s":>12}{"us/event":>10}')
+        for path, parse in [('json-ld', parse_structured), (f'html ({scraping.DEFAULT_PARSER})', scraping.parse_page)]:
+            events = 0
+            start = time.perf_counter()
+            for _ in range(options['repeat']):
+                for content in structured_pages:
+                    events += len(parse(content))
+            elapsed = time.perf_counter() - start
+            self.stdout.write(f'{path:<15}{events / elapsed:>12.0f}{elapsed * 1e6 / events:>10.1f}')
+
+        # Backfills parse in a process pool. Throughput should grow with the pool until it runs out of cores.
+        corpus = pages * options['repeat']
+        self.stdout.write(f'\n{scraping.DEFAULT_PARSER} in a process pool, {len(corpus)} pages, {os.cpu_count()} cores')
+        self.stdout.write(f'{"processes":<15}{"pages/s":>12}{"speedup":>10}')
+        pool_sizes = [1]
+        while pool_sizes[-1] * 2 < options['processes']:
+            pool_sizes.append(pool_sizes[-1] * 2)
+        if options['processes'] > 1:
+            pool_sizes.append(options['processes'])
+
+        single = None
+        for processes in pool_sizes:
+            items, elapsed = parse_with_pool(processes, scraping.DEFAULT_PARSER, corpus)
+            pages_per_second = len(corpus) / elapsed
+            single = single or pages_per_second
+            self.stdout.write(f'{processes:<15}{pages_per_second:>12.0f}{pages_per_second / single:>10.2f}')
@@ -0,0 +1,121 @@
+import datetime
+import random
+import time
+
+import requests
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from lmn import scraping
+from lmn.models import Artist, Venue, Show
+from lmn.ingest.fetch import fetch_pages, DEFAULT_CONCURRENCY
+from lmn.ingest.replay import ReplayServer, load_recorded_pages
+from lmn.ingest.writer import ShowWriter, show_datetime
+
+
+class Command(BaseCommand):
+    help = '''Benchmark the scraper offline against the recorded First Avenue pages. Reports fetch time 
+    (from a local stub server, one page at a time vs. concurrently), parse time, and DB write time 
+    and queries per inserted show on an empty, a populated and an already-ingested database. 
+    Writes go to a throwaway test database, never the real one.'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--latency', type=float, default=0.2, help='Seconds the stub server waits before answering each page')
+        parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY, help='Pages in flight at once for the concurrent fetch')
+        parser.add_argument('--parser', choices=list(scraping.PARSERS), default=scraping.DEFAULT_PARSER)
+        parser.add_argument('--seed-shows', type=int, default=10000, help='Shows already in the populated database')
+
+
+    def handle(self, *args, **options):
+        pages = load_recorded_pages()
+        self.stdout.write(f'{len(pages)} recorded pages, {options["latency"]}s latency per page')
+
+        self.bench_fetch(pages, options['latency'], options['concurrency'])
+
+        start = time.perf_counter()
+        records = [scraping.parse_page(content, options['parser']) for page_number, content in pages]
+        parse_time = time.perf_counter() - start
+        self.stdout.write(f'parse ({options["parser"]}):      {parse_time:.3f}s  {sum(map(len, records))} shows')
+
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self.stdout.write(f'{"write":<30}{"seconds":>10}{"queries":>10}{"inserted":>10}{"queries/show":>14}')
+            self.bench_write('empty database', records)
+            self.bench_write('re-ingest, all rows present', records)
+
+            self.clear()
+            self.seed(options['seed_shows'])
+            self.bench_write(f'populated, {options["seed_shows"]} shows', records)
+
+            self.clear()
+            self.bench_pipeline(options['latency'], options['concurrency'], options['parser'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+    def bench_fetch(self, pages, latency, concurrency):
+        with ReplayServer(latency=latency) as server:
+            urls = [server.url_template.format(page_number=page_number) for page_number, content in pages]
+
+            # What scrape_first used to do - a new connection for each page, one page at a time
+            start = time.perf_counter()
+            for url in urls:
+                requests.get(url).content
+            sequential = time.perf_counter() - start
+
+            start = time.perf_counter()
+            for url, response in fetch_pages(urls, concurrency=concurrency):
+                response.content
+            concurrent = time.perf_counter() - start
+
+        self.stdout.write(f'fetch, sequential:  {sequential:.3f}s')
+        self.stdout.write(f'fetch, concurrent:  {concurrent:.3f}s  (limit {concurrency}, {sequential / concurrent:.1f}x faster)')
+
+
+    def bench_write(self, label, records):
+        writer = ShowWriter()
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            for page_records in records:
+                writer.write(page_records)
+            elapsed = time.perf_counter() - start
+
+        inserted = writer.counts['shows_inserted']
+        per_show = f'{len(queries) / inserted:.2f}' if inserted else '-'
+        self.stdout.write(f'{label:<30}{elapsed:>10.3f}{len(queries):>10}{inserted:>10}{per_show:>14}')
+
+
+    def bench_pipeline(self, latency, concurrency, parser):
+        """ The whole scrape, with fetch, parse, resolve and write overlapping """
+        with ReplayServer(latency=latency) as server:
+            start = time.perf_counter()
+            result = scraping.scrape_first(concurrency=concurrency, url_template=server.url_template, parser=parser, use_cache=False,
+                                            requests_per_second=None, archive=False)
+            elapsed = time.perf_counter() - start
+
+        self.stdout.write(f'pipelined scrape, empty database: {elapsed:.3f}s, {result["shows_inserted"]} shows inserted')
+        self.stdout.write(f'{"stage":<10}{"workers":>8}{"items":>8}{"busy s":>10}{"items/s":>10}{"max queue":>11}{"avg queue":>11}')
+        for stage in result['stages']:
+            self.stdout.write(f'{stage["stage"]:<10}{stage["workers"]:>8}{stage["items_in"]:>8}{stage["busy_seconds"]:>10.3f}'
+                              f'{stage["per_second"]:>10}{stage["max_queue_depth"]:>11}{stage["avg_queue_depth"]:>11}')
+
+
+    def clear(self):
+        Show.objects.all().delete()
+        Artist.objects.all().delete()
+        Venue.objects.all().delete()
+
+
+    def seed(self, show_count):
+        """ Unrelated artists, venues and shows, so lookups run against tables of a realistic size """
+        random.seed(0)
+        Artist.objects.bulk_create([Artist(name=f'Seed Artist {n}', name_key=f'seed artist {n}') for n in range(show_count // 4)])
+        Venue.objects.bulk_create([Venue(name=f'Seed Venue {n}', name_key=f'seed venue {n}', city='Minneapolis', state='MN') for n in range(50)])
+        artist_ids = list(Artist.objects.values_list('id', flat=True))
+        venue_ids = list(Venue.objects.values_list('id', flat=True))
+        first_day = datetime.date(2000, 1, 1)
+        shows = {(random.choice(artist_ids), random.choice(venue_ids), first_day + datetime.timedelta(days=random.randrange(7000)))
+                 for n in range(show_count)}
+        Show.objects.bulk_create([Show(artist_id=artist_id, venue_id=venue_id, show_date=show_datetime(show_date)) 
+                                  for artist_id, venue_id, show_date in shows], batch_size=1000)
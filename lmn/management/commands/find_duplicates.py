@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from lmn.ingest.dedupe import find_duplicates, DEFAULT_THRESHOLD, DEFAULT_MAX_BLOCK
+from lmn.models import DuplicateCandidate
+
+
+class Command(BaseCommand):
+    help = '''Find artists and venues that are probably the same one spelled differently, and save the pairs 
+    with their similarity score for review in the admin site (Duplicate candidates). Nothing is merged.'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kind', choices=[DuplicateCandidate.ARTIST, DuplicateCandidate.VENUE], action='append',
+                            help='Artists or venues, default both')
+        parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help='Lowest similarity, 0 to 1, saved for review')
+        parser.add_argument('--max-block', type=int, default=DEFAULT_MAX_BLOCK, 
+                            help='Words in more names than this, like "band", aren\'t used to pair names up')
+
+
+    def handle(self, *args, **options):
+        for kind in options['kind'] or [DuplicateCandidate.ARTIST, DuplicateCandidate.VENUE]:
+            start = time.perf_counter()
+            counts = find_duplicates(kind, threshold=options['threshold'], max_block=options['max_block'])
+            elapsed = time.perf_counter() - start
+            self.stdout.write(f'{kind}s: {counts["rows"]} rows, {counts["pairs_compared"]} pairs compared in {elapsed:.2f}s, '
+                              f'{counts["candidates_saved"]} new candidates saved')
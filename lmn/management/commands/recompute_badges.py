@@ -0,0 +1,15 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from lmn.models import recompute_badges
+
+
+class Command(BaseCommand):
+    help = '''Recount every user's notes and give them every badge they've earned but don't have - after loading 
+    new badges, or notes added some way that skipped the usual awarding, like a bulk import.'''
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        awarded = recompute_badges()
+        self.stdout.write(f'{awarded} badges awarded in {time.perf_counter() - start:.2f}s')
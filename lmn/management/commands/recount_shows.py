@@ -0,0 +1,18 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from lmn.models import recount_ratings, recount_notes
+
+
+class Command(BaseCommand):
+    help = '''Recompute the rating totals, top rated scores and note counts stored on every show, and the note counts 
+    stored on every user's profile, from the ratings and notes themselves. They're kept up to date as ratings and notes 
+    are saved and deleted, so this is only needed after they're changed some other way, like a bulk update, or to 
+    rescore shows rated when the site average was different.'''
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        shows = recount_ratings()
+        shows, profiles = recount_notes()
+        self.stdout.write(f'Rating totals and note counts recounted for {shows} shows and {profiles} profiles in {time.perf_counter() - start:.2f}s')
@@ -0,0 +1,32 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from lmn.ingest.archive import reparse
+from lmn.ingest.sources import load_sources
+
+
+class Command(BaseCommand):
+    help = 'Parse the archived listing pages again with the current parsers, and add any shows missing from the database. Nothing is fetched.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', action='append', help='Source to reparse, default all of them')
+        parser.add_argument('--all-versions', action='store_true', help='Parse every archived fetch of each page, not just the latest')
+
+
+    def handle(self, *args, **options):
+        if not settings.PAGE_ARCHIVE_DIR:
+            raise CommandError('There is no page archive to reparse. Set PAGE_ARCHIVE_DIR to keep the pages the scraper fetches.')
+        try:
+            sources = load_sources(options['source'])
+        except KeyError as e:
+            raise CommandError(f'No source named {e}')
+
+        for source in sources:
+            start = time.perf_counter()
+            counts = reparse(source, latest_only=not options['all_versions'])
+            elapsed = time.perf_counter() - start
+            self.stdout.write(f'{source}: {counts["pages_parsed"]} pages in {elapsed:.2f}s, '
+                              f'{counts["shows_inserted"]} shows, {counts["artists_inserted"]} artists and '
+                              f'{counts["venues_inserted"]} venues added, {counts["shows_skipped"]} shows already there')
@@ -0,0 +1,54 @@
+import logging
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from lmn.models import ScrapeJob
+from lmn.ingest import jobs
+from lmn.ingest.locks import LockHeld
+
+
+class Command(BaseCommand):
+    help = 'Run the show scraper outside of the web app. Resumes an interrupted or queued job if there is one, otherwise starts a new one.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--job', type=int, help='Run (or resume) this job id')
+        parser.add_argument('--backfill', action='store_true', help='Walk every page, ignoring the watermark and page cache')
+        parser.add_argument('--worker', action='store_true', help='Keep running, picking up jobs queued by /scraper as they appear')
+        parser.add_argument('--poll-interval', type=int, default=30, help='Seconds between checks for new jobs in --worker mode')
+        parser.add_argument('--shard-size', type=int, help='Work on ranges of this many pages, alongside other workers started the same way. For spreading a backfill over several machines.')
+
+
+    def handle(self, *args, **options):
+        ingest_logger = logging.getLogger('lmn.ingest')
+        level = ingest_logger.level
+        ingest_logger.setLevel(settings.INGEST_LOG_LEVEL)
+        try:
+            self.scrape(options)
+        finally:
+            ingest_logger.setLevel(level)
+
+
+    def scrape(self, options):
+        if options['worker']:
+            self.stdout.write('Waiting for scrape jobs')
+            jobs.run_worker(poll_interval=options['poll_interval'], shard_size=options['shard_size'])
+            return
+
+        if options['job']:
+            job = ScrapeJob.objects.filter(pk=options['job']).first()
+            if job is None:
+                raise CommandError(f'No scrape job with id {options["job"]}')
+        else:
+            job = jobs.enqueue_scrape(backfill=options['backfill'])[0]
+
+        if job.status == ScrapeJob.RUNNING:
+            self.stdout.write(f'Resuming job {job.pk} after {job.pages_done} of {job.pages_total} pages')
+
+        try:
+            job = jobs.run_job(job, shard_size=options['shard_size'])
+        except LockHeld as e:
+            # Not an error - a retried cron call, say, while the first one is still going
+            self.stdout.write(f'Another scrape is running ({e}), exiting')
+            return
+        self.stdout.write(str(job))
@@ -0,0 +1,120 @@
+"""Catch pages that run the same query over and over, an N+1 (see lmn.query_stats).
+
+Every query a request runs is fingerprinted (see lmn.query_stats), and fingerprints run more than
+settings.NPLUSONE_THRESHOLD times are reported, each with the template line and the lmn code that ran it.
+settings.NPLUSONE_MODE says how:
+
+    'raise'   raise NPlusOneError, so the page fails - for development and tests
+    'banner'  add a banner listing them to the top of HTML pages - for development
+    'log'     log a warning to the lmn.nplusone logger - for staging
+    'off'     don't watch queries at all - for production
+"""
+import html
+import logging
+import os
+import re
+import sys
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from .query_stats import fingerprint
+
+
+logger = logging.getLogger('lmn.nplusone')
+
+MODES = ('raise', 'banner', 'log', 'off')
+BODY_RE = re.compile(rb'<body[^>]*>', re.IGNORECASE)
+LMN_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class NPlusOneError(Exception):
+    pass
+
+
+class QueryRecorder:
+    """A database execute wrapper that counts the queries run by fingerprint. Where a fingerprint is first repeated,
+    it notes where from - walking the stack is too slow to do for every query."""
+
+    def __init__(self):
+        self.counts = Counter()
+        self.origins = {}
+
+
+    def __call__(self, execute, sql, params, many, context):
+        key = fingerprint(sql)
+        self.counts[key] += 1
+        if self.counts[key] == 2:
+            self.origins[key] = query_origin(sys._getframe(1))
+        return execute(sql, params, many, context)
+
+
+    def repeated(self, threshold):
+        """ (fingerprint, times run, where from) of the queries run more than threshold times, most run first """
+        return [(sql, count, self.origins.get(sql, '')) for sql, count in self.counts.most_common() if count > threshold]
+
+
+def query_origin(frame):
+    """ The template line being rendered, and the innermost lmn code running, when frame ran a query """
+    template = code = None
+    while frame and not (template and code):
+        # Template nodes render through Node.render_annotated. The innermost one is the tag or variable that ran the query.
+        if template is None and frame.f_code.co_name == 'render_annotated':
+            node = frame.f_locals.get('self')
+            origin, token = getattr(node, 'origin', None), getattr(node, 'token', None)
+            if origin and token:
+                template = f'{origin.template_name or origin.name}, line {token.lineno}: {token.contents}'
+        filename = os.path.abspath(frame.f_code.co_filename)
+        if code is None and filename.startswith(LMN_DIR) and filename != os.path.abspath(__file__):
+            code = f'{os.path.relpath(filename, os.path.dirname(LMN_DIR))}:{frame.f_lineno} in {frame.f_code.co_name}'
+        frame = frame.f_back
+    return '; '.join(place for place in (template, code) if place)
+
+
+class NPlusOneMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.mode = getattr(settings, 'NPLUSONE_MODE', 'off')
+        self.threshold = getattr(settings, 'NPLUSONE_THRESHOLD', 5)
+        if self.mode not in MODES:
+            raise ValueError(f'NPLUSONE_MODE should be one of {", ".join(MODES)}, not {self.mode!r}')
+        if self.mode == 'off':
+            raise MiddlewareNotUsed()
+
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+
+        repeated = recorder.repeated(self.threshold)
+        if repeated:
+            report = '\n'.join(f'{count}x {sql}\n    from {origin or "unknown"}' for sql, count, origin in repeated)
+            if self.mode == 'raise':
+                raise NPlusOneError(f'{request.path} repeated queries more than {self.threshold} times:\n{report}')
+            elif self.mode == 'log':
+                logger.warning('%s repeated queries more than %s times:\n%s', request.path, self.threshold, report)
+            elif self.mode == 'banner':
+                self.add_banner(response, repeated)
+        return response
+
+
+    def add_banner(self, response, repeated):
+        if response.streaming or not response.get('Content-Type', '').startswith('text/html'):
+            return
+        items = ''.join(f'<li><code>{count}x {html.escape(sql)}</code><br>from {html.escape(origin or "unknown")}</li>' 
+                        for sql, count, origin in repeated)
+        banner = (f'<div id="nplusone-banner" style="background:#fdd;color:#000;padding:8px;font-size:13px">'
+                  f'<b>Queries repeated more than {self.threshold} times</b> - load them with select_related or prefetch_related<ul>{items}</ul></div>').encode()
+        content = response.content
+        body = BODY_RE.search(content)
+        position = body.end() if body else 0
+        response.content = content[:position] + banner + content[position:]
+        if response.has_header('Content-Length'):
+            response['Content-Length'] = str(len(response.content))
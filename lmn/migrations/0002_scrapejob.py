@@ -0,0 +1,30 @@
+# Generated by Django 3.1.7 on 2026-10-16 20:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lmn', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScrapeJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('finished', 'Finished'), ('failed', 'Failed')], default='queued', max_length=10)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('started', models.DateTimeField(blank=True, null=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('pages_total', models.PositiveIntegerField(default=0)),
+                ('pages_completed', models.JSONField(blank=True, default=list)),
+                ('artists_inserted', models.PositiveIntegerField(default=0)),
+                ('venues_inserted', models.PositiveIntegerField(default=0)),
+                ('shows_inserted', models.PositiveIntegerField(default=0)),
+                ('shows_skipped', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 3.1.7 on 2026-10-16 20:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lmn', '0002_scrapejob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PageCacheEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.CharField(max_length=500, unique=True)),
+                ('etag', models.CharField(blank=True, max_length=200)),
+                ('last_modified', models.CharField(blank=True, max_length=100)),
+                ('content_hash', models.CharField(blank=True, max_length=64)),
+                ('fetched', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='scrapejob',
+            name='pages_skipped',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 3.1.7 on 2026-10-16 20:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lmn', '0003_page_cache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestWatermark',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=50, unique=True)),
+                ('show_date', models.DateField()),
+                ('artist', models.CharField(max_length=200)),
+                ('venue', models.CharField(max_length=200)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='scrapejob',
+            name='backfill',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='scrapejob',
+            name='stopped_early',
+            field=models.BooleanField(default=False),
+        ),
+    ]
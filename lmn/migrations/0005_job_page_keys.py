@@ -0,0 +1,21 @@
+from django.db import migrations
+
+
+def page_numbers_to_keys(apps, schema_editor):
+    """ Jobs from before there were several sources recorded bare First Avenue page numbers """
+    ScrapeJob = apps.get_model('lmn', 'ScrapeJob')
+    for job in ScrapeJob.objects.all():
+        if any(isinstance(page, int) for page in job.pages_completed):
+            job.pages_completed = [f'first_avenue:{page}' if isinstance(page, int) else page for page in job.pages_completed]
+            job.save(update_fields=['pages_completed'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lmn', '0004_ingest_watermark'),
+    ]
+
+    operations = [
+        migrations.RunPython(page_numbers_to_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 3.1.7 on 2026-10-16 20:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lmn', '0005_job_page_keys'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scrapejob',
+            name='artists_skipped',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='scrapejob',
+            name='bytes_fetched',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='scrapejob',
+            name='db_seconds',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='scrapejob',
+            name='fetch_seconds',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='scrapejob',
+            name='pages_fetched',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='scrapejob',
+            name='parse_seconds',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='scrapejob',
+            name='venues_skipped',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.1.7 on 2026-10-16 20:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lmn', '0006_scrapejob_timings'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedPage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=50)),
+                ('url', models.CharField(max_length=500)),
+                ('fetched', models.DateTimeField()),
+                ('content_hash', models.CharField(max_length=64)),
+                ('size', models.PositiveIntegerField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='archivedpage',
+            index=models.Index(fields=['source', 'url', 'fetched'], name='lmn_archive_source_ba09b2_idx'),
+        ),
+    ]
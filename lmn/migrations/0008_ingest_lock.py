@@ -0,0 +1,23 @@
+# Generated by Django 3.1.7 on 2026-10-16 20:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lmn', '0007_archived_page'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestLock',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200, unique=True)),
+                ('owner', models.CharField(max_length=200)),
+                ('acquired', models.DateTimeField()),
+                ('expires', models.DateTimeField()),
+            ],
+        ),
+    ]
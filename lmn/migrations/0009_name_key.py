@@ -0,0 +1,60 @@
+# Generated by Django 3.1.7 on 2026-10-16 20:59
+
+import unicodedata
+
+from django.db import migrations, models
+
+
+def name_key(name):
+    """ A copy of lmn.models.name_key as it was when this migration was written """
+    folded = unicodedata.normalize('NFKC', name).casefold()
+    words = ''.join(char for char in folded if not unicodedata.category(char).startswith('P')).split()
+    if len(words) > 1 and words[0] == 'the':
+        words = words[1:]
+    return ' '.join(words) or ' '.join(folded.split())
+
+
+def fill_name_keys(apps, schema_editor):
+    """Keys for existing artists and venues, oldest first. Where two rows have the same key, 
+    the newer one is left without one - they're the same artist or venue, to be merged."""
+    for model_name in ('Artist', 'Venue'):
+        model = apps.get_model('lmn', model_name)
+        taken = set()
+        for row in model.objects.order_by('pk'):
+            key = name_key(row.name)
+            if key in taken:
+                print(f'\n  {model_name} {row.pk} "{row.name}" has the same name key as an earlier one, left without a key')
+                continue
+            taken.add(key)
+            model.objects.filter(pk=row.pk).update(name_key=key)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lmn', '0008_ingest_lock'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='artist',
+            name='name_key',
+            field=models.CharField(editable=False, max_length=200, null=True),
+        ),
+        migrations.AddField(
+            model_name='venue',
+            name='name_key',
+            field=models.CharField(editable=False, max_length=200, null=True),
+        ),
+        migrations.RunPython(fill_name_keys, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='artist',
+            name='name_key',
+            field=models.CharField(editable=False, max_length=200, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='venue',
+            name='name_key',
+            field=models.CharField(editable=False, max_length=200, null=True, unique=True),
+        ),
+    ]
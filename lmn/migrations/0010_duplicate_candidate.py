@@ -0,0 +1,31 @@
+# Generated by Django 3.1.7 on 2026-10-16 21:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lmn', '0009_name_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DuplicateCandidate',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('artist', 'Artist'), ('venue', 'Venue')], max_length=10)),
+                ('keep_id', models.PositiveIntegerField()),
+                ('merge_id', models.PositiveIntegerField()),
+                ('keep_name', models.CharField(max_length=200)),
+                ('merge_name', models.CharField(max_length=200)),
+                ('score', models.FloatField()),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('approved', 'Approved'), ('rejected', 'Rejected'), ('merged', 'Merged')], default='pending', max_length=10)),
+                ('found', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='duplicatecandidate',
+            constraint=models.UniqueConstraint(fields=('kind', 'keep_id', 'merge_id'), name='one_candidate_per_pair'),
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 3.1.7 on 2026-10-16 21:04
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def fill_rating_totals(apps, schema_editor):
+    """ A copy of lmn.models.recount_ratings as it was when this migration was written """
+    Show = apps.get_model('lmn', 'Show')
+    ShowRating = apps.get_model('lmn', 'ShowRating')
+    ratings = ShowRating.objects.filter(show=OuterRef('pk')).order_by().values('show')
+
+    def total(aggregate, **filters):
+        return Coalesce(Subquery(ratings.filter(**filters).annotate(total=aggregate).values('total')), 0)
+
+    Show.objects.update(rating_count=total(Count('pk')), rating_sum=total(Sum('rating_out_of_five')),
+                        **{f'ratings_{stars}': total(Count('pk'), rating_out_of_five=stars) for stars in range(1, 6)})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lmn', '0010_duplicate_candidate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='show',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='show',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='show',
+            name='ratings_1',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='show',
+            name='ratings_2',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='show',
+            name='ratings_3',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='show',
+            name='ratings_4',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='show',
+            name='ratings_5',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_rating_totals, migrations.RunPython.noop),
+    ]
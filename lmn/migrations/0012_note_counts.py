@@ -0,0 +1,43 @@
+# Generated by Django 3.1.7 on 2026-10-16 21:06
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_note_counts(apps, schema_editor):
+    """ A copy of lmn.models.recount_notes as it was when this migration was written """
+    Note = apps.get_model('lmn', 'Note')
+
+    def note_count(**filters):
+        notes = Note.objects.filter(**filters).order_by().values(*filters).annotate(total=Count('pk')).values('total')
+        return Coalesce(Subquery(notes), 0)
+
+    apps.get_model('lmn', 'Show').objects.update(note_count=note_count(show=OuterRef('pk')))
+    apps.get_model('lmn', 'Profile').objects.update(note_count=note_count(user=OuterRef('user')))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lmn', '0011_show_rating_totals'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='note_count',
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='show',
+            name='note_count',
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='show',
+            name='rating_count',
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.RunPython(fill_note_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 3.1.7 on 2026-10-16 21:09
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+# Django 3.1 can't declare an index on an expression, so the indexes for the registration form's
+# case-insensitive username and email checks (username__iexact, email__iexact) are created here.
+# iexact is UPPER(column) = UPPER(value) on PostgreSQL, and column LIKE value on SQLite, 
+# which SQLite can only answer from an index on the column with its case-insensitive collation.
+CASE_INSENSITIVE_INDEXES = {
+    'postgresql': [
+        ('auth_user_username_upper_idx', 'CREATE INDEX {name} ON auth_user (UPPER(username::text))'),
+        ('auth_user_email_upper_idx', 'CREATE INDEX {name} ON auth_user (UPPER(email::text))'),
+    ],
+    'sqlite': [
+        ('auth_user_username_nocase_idx', 'CREATE INDEX {name} ON auth_user (username COLLATE NOCASE)'),
+        ('auth_user_email_nocase_idx', 'CREATE INDEX {name} ON auth_user (email COLLATE NOCASE)'),
+    ],
+}
+
+
+def create_case_insensitive_indexes(apps, schema_editor):
+    for name, sql in CASE_INSENSITIVE_INDEXES.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql.format(name=name))
+
+
+def drop_case_insensitive_indexes(apps, schema_editor):
+    for name, sql in CASE_INSENSITIVE_INDEXES.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lmn', '0012_note_counts'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='note',
+            index=models.Index(fields=['-posted_date'], name='note_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='note',
+            index=models.Index(fields=['show', '-posted_date'], name='note_show_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='note',
+            index=models.Index(fields=['user', '-posted_date'], name='note_user_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='show',
+            index=models.Index(fields=['artist', '-show_date'], name='show_artist_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='show',
+            index=models.Index(fields=['venue', '-show_date'], name='show_venue_date_idx'),
+        ),
+        migrations.RunPython(create_case_insensitive_indexes, drop_case_insensitive_indexes),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 3.1.7 on 2026-10-16 21:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lmn', '0013_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='note',
+            name='note_date_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='show',
+            name='show_artist_date_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='show',
+            name='show_venue_date_idx',
+        ),
+        migrations.AddIndex(
+            model_name='note',
+            index=models.Index(fields=['-posted_date', '-id'], name='note_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='show',
+            index=models.Index(fields=['-show_date', '-id'], name='show_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='show',
+            index=models.Index(fields=['artist', '-show_date', '-id'], name='show_artist_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='show',
+            index=models.Index(fields=['venue', '-show_date', '-id'], name='show_venue_date_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1.7 on 2026-10-16 22:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lmn', '0014_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scrapejob',
+            name='page_failures',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 3.1.7 on 2026-10-16 22:22
+
+from django.db import migrations, models
+from django.db.models import Count, ExpressionWrapper, F, FloatField, Sum
+from django.db.models.functions import Coalesce
+
+
+PRIOR_RATINGS = 5
+
+
+def fill_rating_scores(apps, schema_editor):
+    """ A copy of lmn.models.recount_site_ratings and rating_score as they were when this migration was written """
+    ShowRating = apps.get_model('lmn', 'ShowRating')
+    totals = ShowRating.objects.filter(show__isnull=False).aggregate(rating_count=Count('pk'), rating_sum=Coalesce(Sum('rating_out_of_five'), 0))
+    apps.get_model('lmn', 'RatingTotals').objects.update_or_create(pk=1, defaults=totals)
+    site_average = totals['rating_sum'] / totals['rating_count'] if totals['rating_count'] else 0
+    score = (PRIOR_RATINGS * site_average + F('rating_sum')) / (PRIOR_RATINGS + F('rating_count'))
+    apps.get_model('lmn', 'Show').objects.update(rating_score=ExpressionWrapper(score, output_field=FloatField()))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lmn', '0015_scrapejob_page_failures'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RatingTotals',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rating_count', models.PositiveIntegerField(default=0)),
+                ('rating_sum', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='show',
+            name='rating_score',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='show',
+            index=models.Index(fields=['-rating_score', '-rating_count'], name='show_rating_score_idx'),
+        ),
+        migrations.RunPython(fill_rating_scores, migrations.RunPython.noop),
+    ]
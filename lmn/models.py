@@ -1,11 +1,15 @@
-from django.db import models
+from django.db import connection, models
 
-from django.db.models import Avg, Count
+from django.db.models import Count, ExpressionWrapper, F, FloatField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
 from django.core.files.storage import default_storage
-import datetime
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, pre_save, post_delete
+from django.utils import timezone
+from django.core.exceptions import ValidationError
 from django.core.validators import MaxValueValidator, MinValueValidator
+import time
+import unicodedata
 
 # Every model gets a primary key field by default.
 
@@ -21,8 +25,35 @@ User._meta.get_field('last_name')._blank = False
 User._meta.get_field('first_name')._blank = False
 
 
+def name_key(name):
+    """The key names are matched on: case folded, punctuation removed, whitespace collapsed and a leading 'The' dropped,
+    so 'The Replacements', 'the replacements' and 'Replacements' are the same artist, and 'R.E.M.' is 'REM'.
+
+    :param name: an artist or venue name
+    :type name: str
+    :rtype: str
+    """
+    folded = unicodedata.normalize('NFKC', name).casefold()
+    words = ''.join(char for char in folded if not unicodedata.category(char).startswith('P')).split()
+    if len(words) > 1 and words[0] == 'the':
+        words = words[1:]
+    return ' '.join(words) or ' '.join(folded.split())  # a name that's all punctuation, like !!!, is its own key
+
+
+""" Artists and venues are looked up by name_key, which has a unique index. It's kept up to date by set_name_key. """
+class NameKeyed(models.Model):
+    name_key = models.CharField(max_length=200, unique=True, null=True, editable=False)
+
+    class Meta:
+        abstract = True
+
+    def clean(self):
+        if type(self).objects.filter(name_key=name_key(self.name)).exclude(pk=self.pk).exists():
+            raise ValidationError({'name': f'There is already a {self._meta.verbose_name} with a name matching {self.name}'})
+
+
 """ A music artist """
-class Artist(models.Model):
+class Artist(NameKeyed):
     name = models.CharField(max_length=200, blank=False, unique=True)
 
     def __str__(self):
@@ -30,7 +61,7 @@ class Artist(models.Model):
 
 
 """ A venue, that hosts shows. """
-class Venue(models.Model):
+class Venue(NameKeyed):
     name = models.CharField(max_length=200, blank=False, unique=True)
     city = models.CharField(max_length=200, blank=False)
     state = models.CharField(max_length=2, blank=False) 
@@ -39,25 +70,49 @@ class Venue(models.Model):
         return f'Name: {self.name} Location: {self.city}, {self.state}'
 
 
-""" A show - one artist playing at one venue at a particular date. """
+""" A show - one artist playing at one venue at a particular date. 
+Its ratings and notes are counted on the show as they're saved and deleted, so showing its rating, 
+or ranking shows by them, costs no aggregate queries. """
 class Show(models.Model):
     show_date = models.DateTimeField(blank=False)
     artist = models.ForeignKey(Artist, on_delete=models.CASCADE)
     venue = models.ForeignKey(Venue, on_delete=models.CASCADE)
+    # Kept by count_rating. manage.py recount_shows recomputes them from ShowRating if they're ever wrong.
+    rating_count = models.PositiveIntegerField(default=0, editable=False, db_index=True)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    ratings_1 = models.PositiveIntegerField(default=0, editable=False)  # how many rated it 1 out of 5
+    ratings_2 = models.PositiveIntegerField(default=0, editable=False)
+    ratings_3 = models.PositiveIntegerField(default=0, editable=False)
+    ratings_4 = models.PositiveIntegerField(default=0, editable=False)
+    ratings_5 = models.PositiveIntegerField(default=0, editable=False)
+    note_count = models.PositiveIntegerField(default=0, editable=False, db_index=True)  # kept by count_note
+    # Bayesian average rating, see rating_score. Kept by count_rating, with the site average as it was then.
+    rating_score = models.FloatField(default=0, editable=False)
 
     class Meta:
         unique_together = ('show_date', 'artist', 'venue')
+        indexes = [
+            # top rated shows, best first
+            models.Index(fields=['-rating_score', '-rating_count'], name='show_rating_score_idx'),
+            # the latest shows, and an artist's or a venue's shows, newest first. Ending in id, the 
+            # pages' keys (see lmn.paginator), so any page is one range scan and needs no sorting
+            models.Index(fields=['-show_date', '-id'], name='show_date_idx'),
+            models.Index(fields=['artist', '-show_date', '-id'], name='show_artist_date_idx'),
+            models.Index(fields=['venue', '-show_date', '-id'], name='show_venue_date_idx'),
+        ]
 
     @property
     def rating(self):
-        rating_out_of_five_dict = self.ratings.all().aggregate(Avg('rating_out_of_five'))
-        rating_out_of_five = rating_out_of_five_dict['rating_out_of_five__avg']
-        if rating_out_of_five is not None:
-            return round(rating_out_of_five, 1) # returns a rounded version of a shows average rating
-            # return round(rating_out_of_five, 1) # returns a rounded version of a shows average rating
+        if self.rating_count:
+            return round(self.rating_sum / self.rating_count, 1) # returns a rounded version of a shows average rating
         else:
             return None
 
+    @property
+    def rating_histogram(self):
+        """ How many rated the show 1, 2, 3, 4 and 5 out of 5 """
+        return {stars: getattr(self, f'ratings_{stars}') for stars in range(1, 6)}
+
     def __str__(self):
         formatted_show_date = self.show_date.strftime("%b %d %Y")
         return f'Artist: {self.artist.name} At: {self.venue.name} On: {formatted_show_date}'
@@ -77,6 +132,16 @@ class ShowRating(models.Model):
         return f'Show: {self.show} User: {self.user.first_name} {self.user.last_name} Rating: {self.rating_out_of_five}/5'
 
 
+""" Every rating on the site, counted as they're saved and deleted - one row, for the site average in rating_score """
+class RatingTotals(models.Model):
+    rating_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+
+    @property
+    def average(self):
+        return self.rating_sum / self.rating_count if self.rating_count else 0
+
+
 """ One user's opinion of one show. """
 class Note(models.Model):
     show = models.ForeignKey(Show, blank=False, on_delete=models.CASCADE)
@@ -91,6 +156,12 @@ class Note(models.Model):
         constraints = [
             models.UniqueConstraint(fields=['show', 'user'], name='user_note_for_show')
         ]
+        indexes = [
+            # the latest notes, and a show's or a user's notes, newest first. The latest notes are paged by (posted_date, id)
+            models.Index(fields=['-posted_date', '-id'], name='note_date_idx'),
+            models.Index(fields=['show', '-posted_date'], name='note_show_date_idx'),
+            models.Index(fields=['user', '-posted_date'], name='note_user_date_idx'),
+        ]
 
 
     def save(self, *args, **kwargs):
@@ -133,6 +204,7 @@ class Profile(models.Model):
     shows_seen = models.ManyToManyField(Show, blank=True)
     bio = models.TextField(blank=True, null=True)
     badges = models.ManyToManyField(Badge, blank=True)
+    note_count = models.PositiveIntegerField(default=0, editable=False, db_index=True)  # kept by count_note
 
 
     def save(self, *args, **kwargs):
@@ -162,6 +234,281 @@ class Profile(models.Model):
           Badges: {self.badges.all()}'
 
 
+""" One run of the show scraper. Pages are checkpointed as they finish, so an interrupted run can pick up where it stopped. """
+class ScrapeJob(models.Model):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    FINISHED = 'finished'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (FINISHED, 'Finished'),
+        (FAILED, 'Failed'),
+    ]
+
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(blank=True, null=True)
+    finished = models.DateTimeField(blank=True, null=True)
+    pages_total = models.PositiveIntegerField(default=0)
+    pages_completed = models.JSONField(default=list, blank=True)  # "source:page", in the order they finished
+    page_failures = models.JSONField(default=list, blank=True)  # "source:page", once for every failed attempt
+    artists_inserted = models.PositiveIntegerField(default=0)
+    artists_skipped = models.PositiveIntegerField(default=0)  # already in the database
+    venues_inserted = models.PositiveIntegerField(default=0)
+    venues_skipped = models.PositiveIntegerField(default=0)
+    shows_inserted = models.PositiveIntegerField(default=0)
+    shows_skipped = models.PositiveIntegerField(default=0)
+    pages_fetched = models.PositiveIntegerField(default=0)
+    pages_skipped = models.PositiveIntegerField(default=0)  # unchanged since the last run, not parsed
+    bytes_fetched = models.PositiveBigIntegerField(default=0)
+    # Summed over pages. Pages overlap in the pipeline, so these can add up to more than the run's elapsed time.
+    fetch_seconds = models.FloatField(default=0)
+    parse_seconds = models.FloatField(default=0)
+    db_seconds = models.FloatField(default=0)
+    backfill = models.BooleanField(default=False)  # walk every page, ignoring the watermark and page cache
+    stopped_early = models.BooleanField(default=False)  # reached shows ingested by an earlier run
+    error = models.TextField(blank=True)
+
+    @property
+    def pages_done(self):
+        return len(set(self.pages_completed))
+
+    @property
+    def elapsed(self):
+        """ Seconds the job has been running for, or ran for if it's done """
+        if not self.started:
+            return 0
+        end = self.finished or timezone.now()
+        return (end - self.started).total_seconds()
+
+    def __str__(self):
+        return f'Scrape job {self.pk}: {self.status}, {self.pages_done}/{self.pages_total} pages, {self.shows_inserted} shows added'
+
+
+""" What the scraper saw the last time it fetched a url, so unchanged pages can be skipped. """
+class PageCacheEntry(models.Model):
+    url = models.CharField(max_length=500, unique=True)
+    etag = models.CharField(max_length=200, blank=True)
+    last_modified = models.CharField(max_length=100, blank=True)
+    content_hash = models.CharField(max_length=64, blank=True)  # sha256 of the page body
+    fetched = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.url} fetched {self.fetched} ETag: {self.etag} Hash: {self.content_hash}'
+
+
+""" The newest show ingested from a source. Listings are newest first, so paging can stop once it gets back to this show. """
+class IngestWatermark(models.Model):
+    source = models.CharField(max_length=50, unique=True)
+    show_date = models.DateField()
+    artist = models.CharField(max_length=200)
+    venue = models.CharField(max_length=200)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.source}: {self.artist} at {self.venue} on {self.show_date}'
+
+
+""" A lease on some ingest work - the whole scrape, or a range of one job's pages. An expired lease can be taken over. """
+class IngestLock(models.Model):
+    name = models.CharField(max_length=200, unique=True)
+    owner = models.CharField(max_length=200)  # host:pid:random, of the process holding it
+    acquired = models.DateTimeField()
+    expires = models.DateTimeField()
+
+    def __str__(self):
+        return f'{self.name} held by {self.owner} until {self.expires}'
+
+
+""" One fetch of a listing page. The page itself is in the page archive, gzipped, filed under its content_hash. """
+class ArchivedPage(models.Model):
+    source = models.CharField(max_length=50)
+    url = models.CharField(max_length=500)
+    fetched = models.DateTimeField()
+    content_hash = models.CharField(max_length=64)  # sha256 of the uncompressed page
+    size = models.PositiveIntegerField()  # uncompressed bytes
+
+    class Meta:
+        indexes = [models.Index(fields=['source', 'url', 'fetched'])]
+
+    def __str__(self):
+        return f'{self.url} fetched {self.fetched}'
+
+
+""" A pair of artists or venues that look like the same one, found by manage.py find_duplicates, for review in the admin site """
+class DuplicateCandidate(models.Model):
+    ARTIST = 'artist'
+    VENUE = 'venue'
+    KIND_CHOICES = [(ARTIST, 'Artist'), (VENUE, 'Venue')]
+
+    PENDING = 'pending'
+    APPROVED = 'approved'
+    REJECTED = 'rejected'
+    MERGED = 'merged'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (APPROVED, 'Approved'), (REJECTED, 'Rejected'), (MERGED, 'Merged')]
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    keep_id = models.PositiveIntegerField()  # the row kept by a merge - the one with more shows
+    merge_id = models.PositiveIntegerField()  # the row merged into it, and deleted
+    keep_name = models.CharField(max_length=200)
+    merge_name = models.CharField(max_length=200)
+    score = models.FloatField()  # 0 to 1
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    found = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'keep_id', 'merge_id'], name='one_candidate_per_pair')
+        ]
+
+    def __str__(self):
+        return f'{self.kind}: merge {self.merge_name} into {self.keep_name} ({self.score:.2f}, {self.status})'
+
+
+def set_name_key(sender, instance, **kwargs):
+    # bulk_create doesn't send signals, so the scraper sets name_key itself
+    instance.name_key = name_key(instance.name)
+pre_save.connect(set_name_key, sender=Artist)
+pre_save.connect(set_name_key, sender=Venue)
+
+
+# Ratings a show is assumed to have at the site's average rating before its own are counted,
+# so one 5 star rating doesn't put a show above one rated 4.8 by fifty people
+PRIOR_RATINGS = 5
+
+
+def rating_score(rating_count, rating_sum, site_average):
+    """A show's Bayesian average rating: (PRIOR_RATINGS * site_average + rating_sum) / (PRIOR_RATINGS + rating_count).
+    The counts can be numbers or expressions. """
+    return ExpressionWrapper((PRIOR_RATINGS * site_average + rating_sum) / (PRIOR_RATINGS + rating_count), output_field=FloatField())
+
+
+def count_rating(show_id, stars, change):
+    """Add a rating to, or with change=-1 take one from, a show's stored totals and the site's, and rescore the show.
+    The totals are changed by the database with F expressions, so ratings saved at the same time can't overwrite 
+    each other's counts.
+
+    Other shows keep the scores they had, from the site average when they were last rated, until recount_ratings.
+    """
+    if show_id is None:
+        return
+    stars = int(stars)
+    if not RatingTotals.objects.update(rating_count=F('rating_count') + change, rating_sum=F('rating_sum') + change * stars):
+        recount_site_ratings()  # there's no row yet
+    site_average = RatingTotals.objects.get().average
+    rating_count, rating_sum = F('rating_count') + change, F('rating_sum') + change * stars
+    Show.objects.filter(pk=show_id).update(rating_count=rating_count, rating_sum=rating_sum,
+                                           rating_score=rating_score(rating_count, rating_sum, site_average),
+                                           **{f'ratings_{stars}': F(f'ratings_{stars}') + change})
+
+
+def recount_site_ratings():
+    """ Recompute the site's rating totals from ShowRating """
+    totals = ShowRating.objects.filter(show__isnull=False).aggregate(rating_count=Count('pk'), rating_sum=Coalesce(Sum('rating_out_of_five'), 0))
+    RatingTotals.objects.update_or_create(pk=1, defaults=totals)
+    return RatingTotals.objects.get()
+
+
+def recount_ratings(shows=None):
+    """Recompute shows' stored rating totals from ShowRating, and the site's, and rescore the shows with the 
+    site average as it is now, in one UPDATE
+
+    :param shows: the shows to recount, default all of them
+    :type shows: QuerySet of Show
+    :returns: the number of shows updated
+    :rtype: int
+    """
+    ratings = ShowRating.objects.filter(show=OuterRef('pk')).order_by().values('show')
+
+    def total(aggregate, **filters):
+        return Coalesce(Subquery(ratings.filter(**filters).annotate(total=aggregate).values('total')), 0)
+
+    shows = Show.objects.all() if shows is None else shows
+    site_average = recount_site_ratings().average
+    rating_count, rating_sum = total(Count('pk')), total(Sum('rating_out_of_five'))
+    return shows.update(rating_count=rating_count, rating_sum=rating_sum, 
+                        rating_score=rating_score(rating_count, rating_sum, site_average),
+                        **{f'ratings_{stars}': total(Count('pk'), rating_out_of_five=stars) for stars in range(1, 6)})
+
+
+def remember_counted_rating(sender, instance, raw=False, **kwargs):
+    # The show and rating the totals have for this rating now, to take back out if either changes
+    instance._counted = None
+    if instance.pk:
+        instance._counted = ShowRating.objects.filter(pk=instance.pk).values_list('show_id', 'rating_out_of_five').first()
+
+
+def count_saved_rating(sender, instance, **kwargs):
+    counted = getattr(instance, '_counted', None)
+    saved = (instance.show_id, int(instance.rating_out_of_five))
+    if counted != saved:
+        if counted:
+            count_rating(*counted, -1)
+        count_rating(*saved, 1)
+    instance._counted = saved
+
+
+def uncount_deleted_rating(sender, instance, **kwargs):
+    count_rating(instance.show_id, instance.rating_out_of_five, -1)
+
+pre_save.connect(remember_counted_rating, sender=ShowRating)
+post_save.connect(count_saved_rating, sender=ShowRating)
+post_delete.connect(uncount_deleted_rating, sender=ShowRating)
+
+
+def count_note(show_id, user_id, change):
+    """ Add a note to, or with change=-1 take one from, the note counts of its show and its user's profile """
+    Show.objects.filter(pk=show_id).update(note_count=F('note_count') + change)
+    Profile.objects.filter(user_id=user_id).update(note_count=F('note_count') + change)
+
+
+def recount_notes(shows=None, profiles=None):
+    """Recompute the note counts of shows and profiles from Note, in one UPDATE each
+
+    :param shows: the shows to recount, default all of them
+    :type shows: QuerySet of Show
+    :param profiles: the profiles to recount, default all of them
+    :type profiles: QuerySet of Profile
+    :returns: the number of shows and of profiles updated
+    :rtype: tuple(int, int)
+    """
+    def note_count(**filters):
+        notes = Note.objects.filter(**filters).order_by().values(*filters).annotate(total=Count('pk')).values('total')
+        return Coalesce(Subquery(notes), 0)
+
+    shows = Show.objects.all() if shows is None else shows
+    profiles = Profile.objects.all() if profiles is None else profiles
+    return shows.update(note_count=note_count(show=OuterRef('pk'))), profiles.update(note_count=note_count(user=OuterRef('user')))
+
+
+def remember_counted_note(sender, instance, raw=False, **kwargs):
+    # The show and user the counts have for this note now, to take back out if either changes
+    instance._counted = None
+    if instance.pk:
+        instance._counted = Note.objects.filter(pk=instance.pk).values_list('show_id', 'user_id').first()
+
+
+def count_saved_note(sender, instance, **kwargs):
+    counted = getattr(instance, '_counted', None)
+    saved = (instance.show_id, instance.user_id)
+    if counted != saved:
+        if counted:
+            count_note(*counted, -1)
+        count_note(*saved, 1)
+        award_badges(instance.user_id)
+    instance._counted = saved
+
+
+def uncount_deleted_note(sender, instance, **kwargs):
+    count_note(instance.show_id, instance.user_id, -1)
+
+pre_save.connect(remember_counted_note, sender=Note)
+post_save.connect(count_saved_note, sender=Note)
+post_delete.connect(uncount_deleted_note, sender=Note)
+
+
 def create_profile(sender, **kwargs):
     user = kwargs["instance"]
     if kwargs["created"]:
@@ -170,11 +517,57 @@ def create_profile(sender, **kwargs):
 post_save.connect(create_profile, sender=User)
 
 
-def post_save_notes_model_receiver(sender, instance, *args, **kwargs):
-    num_notes = instance.user.note_set.count()
-    badge_to_awarded = Badge.objects.filter(number_notes=num_notes).first()
-    profile = instance.user.profile
-    if badge_to_awarded:
-        profile.badges.add(badge_to_awarded)
-
-post_save.connect(post_save_notes_model_receiver, sender= Note)
\ No newline at end of file
+# Badge thresholds, read on every new note, change rarely, so each process keeps a copy. It's cleared when a Badge 
+# is saved or deleted in this process, and re-read after BADGE_CACHE_SECONDS to pick up changes made by other processes.
+BADGE_CACHE_SECONDS = 300
+_badge_cache = None  # (time read, [(number_notes, badge id)])
+
+
+def badge_thresholds():
+    """ (number_notes, badge id) of every badge, fewest notes first """
+    global _badge_cache
+    if _badge_cache is None or time.monotonic() - _badge_cache[0] > BADGE_CACHE_SECONDS:
+        _badge_cache = (time.monotonic(), list(Badge.objects.order_by('number_notes').values_list('number_notes', 'id')))
+    return _badge_cache[1]
+
+
+def clear_badge_cache(*args, **kwargs):
+    global _badge_cache
+    _badge_cache = None
+
+post_save.connect(clear_badge_cache, sender=Badge)
+post_delete.connect(clear_badge_cache, sender=Badge)
+
+
+def award_badges(user_id):
+    """Give a user every badge for their number of notes or fewer that they don't have yet, in one insert. 
+    Badges already earned are ignored by the insert, so one missed earlier - say the count skipped past it - is still given."""
+    thresholds = badge_thresholds()
+    if not thresholds:
+        return
+    profile = Profile.objects.filter(user_id=user_id).values_list('id', 'note_count').first()
+    if not profile:
+        return
+    profile_id, note_count = profile
+    earned = [Profile.badges.through(profile_id=profile_id, badge_id=badge_id) for number_notes, badge_id in thresholds if number_notes <= note_count]
+    if earned:
+        Profile.badges.through.objects.bulk_create(earned, ignore_conflicts=True)
+
+
+def recompute_badges():
+    """Recount every profile's notes, and give every user the badges they've earned and don't have, 
+    with one UPDATE and one INSERT ... SELECT. Badges aren't taken away from users below their threshold.
+
+    :returns: the number of badges given
+    :rtype: int
+    """
+    recount_notes(Show.objects.none())
+    profile_badges = Profile.badges.through._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(f'''
+            INSERT INTO {profile_badges} (profile_id, badge_id)
+            SELECT profile.id, badge.id 
+            FROM {Profile._meta.db_table} profile JOIN {Badge._meta.db_table} badge ON badge.number_notes <= profile.note_count
+            WHERE NOT EXISTS (SELECT 1 FROM {profile_badges} had WHERE had.profile_id = profile.id AND had.badge_id = badge.id)
+        ''')
+        return cursor.rowcount
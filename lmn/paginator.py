@@ -1,22 +1,218 @@
-from django.core.paginator import EmptyPage, Paginator, PageNotAnInteger, EmptyPage
+"""Keyset (cursor) pagination.
 
+Pages are found by where the last one ended, not by how many rows came before them: a page after
+the row with key (show_date, id) is the rows whose key sorts after it, which an index on the key
+answers with one range scan however deep the page is. OFFSET has to read and throw away every
+earlier row, and Paginator also counts the whole table for its page links.
 
-def paginate(request, model_set, per_page):
+The ordering must end in a unique field, like id, so no two rows have the same key and none are
+skipped or shown twice at a page boundary. The cursors in the page links are the first and last
+keys on the page, encoded so they can go in a url as they are.
 
-    paginator = Paginator(model_set, per_page) # 10 shows per page
+A page fetches one row more than it shows, to tell whether there's a page after it, and runs no
+count. Its navigator links to the WINDOW pages either side of it: the pages before are numbered
+back from this one, and a page a few past a key skips the pages' worth of rows between, which is
+an OFFSET of at most WINDOW - 1 pages. How many pages there are past the next one is only known
+with estimate_count, which also gives a link to the last page.
+"""
+import base64
+import binascii
+import datetime
+import json
+import math
+import time
+from collections import namedtuple
+from collections.abc import Sequence
 
-    if request.GET.get('page'):
-        page = int(request.GET.get('page'))
+from django.core.exceptions import ValidationError
+from django.db import connections
+from django.db.models import Q
+
+
+NEXT = 'n'
+PREVIOUS = 'p'
+
+WINDOW = 2  # pages linked either side of the current one
+
+# Exact counts, by query, are cached for COUNT_CACHE_SECONDS - an estimate of the number of pages needn't be up to the second
+COUNT_CACHE_SECONDS = 300
+_count_cache = {}  # (database, count sql) to (time counted, count)
+
+Cursor = namedtuple('Cursor', ['direction', 'number', 'skip', 'key'])
+
+
+class CursorPage(Sequence):
+    """One page of rows, with cursors for the pages around it - None where there's no such page
+
+    :param rows: the rows on the page
+    :type rows: list
+    :param number: the page's number, counting from 1 - an estimate on a page reached from the last page link
+    :type number: int
+    :param page_links: (number, cursor) of the pages in the navigator, in order, with None for the cursor of this page
+    :type page_links: list of tuple
+    :param estimated_pages: about how many pages there are, None if they weren't counted
+    :type estimated_pages: int
+    :param last_cursor: cursor for the last page, None unless the pages were counted and it isn't in page_links
+    :type last_cursor: str
+    """
+
+    def __init__(self, rows, number=1, page_links=(), estimated_pages=None, last_cursor=None):
+        self.object_list = rows
+        self.number = number
+        self.page_links = list(page_links)
+        self.estimated_pages = estimated_pages
+        self.last_cursor = last_cursor
+        links = dict(self.page_links)
+        self.previous_cursor = links.get(number - 1)
+        self.next_cursor = links.get(number + 1)
+        self.gap_before_last = bool(last_cursor) and estimated_pages > self.page_links[-1][0] + 1  # pages the navigator leaves out
+
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+
+def keyset_paginate(request, queryset, per_page, ordering, estimate_count=False):
+    """The page of queryset named by the cursor in the request's query string, or the first page if it has none.
+    Fetches one row more than the page holds to tell whether there's a page beyond it, so it's one query, and
+    one more with estimate_count when the count isn't cached.
+
+    :param request: the request, its cursor is read from request.GET['cursor']
+    :param queryset: the rows to page through, unordered
+    :type queryset: QuerySet
+    :param per_page: rows on a page
+    :type per_page: int
+    :param ordering: field names, with a leading - for descending, ending in a unique field. Like ('-show_date', '-id')
+    :type ordering: tuple of str
+    :param estimate_count: whether to count the rows, roughly, for the last page and the page links past the next one
+    :type estimate_count: bool
+    :rtype: CursorPage
+    """
+    fields = [(name.lstrip('-'), name.startswith('-')) for name in ordering]
+    cursor = decode_cursor(request.GET.get('cursor'), queryset.model, fields) or Cursor(NEXT, 1, 0, None)
+    skip = min(cursor.skip, (WINDOW - 1) * per_page)
+    forward = cursor.direction == NEXT
+
+    # The pages before a key are the rows before it in reverse order, read backwards along the same index, then turned around
+    scan_fields = fields if forward else [(name, not descending) for name, descending in fields]
+    rows = queryset.filter(_after(scan_fields, cursor.key)) if cursor.key else queryset
+    rows = list(rows.order_by(*[('-' if descending else '') + name for name, descending in scan_fields])[skip:skip + per_page + 1])
+    more, rows = len(rows) > per_page, rows[:per_page]
+    if forward:
+        has_next, has_previous = more, bool(cursor.key or skip)
     else:
-        page = None
+        rows.reverse()
+        has_next, has_previous = bool(cursor.key or skip), more
+    number = cursor.number if has_previous else 1  # reaching the start puts right a number that was estimated
 
+    estimated_pages = None
+    if estimate_count:
+        estimated_pages = max(math.ceil(estimated_count(queryset) / per_page), number + has_next, 1)
+
+    if not rows:
+        # Past the end, or before the start, of rows that have changed since the cursor was made
+        return CursorPage(rows, number, [(1, ''), (number, None)] if number > 1 else [(1, None)], estimated_pages)
+
+    first, last = _key(rows[0], fields), _key(rows[-1], fields)
+    links = [(number, None)]
+    for distance in range(1, WINDOW + 1):
+        if number - distance >= 1:
+            # Page 1 is the page with no cursor, so its link is right even if this page's number is an estimate
+            links.insert(0, (number - distance, '' if number - distance == 1 else
+                             encode_cursor(Cursor(PREVIOUS, number - distance, (distance - 1) * per_page, first))))
+        if has_next and (distance == 1 or estimated_pages and number + distance <= estimated_pages):
+            links.append((number + distance, encode_cursor(Cursor(NEXT, number + distance, (distance - 1) * per_page, last))))
+
+    last_cursor = None
+    if estimated_pages and has_next and links[-1][0] < estimated_pages:
+        last_cursor = encode_cursor(Cursor(PREVIOUS, estimated_pages, 0, []))  # no key - the rows before the end
+    return CursorPage(rows, number, links, estimated_pages, last_cursor)
+
+
+def estimated_count(queryset):
+    """About how many rows queryset has. A whole table on PostgreSQL is the planner's estimate, kept up to date by
+    autovacuum; anything else is counted, and the count cached for COUNT_CACHE_SECONDS.
+
+    :rtype: int
+    """
+    connection = connections[queryset.db]
+    if connection.vendor == 'postgresql' and not queryset.query.where:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass', [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+        if row and row[0] > 0:  # -1, or 0, until the table is first analyzed
+            return int(row[0])
+
+    key = (queryset.db, str(queryset.order_by().query))
+    counted = _count_cache.get(key)
+    if counted is None or time.monotonic() - counted[0] > COUNT_CACHE_SECONDS:
+        counted = _count_cache[key] = (time.monotonic(), queryset.order_by().count())
+    return counted[1]
+
+
+def clear_count_cache():
+    _count_cache.clear()
+
+
+def _after(fields, key):
+    """Rows whose key sorts after key: (a, b) after (x, y) is a > x, or a = x and b > y - and, so the database
+    can start its index scan at x rather than test every row, a >= x. Descending fields compare the other way."""
+    after = Q()
+    for position, (name, descending) in enumerate(fields):
+        equal = {earlier: value for (earlier, _), value in zip(fields[:position], key)}
+        after |= Q(**equal, **{f'{name}__{"lt" if descending else "gt"}': key[position]})
+    first_name, first_descending = fields[0]
+    return Q(**{f'{first_name}__{"lte" if first_descending else "gte"}': key[0]}) & after
+
+
+def _key(row, fields):
+    return [getattr(row, name) for name, descending in fields]
+
+
+def encode_cursor(cursor):
+    """ A Cursor as url-safe base64 JSON """
+    data = json.dumps([cursor.direction, cursor.number, cursor.skip, *(cursor.key or [])], default=_json_default, separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, model, fields):
+    """The Cursor encoded by encode_cursor, with the key values converted back by their model fields. A previous
+    cursor can have no key, for the last page. None for no cursor, or one that doesn't decode - an old or edited
+    url shows the first page rather than an error.
+
+    :rtype: Cursor
+    """
+    if not cursor:
+        return None
     try:
-        model_set = paginator.page(page)
-    except PageNotAnInteger:
-        model_set = paginator.page(1)
-        page = 1
-    except EmptyPage:
-        model_set = paginator.page(paginator.num_pages)
-        page = paginator.num_pages
-
-    return model_set, paginator, page
\ No newline at end of file
+        data = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        direction, number, skip, values = data[0], int(data[1]), int(data[2]), data[3:]
+        if direction not in (NEXT, PREVIOUS) or number < 1 or skip < 0:
+            return None
+        if len(values) != len(fields) and not (direction == PREVIOUS and not values):
+            return None
+        key = [model._meta.get_field(name).to_python(value) for (name, descending), value in zip(fields, values)]
+    except (binascii.Error, ValueError, TypeError, KeyError, IndexError, ValidationError):
+        return None
+    if None in key:
+        return None
+    return Cursor(direction, number, skip, key)
+
+
+def _json_default(value):
+    # Not DjangoJSONEncoder, which cuts datetimes to milliseconds - a cursor has to be the exact key
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    raise TypeError(f'Can\'t put {type(value).__name__} in a cursor')
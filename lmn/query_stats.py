@@ -0,0 +1,41 @@
+"""Fingerprints of SQL statements, for spotting the same query run over and over in one request - 
+usually a template reading a relation one row at a time, an N+1, like {{ note.show.artist.name }} 
+in a loop over notes without select_related.
+
+Literals are replaced by ?, and IN lists by (...), so queries that differ only in their values 
+have the same fingerprint.
+"""
+import re
+from collections import Counter
+
+
+LITERALS = [
+    (re.compile(r'%s'), '?'),  # placeholders, in SQL seen before its parameters are filled in
+    (re.compile(r"'(?:[^']|'')*'"), '?'),  # strings
+    (re.compile(r'(?<![\w."])-?\d+(?:\.\d+)?(?![\w"])'), '?'),  # numbers, not digits in names like "ratings_1"
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)'), '(...)'),  # IN lists of any length
+    (re.compile(r'\s+'), ' '),
+]
+
+
+def fingerprint(sql):
+    """ sql with its literal values replaced, so the same query with other values has the same fingerprint """
+    for pattern, replacement in LITERALS:
+        sql = pattern.sub(replacement, sql)
+    return sql.strip()
+
+
+def repeated_queries(sqls):
+    """The fingerprints run more than once, and how many times
+
+    :param sqls: the SQL of each query run
+    :type sqls: iterable of str
+    :rtype: dict
+    """
+    counts = Counter(fingerprint(sql) for sql in sqls)
+    return {sql: count for sql, count in counts.items() if count > 1}
+
+
+def duplicate_count(sqls):
+    """ Queries that repeat an earlier query but for its values - the extra queries an N+1 costs """
+    return sum(count - 1 for count in repeated_queries(sqls).values())
@@ -1,10 +1,15 @@
-import requests
-from bs4 import BeautifulSoup
-from datetime import date, datetime
+from bs4 import BeautifulSoup, SoupStrainer
+from datetime import date
+import logging
 import os
 import django
 import sys
-import requests 
+
+try:
+    import lxml.etree
+    import lxml.html
+except ImportError: # lxml is optional, the BeautifulSoup parsers work without it
+    lxml = None
 
 # include this file location on the path 
 sys.path.append(os.getcwd())   
@@ -12,7 +17,15 @@ sys.path.append(os.getcwd())
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'lmnop_project.settings')
 django.setup() 
 
-from lmn.models import Venue, Show, Artist
+from lmn.ingest.records import ShowRecord
+from lmn.ingest.run import SourceRun
+from lmn.ingest.sources import Source, register
+
+SOURCE_NAME = 'first_avenue'
+FIRST_AVENUE_URL = 'https://first-avenue.com/shows/page/{page_number}/?orderby=past_shows'
+PAGES_TO_SCRAPE = 15
+
+logger = logging.getLogger(f'lmn.ingest.{SOURCE_NAME}')
 
 # web scraping returns unuseful month data, dictionary changes it to MM format
 month_dict = {
@@ -31,107 +44,162 @@ month_dict = {
 }
 
 
-def scrape_first():
-    """This function uses requests and beautifulsoup to get data from https://first-avenue.com/shows/, 
-    The function iterates over the last 30 pages, identifies the html container with the info we want,
+def parse_page(content, parser=None):
+    """Identifies the html containers with the info we want in one listing page,
     and gets artist name, venue name, show date
 
-    :param container_object: Constructed with beautifulsoup library from provided url
-    :type container_object: Obj
-    ...
-    :raises django.db.utils.IntegrityError:
+    :param content: html of one listing page
+    :type content: bytes
+    :param parser: name of a backend in PARSERS, defaults to DEFAULT_PARSER
+    :type parser: str
+    :returns: the shows listed on the page
+    :rtype: list of ShowRecord
+    """
+    return PARSERS[parser or DEFAULT_PARSER](content)
 
 
-    """
+# An event container holds the show's details as descendants with these classes,
+# and the band's name is the first link in the container
+ITEM_CLASSES = ('day', 'month', 'year', 'venue_name')
 
-    for page_number in range(15): # Loop over the first 30 pages on the first avenue website
 
-        url = f'https://first-avenue.com/shows/page/{page_number}/?orderby=past_shows'
+def show_record(fields):
+    """Build a ShowRecord from the text found in one event container
 
-        try:
-            r = requests.get(url)
-            soup = BeautifulSoup(r.content, 'html.parser')
-        except Exception as e:
-            print(e)
-        
+    :param fields: text of the first link ('a') and of the first element with each of ITEM_CLASSES
+    :type fields: dict
+    :returns: the show, or None if the container isn't a show
+    :rtype: ShowRecord
+    """
+    if 'day' not in fields: # checks if this is an appropriate entry, otherwise we capture bad data
+        return None
+
+    try:
+        day = fields['day'].strip()
+        if len(day) == 1: # check to see if day is in range 1-9, needs '0' added before if so
+            day = '0' + day
+
+        month = month_dict[fields['month'].strip()]
+        year = fields['year'].strip()
+        show_date = date.fromisoformat(year + '-' + month + '-' + day)
+
+        return ShowRecord(artist=fields['a'].strip(), venue=fields['venue_name'].strip(), show_date=show_date)
+    except (KeyError, ValueError) as e:
+        # a field missing, an unknown month or an impossible date
+        logger.warning('Skipped an event container: %r', e, extra={'ingest': {'source': SOURCE_NAME, 'fields': fields}})
+        return None
+
+
+def _soup_item_fields(html_item):
+    """ One walk over the container's descendants, keeping the first of each field """
+    fields = {}
+    for tag in html_item.find_all(True):
+        if tag.name == 'a' and 'a' not in fields:
+            fields['a'] = tag.get_text()
+        for css_class in tag.get('class', ()):
+            if css_class in ITEM_CLASSES and css_class not in fields:
+                fields[css_class] = tag.get_text()
+    return fields
+
+
+def parse_page_html_parser(content):
+    """ Full BeautifulSoup tree of the whole page, with the pure python parser """
+    soup = BeautifulSoup(content, 'html.parser')
     # selecting elements with <div class="d-flex flex-column h-100 flex-fill">
-        container_object = soup.find_all(class_="h-100")
-
-    # finds children to pull out date information, artist name, and venue name
-        for html_item in container_object:  
-            day_bs4_result_set = html_item.select('.day') # checks if this is an appropriate entry, otherwise we capture bad data
-            if day_bs4_result_set:  
-                try:
-                    band_name_bs4_result_set = html_item.select('a') # this item should be the band's name
-                    band_name = str(band_name_bs4_result_set[0].text).strip()        
-
-                    """Creates a new Artist instance
-                    :param band_name: name of band
-                    :type band_name: str
-                    """
-                    a = Artist(name=band_name)
-                    a.save()
-                    print(f'created new artist named {a.name}')
-                except django.db.utils.IntegrityError as e:
-                    print('Duplicate Artist entry, not added.')
-                    break
-                except Exception as e:
-                    print(e)
-                
-                try:
-                    venue_name_bs4_result_set = html_item.select('.venue_name')
-                    venue_name = str(venue_name_bs4_result_set[0].text).strip()
-                    """Creates a new Venue instance
-
-                       :param name: name of music venue
-                       :type name: str
-
-                       :param city: city inwhich venue is located
-                       :type city: str
-
-                       :param state: state inwhich venue is located
-                       :type state: str
-                    """
-                    v = Venue(name=venue_name, city='Minneapolis', state='MN')
-                    v.save()
-                    print(f'created new venue named {v.name}')
-                except django.db.utils.IntegrityError as e:
-                    print('Duplicate Venue entry, not added.')
-                except Exception as e:
-                    print(e)    
-                
-                try:
-                    day_bs4_result_set = html_item.select('.day')
-                    if day_bs4_result_set:
-                        day = str(day_bs4_result_set[0].text).strip() # results are beautifulsoup4 objects
-                        if len(day) == 1: # check to see if day is in range 1-9, needs '0' added before if so
-                            day = '0' + day
-
-                        month_bs4_result_set = html_item.select('.month')
-                        month_char_format = str(month_bs4_result_set[0].text).strip()
-                        month = month_dict[month_char_format]
-                        year_bs4_result_set = html_item.select('.year')
-                        year = str(year_bs4_result_set[0].text).strip()
-                        event_date = year + '-' + month + '-' + day
-                        date_time = date.fromisoformat(event_date)
-                                             
-                        """Created new show instance
-                            :param show_date: date show was performed
-                            :type show_date: datetime
-
-                            :param artist_id: fk for artist table
-                            :type artist_id: int
-                            
-                            :param venue_id: fk for venue table
-                            :type venue_id: int
-                        """
-                        s = Show(show_date=date_time, artist=Artist.objects.filter(name__icontains=band_name)[0], venue=Venue.objects.filter(name__icontains=venue_name)[0])
-                        s.save()
-                        print(f'created new show on {date_time}')
-                except django.db.utils.IntegrityError as e:
-                    print('Duplicate Show entry, not added.')
-                except Exception as e:
-                    print(e)
+    records = (show_record(_soup_item_fields(html_item)) for html_item in soup.find_all(class_="h-100"))
+    return [record for record in records if record]
+
+
+def _has_h100_class(css_class):
+    # While parsing, the strainer sees the raw class attribute ("card h-100"), so match on the split value
+    return css_class is not None and 'h-100' in css_class.split()
+
+
+def parse_page_soupstrainer(content):
+    """ BeautifulSoup, but only elements inside the h-100 containers are built into the tree """
+    soup = BeautifulSoup(content, 'html.parser', parse_only=SoupStrainer(class_=_has_h100_class))
+    records = (show_record(_soup_item_fields(html_item)) for html_item in soup.find_all(class_="h-100"))
+    return [record for record in records if record]
+
+
+def parse_page_lxml(content):
+    """ lxml's C parser, containers found with one XPath query """
+    document = lxml.html.fromstring(content)
+    records = []
+    for html_item in document.xpath('//*[contains(concat(" ", normalize-space(@class), " "), " h-100 ")]'):
+        fields = {}
+        for element in html_item.iterdescendants(tag=lxml.etree.Element):
+            if element.tag == 'a' and 'a' not in fields:
+                fields['a'] = element.text_content()
+            for css_class in element.get('class', '').split():
+                if css_class in ITEM_CLASSES and css_class not in fields:
+                    fields[css_class] = element.text_content()
+        record = show_record(fields)
+        if record:
+            records.append(record)
+    return records
+
+
+PARSERS = {
+    'html.parser': parse_page_html_parser,
+    'soupstrainer': parse_page_soupstrainer,
+}
+
+if lxml:
+    PARSERS['lxml'] = parse_page_lxml
+
+DEFAULT_PARSER = 'lxml' if lxml else 'soupstrainer'
+
+
+@register
+class FirstAvenue(Source):
+    """ https://first-avenue.com/shows/ - First Avenue, the 7th St Entry, and the other venues they book """
+
+    name = SOURCE_NAME
+    url_template = FIRST_AVENUE_URL
+    pages = PAGES_TO_SCRAPE
+    requests_per_second = 4
+    concurrency = 4
+    parser = None  # a backend in PARSERS, None for DEFAULT_PARSER
+
+    def parse_html(self, content):
+        return parse_page(content, self.parser)
+
+
+def scrape_first(concurrency=FirstAvenue.concurrency, url_template=FIRST_AVENUE_URL, pages=None, on_page=None, use_cache=True, parser=None, backfill=False, 
+                 requests_per_second=FirstAvenue.requests_per_second, parse_processes=None, archive=True):
+    """This function uses requests and beautifulsoup to get data from https://first-avenue.com/shows/, 
+    The last 15 pages go through the ingest pipeline (see lmn.ingest.run) - fetched, parsed, 
+    and written a page at a time.
+
+    :param concurrency: maximum number of pages downloading at once
+    :type concurrency: int
+    :param url_template: listing page url, with a {page_number} placeholder
+    :type url_template: str
+    :param pages: page numbers to scrape, defaults to the first PAGES_TO_SCRAPE pages
+    :type pages: iterable of int
+    :param on_page: called as on_page(page_number, counts) after each page is written or skipped
+    :type on_page: callable
+    :param use_cache: skip pages that are unchanged since they were last fetched
+    :type use_cache: bool
+    :param parser: name of a backend in PARSERS, defaults to DEFAULT_PARSER
+    :type parser: str
+    :param backfill: walk every page, ignoring the watermark and the page cache
+    :type backfill: bool
+    :param requests_per_second: politeness limit, None for no limit
+    :type requests_per_second: float
+    :param parse_processes: processes to parse pages in, defaults to one per core for a backfill
+    :type parse_processes: int
+    :param archive: keep every page fetched in the page archive, if settings.PAGE_ARCHIVE_DIR is set
+    :type archive: bool
+    :returns: totals of artists, venues and shows inserted, shows skipped and pages skipped, 
+        whether paging stopped early, and each pipeline stage's stats
+    :rtype: dict
+    """
+
+    source = FirstAvenue(concurrency=concurrency, url_template=url_template, parser=parser, requests_per_second=requests_per_second)
+    return SourceRun(source, pages=pages, on_page=on_page, backfill=backfill, use_cache=use_cache, 
+                     parse_processes=parse_processes, archive=archive).run()
 
 
 if __name__ == "__main__":
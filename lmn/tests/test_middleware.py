@@ -0,0 +1,60 @@
+from django.http import HttpResponse, JsonResponse
+from django.template import engines
+from django.test import TestCase, RequestFactory, override_settings
+from django.utils import timezone
+
+from lmn.middleware import NPlusOneMiddleware, NPlusOneError
+from lmn.models import Artist, Venue, Show
+
+
+SHOW_LIST = engines['django'].from_string('<html><body>\n<ul>\n{% for show in shows %}<li>{{ show.artist.name }}</li>{% endfor %}\n</ul></body></html>')
+
+
+class TestNPlusOneMiddleware(TestCase):
+
+    def setUp(self):
+        venue = Venue.objects.create(name='First Avenue', city='Minneapolis', state='MN')
+        for n in range(4):
+            Show.objects.create(artist=Artist.objects.create(name=f'Artist {n}'), venue=venue, show_date=timezone.now())
+        self.request = RequestFactory().get('/shows/')
+
+
+    def show_list(self, request, shows=None):
+        return HttpResponse(SHOW_LIST.render({'shows': shows or Show.objects.all()}))
+
+
+    def middleware(self, mode, view=None):
+        with override_settings(NPLUSONE_MODE=mode, NPLUSONE_THRESHOLD=3):
+            return NPlusOneMiddleware(view or self.show_list)
+
+
+    def test_raise_names_the_query_and_template_line(self):
+        with self.assertRaises(NPlusOneError) as error:
+            self.middleware('raise')(self.request)
+        message = str(error.exception)
+        self.assertIn('4x SELECT "lmn_artist"', message)
+        self.assertIn('WHERE "lmn_artist"."id" = ?', message)
+        self.assertIn('line 3: show.artist.name', message)
+
+
+    def test_queries_under_the_threshold_are_fine(self):
+        response = self.middleware('raise', lambda request: self.show_list(request, Show.objects.select_related('artist')))(self.request)
+        self.assertEqual(response.status_code, 200)
+
+
+    def test_banner_is_added_to_html_pages(self):
+        response = self.middleware('banner')(self.request)
+        content = response.content.decode()
+        self.assertIn('<body><div id="nplusone-banner"', content)
+        self.assertIn('4x SELECT', content)
+
+        json_response = self.middleware('banner', lambda request: JsonResponse({'artists': [show.artist.name for show in Show.objects.all()]}))(self.request)
+        self.assertNotIn(b'nplusone-banner', json_response.content)
+
+
+    def test_log_mode_only_logs(self):
+        with self.assertLogs('lmn.nplusone', 'WARNING') as logs:
+            response = self.middleware('log')(self.request)
+        self.assertNotIn(b'nplusone-banner', response.content)
+        self.assertIn('4x SELECT', logs.output[0])
+        self.assertIn('/shows/', logs.output[0])
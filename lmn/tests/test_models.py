@@ -1,7 +1,16 @@
+import datetime
+import io
+
 from django.test import TestCase
 
 from django.contrib.auth.models import User
-from django.db import IntegrityError
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from lmn.models import Artist, Venue, Show, ShowRating, RatingTotals, name_key
 # Create your tests here.
 
 
@@ -26,3 +35,98 @@ class TestUser(TestCase):
             user2.save()
 
 
+class TestNameKey(TestCase):
+
+    def test_name_key_normalizes_case_space_punctuation_and_the(self):
+        self.assertEqual(name_key('The  Replacements'), 'replacements')
+        self.assertEqual(name_key('replacements'), 'replacements')
+        self.assertEqual(name_key('R.E.M.'), 'rem')
+        self.assertEqual(name_key('Guns N\' Roses'), 'guns n roses')
+        self.assertEqual(name_key('Hüsker Dü'), 'hüsker dü')
+        self.assertEqual(name_key('The The'), 'the')
+        self.assertEqual(name_key('!!!'), '!!!')
+
+
+    def test_name_key_is_saved(self):
+        artist = Artist.objects.create(name='The Cure')
+        self.assertEqual(Artist.objects.get(name_key='cure'), artist)
+
+        artist.name = 'The Cure Tribute'
+        artist.save()
+        self.assertEqual(Artist.objects.get(name_key='cure tribute'), artist)
+
+
+    def test_names_with_same_key_are_the_same_artist(self):
+        Artist.objects.create(name='The Cure')
+        with self.assertRaises(IntegrityError):
+            Artist.objects.create(name='cure')
+
+
+    def test_clean_reports_a_name_matching_another_venue(self):
+        Venue.objects.create(name='The Turf Club', city='St. Paul', state='MN')
+        with self.assertRaises(ValidationError):
+            Venue(name='Turf Club', city='St. Paul', state='MN').full_clean()
+        Venue(name='Turf Club Annex', city='St. Paul', state='MN').full_clean()
+
+
+class TestShowRatingTotals(TestCase):
+
+    def setUp(self):
+        artist = Artist.objects.create(name='Dessa')
+        venue = Venue.objects.create(name='First Avenue', city='Minneapolis', state='MN')
+        self.show = Show.objects.create(artist=artist, venue=venue, show_date=timezone.now())
+        self.users = [User.objects.create(username=name, email=f'{name}@{name}.com') for name in ('al', 'bo', 'cy')]
+
+
+    def totals(self):
+        show = Show.objects.get(pk=self.show.pk)
+        return show.rating_count, show.rating_sum, show.rating_histogram
+
+
+    def test_totals_follow_ratings_saved_changed_and_deleted(self):
+        first = ShowRating.objects.create(show=self.show, user=self.users[0], rating_out_of_five=5)
+        ShowRating.objects.create(show=self.show, user=self.users[1], rating_out_of_five='4')
+        self.assertEqual(self.totals(), (2, 9, {1: 0, 2: 0, 3: 0, 4: 1, 5: 1}))
+
+        first.rating_out_of_five = 2
+        first.save()
+        first.save()
+        self.assertEqual(self.totals(), (2, 6, {1: 0, 2: 1, 3: 0, 4: 1, 5: 0}))
+
+        first.delete()
+        self.users[1].delete()  # and their rating with them
+        self.assertEqual(self.totals(), (0, 0, {1: 0, 2: 0, 3: 0, 4: 0, 5: 0}))
+
+
+    def test_rating_reads_the_totals_without_a_query(self):
+        ShowRating.objects.create(show=self.show, user=self.users[0], rating_out_of_five=5)
+        ShowRating.objects.create(show=self.show, user=self.users[1], rating_out_of_five=4)
+        ShowRating.objects.create(show=self.show, user=self.users[2], rating_out_of_five=4)
+        show = Show.objects.get(pk=self.show.pk)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(show.rating, 4.3)
+        self.assertEqual(len(queries), 0)
+        self.assertIsNone(Show(artist=show.artist, venue=show.venue, show_date=show.show_date).rating)
+
+
+    def test_score_is_stored_with_the_site_average(self):
+        other = Show.objects.create(artist=self.show.artist, venue=self.show.venue, show_date=timezone.now() - datetime.timedelta(days=1))
+        ShowRating.objects.create(show=other, user=self.users[0], rating_out_of_five=1)
+        ShowRating.objects.create(show=self.show, user=self.users[0], rating_out_of_five=5)
+
+        # site average 3, so (5 * 3 + 5) / (5 + 1)
+        self.assertAlmostEqual(Show.objects.get(pk=self.show.pk).rating_score, 20 / 6)
+        self.assertEqual(RatingTotals.objects.get().rating_count, 2)
+
+
+    def test_recount_shows_repairs_the_totals(self):
+        ShowRating.objects.create(show=self.show, user=self.users[0], rating_out_of_five=3)
+        ShowRating.objects.create(show=self.show, user=self.users[1], rating_out_of_five=1)
+        ShowRating.objects.filter(user=self.users[0]).update(rating_out_of_five=5)  # no signals
+        Show.objects.update(rating_count=7)
+
+        call_command('recount_shows', stdout=io.StringIO())
+
+        self.assertEqual(self.totals(), (2, 6, {1: 1, 2: 0, 3: 0, 4: 0, 5: 1}))
+        self.assertAlmostEqual(Show.objects.get(pk=self.show.pk).rating_score, (5 * 3 + 6) / (5 + 2))
@@ -0,0 +1,188 @@
+"""Query and time budgets for every page, on a database of a realistic size.
+
+Each named url in lmn/urls.py is requested anonymously and logged in. A request may run at most its 
+budgeted number of queries, and at most its budgeted number of duplicates - queries that are an earlier
+query with other values (see lmn.query_stats).
+
+Timings are written to the file named in the PERF_RESULTS environment variable, if it's set.
+To check for slowdowns, keep a results file from a good run and name it in PERF_BASELINE: any page
+taking more than PERF_TOLERANCE (default 0.5, meaning 50%) longer than in the baseline fails.
+"""
+import datetime
+import json
+import os
+import time
+from collections import namedtuple
+
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from lmn import urls
+from lmn.models import Artist, Venue, Show, Note, ShowRating, Profile, Badge, ScrapeJob, recount_ratings, recount_notes, clear_badge_cache
+from lmn.paginator import clear_count_cache
+from lmn.query_stats import duplicate_count, repeated_queries
+
+
+ARTISTS = 300
+VENUES = 60
+SHOWS = 3000
+USERS = 150
+NOTES = 1500
+RATINGS = 1500
+SHOWS_SEEN = 20  # per user
+
+TIMED_RUNS = 5  # the fastest is kept - slower runs are other things using the machine
+TIME_SLACK = 0.005  # seconds, on top of the tolerance, so very fast pages don't fail on noise
+
+Budget = namedtuple('Budget', ['anonymous', 'logged_in', 'duplicates'])
+
+# Most queries, anonymous and logged in, and most duplicate queries, for each named url
+BUDGETS = {
+    'homepage': Budget(0, 2, 0),
+    'venue_list': Budget(1, 3, 0),
+    'artists_at_venue': Budget(2, 4, 0),
+    'latest_notes': Budget(2, 4, 0),
+    'note_detail': Budget(1, 4, 0),
+    'new_note': Budget(0, 6, 0),  # anonymous users are redirected to log in
+    'edit_note': Budget(0, 3, 0),
+    'delete_note': Budget(0, 6, 0),
+    'most_notes': Budget(1, 3, 0),
+    'top_rated': Budget(1, 3, 0),
+    'artist_list': Budget(1, 3, 0),
+    'venues_for_artist': Budget(2, 4, 0),
+    'save_show_rating': Budget(0, 5, 0),
+    'show_detail': Budget(2, 6, 0),
+    'latest_shows': Budget(2, 4, 0),
+    'user_profile': Budget(4, 6, 0),
+    'edit_user': Budget(0, 8, 1),  # the form gets its own copy of the logged in user, see edit_user
+    'my_user_profile': Budget(0, 2, 0),
+    'most_active_users': Budget(1, 3, 0),
+    'goodbye': Budget(0, 4, 0),
+    'login': Budget(0, 2, 0),
+    'logout': Budget(0, 4, 0),
+    'register': Budget(0, 2, 0),
+    'admin_get_new_show': Budget(1, 1, 0),
+    'run_scrape_job': Budget(0, 2, 0),  # staff and App Engine cron only, everyone else is sent to log in
+    'scrape_job_status': Budget(1, 1, 0),
+}
+
+
+class TestPerformanceBudgets(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # Not in setUpTestData, whose attributes each test gets a copy of
+        cls.results = {}
+        super().setUpClass()
+
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='perf', email='perf@perf.com', password='qwertyuiop', first_name='P', last_name='Erf')
+        User.objects.bulk_create([User(username=f'user{n}', email=f'user{n}@example.com', first_name='U', last_name=str(n)) for n in range(USERS - 1)])
+        users = list(User.objects.order_by('pk'))
+        Profile.objects.bulk_create([Profile(user=user) for user in users if user != cls.user])
+
+        Artist.objects.bulk_create([Artist(name=f'Artist {n}', name_key=f'artist {n}') for n in range(ARTISTS)])
+        Venue.objects.bulk_create([Venue(name=f'Venue {n}', name_key=f'venue {n}', city='Minneapolis', state='MN') for n in range(VENUES)])
+        artists = list(Artist.objects.order_by('pk'))
+        venues = list(Venue.objects.order_by('pk'))
+        first_day = timezone.make_aware(datetime.datetime(2015, 1, 1))
+        Show.objects.bulk_create([Show(artist=artists[n % ARTISTS], venue=venues[n % VENUES], show_date=first_day + datetime.timedelta(days=n))
+                                  for n in range(SHOWS)])
+        shows = list(Show.objects.order_by('pk'))
+
+        Note.objects.bulk_create([Note(show=shows[n % SHOWS], user=users[n % USERS], title=f'Note {n}', text='Great show ' * 20)
+                                  for n in range(NOTES)])
+        ShowRating.objects.bulk_create([ShowRating(show=shows[(n * 7) % SHOWS], user=users[n % USERS], rating_out_of_five=n % 5 + 1)
+                                        for n in range(RATINGS)])
+        seen = Profile.shows_seen.through
+        profiles = list(Profile.objects.order_by('pk'))
+        seen.objects.bulk_create([seen(profile=profile, show=shows[(index * SHOWS_SEEN + n) % SHOWS]) 
+                                  for index, profile in enumerate(profiles) for n in range(SHOWS_SEEN)])
+        Badge.objects.bulk_create([Badge(name=f'{count} notes', description=f'{count} notes!', number_notes=count) for count in (1, 5, 10)])
+        badges = Profile.badges.through
+        badges.objects.bulk_create([badges(profile=profile, badge=badge) for profile in profiles for badge in Badge.objects.filter(number_notes=1)])
+        recount_ratings()
+        recount_notes()
+        clear_badge_cache()
+
+        cls.note = Note.objects.filter(user=cls.user).order_by('pk').first()
+        cls.show = cls.note.show
+        cls.job = ScrapeJob.objects.create()
+
+
+    @classmethod
+    def tearDownClass(cls):
+        if os.environ.get('PERF_RESULTS'):
+            with open(os.environ['PERF_RESULTS'], 'w') as results:
+                json.dump(cls.results, results, indent=2, sort_keys=True)
+        clear_badge_cache()
+        super().tearDownClass()
+
+
+    def url_kwargs(self):
+        return {'artist_pk': self.show.artist_id, 'venue_pk': self.show.venue_id, 'show_pk': self.show.pk, 
+                'note_pk': self.note.pk, 'user_pk': self.user.pk, 'job_pk': self.job.pk}
+
+
+    def url(self, pattern):
+        kwargs = self.url_kwargs()
+        return reverse(pattern.name, kwargs={name: kwargs[name] for name in pattern.pattern.converters})
+
+
+    def request(self, url, logged_in):
+        """The queries and wall time of one GET of url. Whatever it changes in the database is rolled back. 
+        Cached page counts are cleared first, so a page is measured as it is when its count has expired. """
+        clear_count_cache()
+        if logged_in:
+            self.client.force_login(self.user)
+        else:
+            self.client.logout()
+        with transaction.atomic():
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                response = self.client.get(url)
+                elapsed = time.perf_counter() - start
+            transaction.set_rollback(True)
+        self.assertLess(response.status_code, 400, url)
+        return [query['sql'] for query in queries], elapsed
+
+
+    def test_every_named_url_has_a_budget(self):
+        names = {pattern.name for pattern in urls.urlpatterns if getattr(pattern, 'name', None)}
+        self.assertEqual(names - BUDGETS.keys(), set(), 'Add a budget for each new page to BUDGETS')
+
+
+    def test_pages_within_budget(self):
+        baseline = None
+        if os.environ.get('PERF_BASELINE'):
+            with open(os.environ['PERF_BASELINE']) as baseline_file:
+                baseline = json.load(baseline_file)
+        tolerance = float(os.environ.get('PERF_TOLERANCE', 0.5))
+
+        for pattern in urls.urlpatterns:
+            if not getattr(pattern, 'name', None) or pattern.name not in BUDGETS:
+                continue
+            budget = BUDGETS[pattern.name]
+            url = self.url(pattern)
+            for role, logged_in, most_queries in (('anonymous', False, budget.anonymous), ('logged_in', True, budget.logged_in)):
+                with self.subTest(url=pattern.name, role=role):
+                    timings = []
+                    for run in range(TIMED_RUNS):
+                        queries, elapsed = self.request(url, logged_in)
+                        timings.append(elapsed)
+                    seconds = min(timings)
+                    key = f'{pattern.name} {role}'
+                    self.results[key] = {'queries': len(queries), 'duplicates': duplicate_count(queries), 'seconds': round(seconds, 4)}
+
+                    self.assertLessEqual(len(queries), most_queries, f'{url} ran {len(queries)} queries:\n' + '\n'.join(queries))
+                    self.assertLessEqual(duplicate_count(queries), budget.duplicates, 
+                                         f'{url} repeated queries:\n' + '\n'.join(f'{count}x {sql}' for sql, count in repeated_queries(queries).items()))
+                    if baseline and key in baseline:
+                        most_seconds = baseline[key]['seconds'] * (1 + tolerance) + TIME_SLACK
+                        self.assertLessEqual(seconds, most_seconds, f'{url} took {seconds:.4f}s, baseline {baseline[key]["seconds"]:.4f}s')
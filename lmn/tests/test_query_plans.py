@@ -0,0 +1,112 @@
+import re
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from lmn.forms import UserRegistrationForm
+from lmn.models import Artist, Venue, Show, Note
+from lmn.paginator import Cursor, encode_cursor, clear_count_cache, NEXT, PREVIOUS
+
+
+# Plan lines that mean a table was read row by row, or rows were sorted after reading them, instead of using an index.
+# SQLite: SCAN of a table (not of a subquery's rows) without USING INDEX - 'SCAN TABLE name [AS alias]' before SQLite 3.36 - and USE TEMP B-TREE. PostgreSQL, with seq scans and sorts made as costly 
+# as possible so a tiny test table doesn't make them the cheapest plan: Seq Scan and Sort nodes.
+FULL_SCAN_OR_SORT = {
+    'sqlite': re.compile(r'^SCAN (TABLE )?(?!subquery$)\w+( AS \w+)?$|USE TEMP B-TREE'),
+    'postgresql': re.compile(r'(^|->\s+)(Seq Scan|Sort)\b'),
+}
+
+
+def query_plan(sql):
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute('SET LOCAL enable_sort = off')
+            cursor.execute(f'EXPLAIN {sql}')
+            return [row[0].strip() for row in cursor.fetchall()]
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+        return [row[-1] for row in cursor.fetchall()]
+
+
+class TestQueryPlans(TestCase):
+    """ The listing views' queries are answered from indexes - no full table scans, and no sorting """
+
+    fixtures = ['testing_users', 'testing_artists', 'testing_venues', 'testing_shows', 'testing_notes']
+
+    def setUp(self):
+        if connection.vendor not in FULL_SCAN_OR_SORT:
+            self.skipTest(f'No query plan checks for {connection.vendor}')
+
+
+    def assertIndexedQueries(self, run):
+        with CaptureQueriesContext(connection) as queries:
+            run()
+        problems = []
+        for query in queries:
+            if not query['sql'].startswith('SELECT'):
+                continue
+            plan = query_plan(query['sql'])
+            if any(FULL_SCAN_OR_SORT[connection.vendor].search(line) for line in plan):
+                problems.append(query['sql'] + '\n    ' + '\n    '.join(plan))
+        self.assertFalse(problems, 'Queries not answered from an index:\n' + '\n'.join(problems))
+
+
+    def test_latest_shows(self):
+        self.assertIndexedQueries(lambda: self.client.get(reverse('latest_shows')))
+
+
+    def test_venues_for_artist(self):
+        self.assertIndexedQueries(lambda: self.client.get(reverse('venues_for_artist', kwargs={'artist_pk': 1})))
+
+
+    def test_artists_at_venue(self):
+        self.assertIndexedQueries(lambda: self.client.get(reverse('artists_at_venue', kwargs={'venue_pk': 2})))
+
+
+    def test_top_rated(self):
+        self.assertIndexedQueries(lambda: self.client.get(reverse('top_rated')))
+
+
+    def test_latest_notes(self):
+        self.assertIndexedQueries(lambda: self.client.get(reverse('latest_notes')))
+
+
+    def test_pages_after_and_before_a_cursor(self):
+        """ A page deep in a list is a range scan of the same index as the first page """
+        show, note = Show.objects.order_by('pk').first(), Note.objects.order_by('pk').first()
+        artist, venue = Artist.objects.order_by('pk').first(), Venue.objects.order_by('pk').first()
+        pages = [
+            (reverse('latest_shows'), [show.show_date, show.pk]),
+            (reverse('venues_for_artist', kwargs={'artist_pk': show.artist_id}), [show.show_date, show.pk]),
+            (reverse('artists_at_venue', kwargs={'venue_pk': show.venue_id}), [show.show_date, show.pk]),
+            (reverse('latest_notes'), [note.posted_date, note.pk]),
+            (reverse('artist_list'), [artist.name, artist.pk]),
+            (reverse('venue_list'), [venue.name, venue.pk]),
+        ]
+        # The next page, a page two on from it, the previous page, and the last page
+        cursors = lambda key: [Cursor(NEXT, 3, 0, key), Cursor(NEXT, 4, 10, key), Cursor(PREVIOUS, 2, 0, key), Cursor(PREVIOUS, 9, 0, [])]
+        for url, key in pages:
+            for cursor in cursors(key):
+                with self.subTest(url=url, cursor=cursor):
+                    clear_count_cache()
+                    self.assertIndexedQueries(lambda: self.client.get(url, {'cursor': encode_cursor(cursor)}))
+
+
+    def test_show_detail(self):
+        self.client.force_login(User.objects.get(pk=1))
+        self.assertIndexedQueries(lambda: self.client.get(reverse('show_detail', kwargs={'show_pk': 1})))
+
+
+    def test_user_profile(self):
+        self.client.force_login(User.objects.get(pk=2))
+        self.assertIndexedQueries(lambda: self.client.get(reverse('user_profile', kwargs={'user_pk': 2})))
+
+
+    def test_registration_username_and_email_checks(self):
+        form = UserRegistrationForm({'username': 'BOB', 'email': 'Bob@Bob.com', 'first_name': 'bob', 'last_name': 'bob', 
+                                     'password1': 'qwertyuiop', 'password2': 'qwertyuiop'})
+        self.assertIndexedQueries(form.is_valid)
+        self.assertIn('username', form.errors)
@@ -0,0 +1,867 @@
+import contextlib
+import datetime
+import io
+import os
+import shutil
+import tempfile
+import time
+
+from django.contrib.auth.models import User
+from django.core.management import call_command, CommandError
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from lmn.models import Artist, Venue, Show, Note, ShowRating, ScrapeJob, PageCacheEntry, IngestWatermark, ArchivedPage, IngestLock, DuplicateCandidate
+from lmn.ingest import dedupe
+from lmn.ingest import jobs
+from lmn.ingest.archive import PageArchive, reparse
+from lmn.ingest.fetch import fetch_pages, RateLimiter
+from lmn.ingest.locks import RunLock, LockHeld, acquire, release
+from lmn.ingest.pipeline import Pipeline
+from lmn.ingest.records import ShowRecord
+from lmn.ingest.replay import ReplayServer, load_recorded_pages, with_json_ld
+from lmn.ingest.run import run_sources
+from lmn.ingest.sources import Source, load_sources
+from lmn.ingest.structured import parse_structured, parse_json_ld, parse_ical
+from lmn.ingest.writer import ShowWriter
+from lmn import scraping
+
+
+RECORDED_PAGES = dict(load_recorded_pages())
+
+archive_settings = None
+
+
+def setUpModule():
+    # Scrapes in these tests archive their pages in a temporary directory
+    global archive_settings
+    archive_settings = override_settings(PAGE_ARCHIVE_DIR=tempfile.mkdtemp())
+    archive_settings.enable()
+
+
+def tearDownModule():
+    shutil.rmtree(archive_settings.options['PAGE_ARCHIVE_DIR'])
+    archive_settings.disable()
+
+
+def recorded_page(page_number):
+    return RECORDED_PAGES[page_number]
+
+
+def scrape(server, **kwargs):
+    """ scrape_first against a ReplayServer, without the politeness limit """
+    return scraping.scrape_first(url_template=server.url_template, requests_per_second=None, **kwargs)
+
+
+def replay_sources(server):
+    return [scraping.FirstAvenue(url_template=server.url_template, requests_per_second=None)]
+
+
+class TestFetchPages(TestCase):
+
+    def test_fetch_pages_returns_every_page(self):
+        with ReplayServer() as server:
+            urls = [server.url_template.format(page_number=n) for n in range(server.page_count())]
+            fetched = dict(fetch_pages(urls, concurrency=4))
+
+        self.assertEqual(set(fetched.keys()), set(urls))
+        for response in fetched.values():
+            self.assertEqual(response.status_code, 200)
+
+
+    def test_missing_page_yields_none(self):
+        with ReplayServer() as server, self.assertLogs('lmn.ingest.fetch', 'WARNING'):
+            url = server.url_template.format(page_number=999)
+            fetched = list(fetch_pages([url]))
+
+        self.assertEqual(fetched, [(url, None)])
+
+
+class TestRateLimiter(TestCase):
+
+    def test_calls_are_spaced_out(self):
+        limiter = RateLimiter(20)
+        start = time.perf_counter()
+        for _ in range(5):
+            limiter.wait()
+        self.assertGreaterEqual(time.perf_counter() - start, 0.19)  # the first call doesn't wait
+
+
+    def test_no_rate_means_no_waiting(self):
+        limiter = RateLimiter(None)
+        start = time.perf_counter()
+        for _ in range(100):
+            limiter.wait()
+        self.assertLess(time.perf_counter() - start, 0.1)
+
+
+class TestReplay(TestCase):
+
+    def test_recorded_pages_load_in_page_order(self):
+        self.assertEqual([page_number for page_number, content in load_recorded_pages()], list(range(15)))
+
+
+    def test_server_serves_recorded_page(self):
+        with ReplayServer() as server:
+            url, response = next(fetch_pages([server.url_template.format(page_number=4)]))
+
+        self.assertEqual(response.content, recorded_page(4))
+        self.assertIn('ETag', response.headers)
+
+
+class TestParsePage(TestCase):
+
+    def test_parse_recorded_page(self):
+        for parser in scraping.PARSERS:
+            records = scraping.parse_page(recorded_page(0), parser)
+            self.assertEqual(len(records), 12)
+            self.assertEqual(records[0], ShowRecord(artist='Bad Bad Hats', venue='7th St Entry', show_date=datetime.date(2021, 5, 8)))
+
+
+    def test_parsers_agree_on_every_recorded_page(self):
+        for page_number in range(15):
+            content = recorded_page(page_number)
+            expected = scraping.parse_page(content, 'html.parser')
+            for parser in scraping.PARSERS:
+                self.assertEqual(scraping.parse_page(content, parser), expected, f'{parser} on page {page_number}')
+
+
+    def test_parse_non_ascii_names(self):
+        for parser in scraping.PARSERS:
+            artists = {record.artist for record in scraping.parse_page(recorded_page(3), parser)}
+            self.assertIn('Hüsker Dü', artists)
+
+
+    def test_parse_page_without_shows(self):
+        for parser in scraping.PARSERS:
+            self.assertEqual(scraping.parse_page(b'<html><div class="h-100"><a href="/">Home</a></div></html>', parser), [])
+
+
+    def test_bad_event_is_logged_and_skipped(self):
+        page = (b'<html><div class="h-100"><a href="/">Bad Date</a><span class="day">31</span><span class="month">Feb</span>'
+                b'<span class="year">2021</span><span class="venue_name">Turf Club</span></div></html>')
+        for parser in scraping.PARSERS:
+            with self.assertLogs('lmn.ingest', 'WARNING') as logs:
+                self.assertEqual(scraping.parse_page(page, parser), [])
+            self.assertEqual(logs.records[0].ingest['fields']['a'], 'Bad Date')
+
+
+class TestStructuredData(TestCase):
+
+    ICAL_FEED = (b'BEGIN:VCALENDAR\r\nVERSION:2.0\r\n'
+                 b'BEGIN:VEVENT\r\nSUMMARY:Bad Bad Hats\r\nLOCATION:7th St Entry,701 1st Ave N,Minneapolis\r\n'
+                 b'DTSTART;TZID=America/Chicago:20210508T200000\r\nEND:VEVENT\r\n'
+                 b'BEGIN:VEVENT\r\nSUMMARY:A Very Long Band Name That Is Folded Ont\r\n o Two Lines\r\nLOCATION:Fine Line\\, Music Cafe\r\n'
+                 b'DTSTART:20210509T033000Z\r\nEND:VEVENT\r\n'
+                 b'END:VCALENDAR\r\n')
+
+    def test_json_ld_gives_the_same_shows_as_the_html(self):
+        for page_number, content in RECORDED_PAGES.items():
+            html_records = scraping.parse_page(content)
+            self.assertEqual(parse_json_ld(with_json_ld(content, html_records)), html_records)
+
+
+    def test_json_ld_start_time_is_converted_to_local_date(self):
+        page = b'<html><head><script type="application/ld+json">' \
+               b'{"@context": "https://schema.org", "@graph": [{"@type": "Organization", "name": "First Avenue"}, ' \
+               b'{"@type": ["Event", "MusicEvent"], "name": "Late Show", "startDate": "2021-05-09T04:30:00+00:00", ' \
+               b'"location": [{"@type": "Place", "name": "Turf Club"}]}]}</script></head></html>'
+        self.assertEqual(parse_json_ld(page), [ShowRecord('Late Show', 'Turf Club', datetime.date(2021, 5, 8))])
+        self.assertEqual(parse_json_ld(page.replace(b'+00:00', b'Z')), [ShowRecord('Late Show', 'Turf Club', datetime.date(2021, 5, 8))])
+
+
+    def test_ical_feed(self):
+        self.assertEqual(parse_structured(self.ICAL_FEED), [
+            ShowRecord('Bad Bad Hats', '7th St Entry', datetime.date(2021, 5, 8)),
+            ShowRecord('A Very Long Band Name That Is Folded Onto Two Lines', 'Fine Line, Music Cafe', datetime.date(2021, 5, 8)),  # 10:30pm in Minneapolis
+        ])
+
+
+    def test_pages_without_structured_data_fall_back_to_html(self):
+        content = recorded_page(0)
+        self.assertIsNone(parse_structured(content))
+        self.assertEqual(scraping.FirstAvenue().parse(content), scraping.parse_page(content))
+
+
+    def test_structured_data_comes_first(self):
+        content = with_json_ld(recorded_page(0), [ShowRecord('Only In JSON-LD', 'First Avenue', datetime.date(2021, 6, 1))])
+        self.assertEqual(scraping.FirstAvenue().parse(content),
+                         [ShowRecord('Only In JSON-LD', 'First Avenue', datetime.date(2021, 6, 1))] + scraping.parse_page(recorded_page(0)))
+
+
+    def test_partial_json_ld_is_merged_with_the_html(self):
+        html_records = scraping.parse_page(recorded_page(0))
+        content = with_json_ld(recorded_page(0), html_records[3:5])
+        records = scraping.FirstAvenue().parse(content)
+        self.assertEqual(records, html_records[3:5] + html_records[:3] + html_records[5:])
+        self.assertEqual(scraping.FirstAvenue().parse(with_json_ld(recorded_page(0), html_records)), html_records)
+
+
+    def test_ical_feed_needs_no_html_parser(self):
+        self.assertEqual(Source().parse(self.ICAL_FEED), parse_structured(self.ICAL_FEED))
+
+
+class TestShowWriter(TestCase):
+
+    def test_names_are_matched_by_key_not_substring(self):
+        Artist.objects.create(name='Remi Wolf')
+        Artist.objects.create(name='Replacements')
+        ShowWriter().write([ShowRecord('REM', 'First Avenue', datetime.date(2021, 1, 1)),
+                            ShowRecord('The Replacements', 'first avenue', datetime.date(2021, 1, 2))])
+
+        self.assertEqual(Show.objects.get(show_date__date=datetime.date(2021, 1, 1)).artist.name, 'REM')
+        self.assertEqual(Show.objects.get(show_date__date=datetime.date(2021, 1, 2)).artist.name, 'Replacements')
+        self.assertEqual(Venue.objects.get().name, 'First Avenue')  # the first spelling seen
+
+
+    def test_lookups_use_the_name_key_index(self):
+        plan = Artist.objects.filter(name_key__in=['rem', 'acdc']).explain()
+        self.assertIn('INDEX', plan.upper())
+        self.assertIn('name_key', plan)
+
+    def make_records(self, count, prefix=''):
+        start = datetime.date(2021, 1, 1)
+        return [ShowRecord(f'{prefix}Artist {n}', f'{prefix}Venue {n % 3}', start + datetime.timedelta(days=n)) for n in range(count)]
+
+
+    def test_write_inserts_artists_venues_and_shows(self):
+        counts = ShowWriter().write(self.make_records(5))
+
+        self.assertEqual(counts, {'artists_inserted': 5, 'artists_skipped': 0, 'venues_inserted': 3, 'venues_skipped': 0, 
+                                  'shows_inserted': 5, 'shows_skipped': 0})
+        self.assertEqual(Show.objects.count(), 5)
+        show = Show.objects.get(artist__name='Artist 4')
+        self.assertEqual(show.venue.name, 'Venue 1')
+        self.assertEqual(show.venue.city, 'Minneapolis')
+
+
+    def test_query_count_does_not_grow_with_batch_size(self):
+        with CaptureQueriesContext(connection) as small_batch:
+            ShowWriter().write(self.make_records(3))
+
+        with CaptureQueriesContext(connection) as large_batch:
+            ShowWriter().write(self.make_records(60, prefix='Another '))
+
+        self.assertEqual(len(small_batch), len(large_batch))
+
+
+    def test_rows_already_in_database_are_skipped(self):
+        ShowWriter().write(self.make_records(5))
+        counts = ShowWriter().write(self.make_records(5))
+
+        self.assertEqual(counts, {'artists_inserted': 0, 'artists_skipped': 5, 'venues_inserted': 0, 'venues_skipped': 3, 
+                                  'shows_inserted': 0, 'shows_skipped': 5})
+        self.assertEqual(Artist.objects.count(), 5)
+        self.assertEqual(Show.objects.count(), 5)
+
+
+    def test_duplicates_within_a_run_are_resolved_in_memory(self):
+        writer = ShowWriter()
+        records = self.make_records(5)
+        writer.write(records)
+
+        with CaptureQueriesContext(connection) as queries:
+            counts = writer.write(records + records)
+
+        self.assertEqual(counts['shows_inserted'], 0)
+        self.assertFalse([query for query in queries if query['sql'].startswith(('SELECT', 'INSERT'))])
+
+
+    def test_names_are_matched_exactly(self):
+        Artist.objects.create(name='Remi Wolf')
+        ShowWriter().write([ShowRecord('REM', 'Turf Club', datetime.date(2021, 1, 1))])
+
+        show = Show.objects.get()
+        self.assertEqual(show.artist.name, 'REM')
+
+
+class TestPipeline(TestCase):
+
+    def test_items_pass_through_every_stage(self):
+        results = []
+        pipeline = Pipeline()
+        pipeline.add_stage('double', lambda n: [n * 2], workers=3)
+        pipeline.add_stage('split', lambda n: [n, n + 1] if n % 4 == 0 else [])  # fan out and drop
+        pipeline.add_stage('collect', lambda n: results.append(n) or ())
+        pipeline.run(range(10))
+
+        self.assertEqual(sorted(results), [0, 1, 4, 5, 8, 9, 12, 13, 16, 17])
+        stats = {stage['stage']: stage for stage in pipeline.stats()}
+        self.assertEqual(stats['double']['items_in'], 10)
+        self.assertEqual(stats['split']['items_out'], 10)
+        self.assertEqual(stats['collect']['items_in'], 10)
+
+
+    def test_queues_are_bounded(self):
+        pipeline = Pipeline(queue_size=2)
+        pipeline.add_stage('fast', lambda n: [n], workers=4)
+        pipeline.add_stage('slow', lambda n: time.sleep(0.005) or ())
+        pipeline.run(range(30))
+
+        for stage in pipeline.stats():
+            self.assertLessEqual(stage['max_queue_depth'], 2)
+
+
+    def test_stage_error_is_raised_and_stops_input(self):
+        fed = []
+
+        def items():
+            for n in range(1000):
+                fed.append(n)
+                yield n
+
+        def explode(n):
+            if n == 3:
+                raise ValueError('bad item')
+            return [n]
+
+        pipeline = Pipeline()
+        pipeline.add_stage('explode', explode)
+        with self.assertRaises(ValueError):
+            pipeline.run(items())
+        self.assertLess(len(fed), 1000)
+
+
+    def test_database_stage_uses_callers_connection(self):
+        Artist.objects.create(name='Only visible inside this test transaction')
+        found = []
+        pipeline = Pipeline()
+        pipeline.add_stage('lookup', lambda name: found.extend(Artist.objects.filter(name=name)) or (), uses_db=True)
+        pipeline.run(['Only visible inside this test transaction'])
+
+        self.assertEqual(len(found), 1)
+
+
+class TestScrapeFirst(TestCase):
+
+    def test_scrape_recorded_pages_creates_shows(self):
+        with ReplayServer() as server:
+            counts = scrape(server)
+
+        self.assertEqual(Show.objects.count(), counts['shows_inserted'])
+        self.assertEqual(Artist.objects.count(), counts['artists_inserted'])
+        self.assertEqual(Venue.objects.count(), counts['venues_inserted'])
+        self.assertGreater(counts['shows_inserted'], 150)
+        self.assertEqual([stage['stage'] for stage in counts['stages']], ['fetch', 'parse', 'resolve', 'write'])
+        self.assertEqual(counts['stages'][-1]['items_in'], 15)
+
+
+    def test_backfill_parses_in_worker_processes(self):
+        with ReplayServer() as server:
+            counts = scrape(server, backfill=True, parse_processes=2)
+
+        parse_stage = counts['stages'][1]
+        self.assertEqual((parse_stage['stage'], parse_stage['workers'], parse_stage['items_in']), ('parse', 2, 15))
+        self.assertEqual(counts['shows_inserted'], sum(len(scraping.parse_page(content)) for content in RECORDED_PAGES.values()))
+        self.assertEqual(Show.objects.count(), counts['shows_inserted'])
+
+
+    def test_every_page_is_logged_with_its_timings(self):
+        with ReplayServer() as server, self.assertLogs('lmn.ingest.run') as logs:
+            scrape(server, pages=range(2))
+
+        pages = [record.ingest for record in logs.records if 'page' in getattr(record, 'ingest', {})]
+        self.assertEqual(sorted(page['page'] for page in pages), [0, 1])
+        for page in pages:
+            self.assertEqual(page['status'], 200)
+            self.assertEqual(page['bytes_fetched'], len(recorded_page(page['page'])))
+            self.assertEqual(page['shows_inserted'] + page['shows_skipped'], 12)
+            for timing in ('fetch_seconds', 'parse_seconds', 'db_seconds'):
+                self.assertGreater(page[timing], 0)
+
+
+    def test_bad_event_is_logged_not_printed(self):
+        pages_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, pages_dir)
+        with open(os.path.join(pages_dir, 'page_0.html'), 'wb') as f:
+            f.write(b'<html><div class="h-100"><a href="/">Bad Date</a><span class="day">31</span><span class="month">Feb</span>'
+                    b'<span class="year">2021</span><span class="venue_name">Turf Club</span></div>'
+                    b'<div class="h-100"><a href="/">Good Date</a><span class="day">1</span><span class="month">Mar</span>'
+                    b'<span class="year">2021</span><span class="venue_name">Turf Club</span></div></html>')
+
+        stdout = io.StringIO()
+        with ReplayServer(pages_dir) as server, self.assertLogs('lmn.ingest', 'WARNING') as logs, contextlib.redirect_stdout(stdout):
+            counts = scrape(server, pages=[0])
+
+        self.assertEqual(stdout.getvalue(), '')
+        self.assertEqual(counts['shows_inserted'], 1)
+        skipped = [record for record in logs.records if record.name == 'lmn.ingest.first_avenue']
+        self.assertEqual([(record.ingest['source'], record.ingest['fields']['a']) for record in skipped], [('first_avenue', 'Bad Date')])
+
+
+class TestScrapeJobs(TestCase):
+
+    def test_enqueue_returns_unfinished_job_instead_of_adding_another(self):
+        job, created = jobs.enqueue_scrape()
+        self.assertTrue(created)
+
+        same_job, created = jobs.enqueue_scrape()
+        self.assertFalse(created)
+        self.assertEqual(job, same_job)
+
+
+    def test_run_job_checkpoints_every_page(self):
+        job, created = jobs.enqueue_scrape()
+        with ReplayServer() as server:
+            jobs.run_job(job, replay_sources(server))
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, ScrapeJob.FINISHED)
+        self.assertEqual(sorted(job.pages_completed), sorted(f'first_avenue:{n}' for n in range(15)))
+        self.assertEqual(job.shows_inserted, Show.objects.count())
+        self.assertEqual(job.artists_inserted, Artist.objects.count())
+        self.assertEqual(job.pages_fetched, 15)
+        self.assertEqual(job.bytes_fetched, sum(len(content) for content in RECORDED_PAGES.values()))
+        self.assertGreater(job.parse_seconds, 0)
+        self.assertGreater(job.db_seconds, 0)
+
+
+    def test_interrupted_job_resumes_with_remaining_pages(self):
+        job = ScrapeJob.objects.create(status=ScrapeJob.RUNNING, pages_total=15, pages_completed=[f'first_avenue:{n}' for n in range(10)])
+        self.assertEqual(jobs.next_job(), job)
+
+        with ReplayServer() as server:
+            jobs.run_job(job, replay_sources(server))
+            self.assertEqual(server.request_count, 5)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, ScrapeJob.FINISHED)
+        self.assertEqual(job.pages_done, 15)
+
+
+    def test_failed_job_is_marked_failed(self):
+        job, created = jobs.enqueue_scrape()
+        with self.assertRaises(KeyError):
+            jobs.run_job(job, [scraping.FirstAvenue(url_template='http://127.0.0.1:1/{missing_placeholder}')])
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, ScrapeJob.FAILED)
+        self.assertIsNone(jobs.next_job())
+
+
+class TestRunLock(TestCase):
+
+    def test_lock_is_held_until_released(self):
+        self.assertTrue(acquire('test', 'worker-1'))
+        self.assertFalse(acquire('test', 'worker-2'))
+        self.assertTrue(acquire('test', 'worker-1'))  # renewing
+
+        release('test', 'worker-1')
+        self.assertTrue(acquire('test', 'worker-2'))
+
+
+    def test_expired_lock_can_be_taken_over(self):
+        acquire('test', 'worker-1', lease=-1)
+        self.assertTrue(acquire('test', 'worker-2'))
+        self.assertEqual(IngestLock.objects.get().owner, 'worker-2')
+
+
+    def test_run_lock_context_manager(self):
+        with RunLock('test'):
+            with self.assertRaises(LockHeld):
+                with RunLock('test'):
+                    pass
+        self.assertFalse(IngestLock.objects.exists())
+
+
+    def test_second_run_exits_without_touching_the_job(self):
+        acquire(jobs.RUN_LOCK, 'another-worker')
+        job, created = jobs.enqueue_scrape()
+        with self.assertRaises(LockHeld):
+            jobs.run_job(job, [scraping.FirstAvenue(url_template='http://127.0.0.1:1/{page_number}')])
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, ScrapeJob.QUEUED)
+
+
+    def test_scrape_command_exits_while_another_run_holds_the_lock(self):
+        acquire(jobs.RUN_LOCK, 'another-worker')
+        out = io.StringIO()
+        call_command('scrape', stdout=out)
+        self.assertIn('Another scrape is running', out.getvalue())
+
+
+    def test_sharded_job_does_every_page(self):
+        job, created = jobs.enqueue_scrape(backfill=True)
+        with ReplayServer() as server:
+            job = jobs.run_job(job, replay_sources(server), shard_size=4)
+
+        self.assertEqual(job.status, ScrapeJob.FINISHED)
+        self.assertEqual(job.pages_done, 15)
+        self.assertEqual(job.shows_inserted, Show.objects.count())
+        self.assertFalse(IngestLock.objects.exists())
+
+
+    def test_shards_claimed_by_another_worker_are_left_to_it(self):
+        job, created = jobs.enqueue_scrape(backfill=True)
+        claimed = f'{jobs.RUN_LOCK}:{job.pk}:first_avenue:4'
+        acquire(claimed, 'another-worker')
+
+        with ReplayServer() as server:
+            job = jobs.run_job(job, replay_sources(server), shard_size=4)
+            self.assertEqual(job.status, ScrapeJob.RUNNING)
+            self.assertEqual(job.pages_done, 11)
+
+            # The other worker went away, and its lease ran out
+            IngestLock.objects.filter(name=claimed).update(expires=timezone.now())
+            job = jobs.run_job(job, replay_sources(server), shard_size=4)
+
+        self.assertEqual(job.status, ScrapeJob.FINISHED)
+        self.assertEqual(job.pages_done, 15)
+
+
+    def test_sharded_job_gives_up_on_a_page_that_always_fails(self):
+        job, created = jobs.enqueue_scrape(backfill=True)
+        with ReplayServer() as server, self.assertLogs('lmn.ingest', 'WARNING'):
+            sources = [scraping.FirstAvenue(url_template=server.url_template, requests_per_second=None, pages=17)]  # there's no page 15 or 16
+            job = jobs.run_job(job, sources, shard_size=5)
+            self.assertEqual(server.request_count, 15 + 2 * jobs.MAX_PAGE_ATTEMPTS)
+
+        self.assertEqual(job.status, ScrapeJob.FINISHED)
+        self.assertEqual(job.pages_done, 15)
+        self.assertEqual(jobs.given_up(job), {'first_avenue:15', 'first_avenue:16'})
+        self.assertIn('first_avenue:16', job.error)
+        self.assertFalse(IngestLock.objects.exists())
+
+
+    def test_whole_job_run_waits_for_shards(self):
+        job, created = jobs.enqueue_scrape(backfill=True)
+        acquire(f'{jobs.RUN_LOCK}:{job.pk}:first_avenue:0', 'another-worker')
+        with self.assertRaises(LockHeld):
+            jobs.run_job(job, [scraping.FirstAvenue()])
+        self.assertFalse(IngestLock.objects.filter(name=jobs.RUN_LOCK).exists())
+
+
+class TestPageCache(TestCase):
+
+    # These runs clear the watermark in between, so every page is fetched again
+
+    def test_second_run_skips_pages_not_modified(self):
+        with ReplayServer() as server:
+            scrape(server)
+            self.assertEqual(PageCacheEntry.objects.count(), 15)
+
+            IngestWatermark.objects.all().delete()
+            counts = scrape(server)
+
+        self.assertEqual(counts['pages_skipped'], 15)
+        self.assertEqual(counts['shows_skipped'], 0)  # pages weren't even parsed
+
+
+    def test_pages_with_same_content_are_skipped_without_conditional_get(self):
+        with ReplayServer(conditional=False) as server:
+            scrape(server)
+            IngestWatermark.objects.all().delete()
+            counts = scrape(server)
+
+        self.assertEqual(counts['pages_skipped'], 15)
+        self.assertEqual(counts['shows_skipped'], 0)
+
+
+    def test_changed_page_is_parsed(self):
+        with ReplayServer(conditional=False) as server:
+            scrape(server)
+            IngestWatermark.objects.all().delete()
+            PageCacheEntry.objects.filter(url=server.url_template.format(page_number=3)).update(content_hash='changed')
+            counts = scrape(server)
+
+        self.assertEqual(counts['pages_skipped'], 14)
+        self.assertEqual(counts['shows_skipped'], 12)
+
+
+    def test_cache_can_be_bypassed(self):
+        with ReplayServer() as server:
+            scrape(server)
+            counts = scrape(server, use_cache=False)
+
+        self.assertEqual(counts['pages_skipped'], 0)
+        self.assertEqual(counts['shows_inserted'], 0)
+
+
+    def test_job_counts_skipped_pages(self):
+        with ReplayServer() as server:
+            jobs.run_job(jobs.enqueue_scrape()[0], replay_sources(server))
+            job = jobs.run_job(jobs.enqueue_scrape()[0], replay_sources(server))
+
+        self.assertEqual(job.pages_skipped, 1)
+        self.assertEqual(job.pages_done, 1)
+        self.assertTrue(job.stopped_early)
+
+
+class TestWatermark(TestCase):
+
+    def test_first_run_records_newest_show(self):
+        with ReplayServer() as server:
+            scrape(server)
+
+        watermark = IngestWatermark.objects.get(source=scraping.SOURCE_NAME)
+        self.assertEqual((watermark.show_date, watermark.artist, watermark.venue), (datetime.date(2021, 5, 8), 'Bad Bad Hats', '7th St Entry'))
+
+
+    def test_steady_state_run_fetches_one_page(self):
+        with ReplayServer() as server:
+            scrape(server)
+            server.request_count = 0
+            counts = scrape(server, use_cache=False)
+            self.assertEqual(server.request_count, 1)
+
+        self.assertTrue(counts['stopped_early'])
+
+
+    def test_paging_stops_at_page_holding_watermark(self):
+        newest_on_page_2 = scraping.parse_page(recorded_page(2))[0]
+        IngestWatermark.objects.create(source=scraping.SOURCE_NAME, show_date=newest_on_page_2.show_date, 
+                                       artist=newest_on_page_2.artist, venue=newest_on_page_2.venue)
+
+        with ReplayServer() as server:
+            counts = scrape(server)
+            # page 0, then pages 1 and 2. If page 1 is parsed before page 2 it releases pages 3 and 4 too.
+            self.assertGreaterEqual(server.request_count, 3)
+            self.assertLessEqual(server.request_count, 5)
+
+        self.assertTrue(counts['stopped_early'])
+        self.assertEqual(IngestWatermark.objects.get().show_date, datetime.date(2021, 5, 8))
+
+
+    def test_backfill_ignores_watermark(self):
+        with ReplayServer() as server:
+            scrape(server)
+            server.request_count = 0
+            counts = scrape(server, backfill=True)
+            self.assertEqual(server.request_count, 15)
+
+        self.assertFalse(counts['stopped_early'])
+        self.assertEqual(counts['pages_skipped'], 0)
+
+
+    def test_watermark_not_advanced_when_a_page_fails(self):
+        with ReplayServer() as server, self.assertLogs('lmn.ingest', 'WARNING'):
+            scrape(server, pages=range(16))  # there's no page 15
+
+        self.assertFalse(IngestWatermark.objects.exists())
+
+
+class SaintPaulListings(Source):
+    """ The recorded First Avenue pages, standing in for a second site """
+
+    name = 'st_paul_listings'
+    pages = 3
+    city = 'St. Paul'
+    requests_per_second = None
+
+    def parse_html(self, content):
+        return scraping.parse_page(content)
+
+
+class TestSources(TestCase):
+
+    def test_first_avenue_is_registered(self):
+        self.assertEqual([source.name for source in load_sources()], ['first_avenue'])
+
+
+    def test_unknown_override_is_an_error(self):
+        with self.assertRaises(AttributeError):
+            scraping.FirstAvenue(url='http://example.com/')
+
+
+    def test_sources_run_side_by_side(self):
+        pages_seen = []
+        with ReplayServer() as server:
+            sources = replay_sources(server) + [SaintPaulListings(url_template=server.url_template)]
+            results = run_sources(sources, on_page=lambda name, page, counts: pages_seen.append((name, page)))
+
+        self.assertEqual(set(results.keys()), {'first_avenue', 'st_paul_listings'})
+        self.assertEqual(len([page for page in pages_seen if page[0] == 'first_avenue']), 15)
+        self.assertEqual(len([page for page in pages_seen if page[0] == 'st_paul_listings']), 3)
+        # Both sources list the same shows, so each show is written once, whichever source got there first
+        self.assertEqual(Show.objects.count(), sum(result['shows_inserted'] for result in results.values()))
+        self.assertEqual(set(IngestWatermark.objects.values_list('source', flat=True)), {'first_avenue', 'st_paul_listings'})
+
+
+    def test_venues_get_their_source_city(self):
+        with ReplayServer() as server:
+            run_sources([SaintPaulListings(url_template=server.url_template)])
+
+        self.assertTrue(Venue.objects.exists())
+        self.assertFalse(Venue.objects.exclude(city='St. Paul').exists())
+
+
+    def test_one_source_failing_does_not_stop_the_others(self):
+        with ReplayServer() as server:
+            broken = SaintPaulListings(url_template=server.url_template)
+            broken.parse = lambda content: 1 / 0
+            with self.assertRaises(ZeroDivisionError):
+                run_sources(replay_sources(server) + [broken])
+
+        self.assertEqual(IngestWatermark.objects.get().source, 'first_avenue')
+
+
+class TestPageArchive(TestCase):
+
+    def archived_files(self):
+        return sum(len(files) for path, dirs, files in os.walk(PageArchive().root))
+
+
+    def test_every_fetched_page_is_archived(self):
+        with ReplayServer() as server:
+            scrape(server)
+
+        self.assertEqual(ArchivedPage.objects.count(), 15)
+        page = ArchivedPage.objects.get(url=server.url_template.format(page_number=3))
+        self.assertEqual(PageArchive().get(page.content_hash), recorded_page(3))
+        self.assertEqual(page.size, len(recorded_page(3)))
+        self.assertLess(os.path.getsize(PageArchive().path(page.content_hash)), page.size / 2)
+
+
+    def test_same_content_is_stored_once(self):
+        files_before = self.archived_files()
+        with ReplayServer(conditional=False) as server:
+            scrape(server)
+            scrape(server, backfill=True, parse_processes=0)
+
+        self.assertEqual(ArchivedPage.objects.count(), 30)  # every fetch is recorded
+        self.assertLessEqual(self.archived_files() - files_before, 15)
+
+
+    def test_nothing_is_archived_without_an_archive_directory(self):
+        with override_settings(PAGE_ARCHIVE_DIR=None), ReplayServer() as server:
+            scrape(server)
+            with self.assertRaises(CommandError):
+                call_command('reparse', stdout=io.StringIO())
+
+        self.assertFalse(ArchivedPage.objects.exists())
+        self.assertEqual(Show.objects.count(), 180)
+
+
+    def test_not_modified_pages_are_not_recorded(self):
+        with ReplayServer() as server:
+            scrape(server)
+            IngestWatermark.objects.all().delete()
+            scrape(server)
+
+        self.assertEqual(ArchivedPage.objects.count(), 15)
+
+
+    def test_reparse_rebuilds_shows_without_fetching(self):
+        with ReplayServer() as server:
+            scrape(server)
+        shows = Show.objects.count()
+        Show.objects.all().delete()
+        Artist.objects.all().delete()
+        Venue.objects.all().delete()
+
+        counts = reparse(scraping.FirstAvenue())  # the server is gone
+
+        self.assertEqual(counts['pages_parsed'], 15)
+        self.assertEqual(counts['shows_inserted'], shows)
+        self.assertEqual(Show.objects.count(), shows)
+
+
+    def test_reparse_command(self):
+        with ReplayServer() as server:
+            scrape(server)
+        Show.objects.all().delete()
+
+        out = io.StringIO()
+        call_command('reparse', stdout=out)
+        self.assertIn('first_avenue: 15 pages', out.getvalue())
+        self.assertGreater(Show.objects.count(), 150)
+
+
+class TestDuplicates(TestCase):
+
+    def setUp(self):
+        self.venue = Venue.objects.create(name='First Avenue', city='Minneapolis', state='MN')
+        self.prince = Artist.objects.create(name='Prince')
+        self.revolution = Artist.objects.create(name='Prince & The Revolution')
+        Artist.objects.create(name='Hüsker Dü')
+        Artist.objects.create(name='Husker Du')
+        Artist.objects.create(name='REM')
+        Artist.objects.create(name='Remi Wolf')
+        self.user = User.objects.create_user(username='bob', email='bob@bob.com', password='qwertyuiop')
+
+
+    def show(self, artist, day):
+        return Show.objects.create(artist=artist, venue=self.venue, show_date=timezone.make_aware(datetime.datetime(2021, 3, day)))
+
+
+    def test_similarity(self):
+        self.assertEqual(dedupe.similarity('hüsker dü', 'husker du'), 1)
+        self.assertGreater(dedupe.similarity('7th st entry', '7th street entry'), dedupe.DEFAULT_THRESHOLD)
+        self.assertLess(dedupe.similarity('rem', 'remi wolf'), dedupe.DEFAULT_THRESHOLD)
+        self.assertEqual(dedupe.similarity('turf club', 'fine line'), 0)
+
+
+    def test_only_names_sharing_a_word_are_compared(self):
+        pairs = dedupe.candidate_pairs({1: 'prince', 2: 'prince royce', 3: 'dessa', 4: 'dessa darling', 5: 'turf club'})
+        self.assertEqual(pairs, {(1, 2), (3, 4)})
+
+        pairs = dedupe.candidate_pairs({1: 'fine line', 2: 'fine line music cafe', 3: 'fine young cannibals'}, max_block=2)
+        self.assertEqual(pairs, {(1, 2)})  # 'fine' is in too many names to block on
+
+
+    def test_find_duplicates_saves_pairs_above_threshold(self):
+        self.show(self.revolution, 1)
+        self.show(self.revolution, 2)
+
+        counts = dedupe.find_duplicates(DuplicateCandidate.ARTIST)
+
+        self.assertEqual(counts['candidates_saved'], 2)
+        pairs = set(DuplicateCandidate.objects.values_list('keep_name', 'merge_name'))
+        self.assertIn(('Prince & The Revolution', 'Prince'), pairs)  # the one with more shows is kept
+        self.assertEqual(len(pairs & {('Hüsker Dü', 'Husker Du'), ('Husker Du', 'Hüsker Dü')}), 1)
+
+        counts = dedupe.find_duplicates(DuplicateCandidate.ARTIST)
+        self.assertEqual(counts['candidates_saved'], 0)
+
+
+    def test_merge_moves_shows_and_combines_duplicate_shows(self):
+        kept_show = self.show(self.revolution, 1)
+        clashing_show = self.show(self.prince, 1)
+        moved_show = self.show(self.prince, 2)
+        other_user = User.objects.create_user(username='al', email='al@al.com', password='qwertyuiop')
+        Note.objects.create(show=kept_show, user=self.user, title='Kept', text='Kept')
+        Note.objects.create(show=clashing_show, user=self.user, title='Clash', text='Clash')
+        Note.objects.create(show=clashing_show, user=other_user, title='Moved', text='Moved')
+        ShowRating.objects.create(show=clashing_show, user=self.user, rating_out_of_five=5)
+        ShowRating.objects.create(show=kept_show, user=other_user, rating_out_of_five=4)
+        ShowRating.objects.create(show=clashing_show, user=other_user, rating_out_of_five=1)
+
+        candidate = DuplicateCandidate.objects.create(kind=DuplicateCandidate.ARTIST, keep_id=self.revolution.pk, merge_id=self.prince.pk,
+                                                      keep_name=self.revolution.name, merge_name=self.prince.name, score=0.74,
+                                                      status=DuplicateCandidate.APPROVED)
+        with CaptureQueriesContext(connection) as queries:
+            counts = dedupe.merge(candidate)
+
+        self.assertEqual(counts, {'shows_moved': 1, 'shows_folded': 1, 'notes_dropped': 1, 'ratings_dropped': 1})
+        self.assertLess(len(queries), 40)  # the dropped note and rating are deleted one at a time, for their signals
+        self.assertFalse(Artist.objects.filter(pk=self.prince.pk).exists())
+        self.assertEqual(set(Show.objects.filter(artist=self.revolution)), {kept_show, moved_show})
+        self.assertEqual(set(Note.objects.filter(show=kept_show).values_list('title', flat=True)), {'Kept', 'Moved'})
+        self.assertEqual(set(ShowRating.objects.values_list('show', 'rating_out_of_five')), {(kept_show.pk, 5), (kept_show.pk, 4)})
+        candidate.refresh_from_db()
+        self.assertEqual(candidate.status, DuplicateCandidate.MERGED)
+
+
+    def test_admin_merges_only_approved_pairs(self):
+        admin_user = User.objects.create_superuser(username='admin', email='admin@admin.com', password='qwertyuiop')
+        self.client.force_login(admin_user)
+        self.show(self.prince, 1)
+        dedupe.find_duplicates(DuplicateCandidate.ARTIST)
+        prince = DuplicateCandidate.objects.get(keep_name='Prince')
+        husker = DuplicateCandidate.objects.exclude(pk=prince.pk).get()
+        prince.status = DuplicateCandidate.APPROVED
+        prince.save()
+
+        url = '/admin/lmn/duplicatecandidate/'
+        response = self.client.post(url, {'action': 'merge_approved', '_selected_action': [prince.pk, husker.pk]}, follow=True)
+
+        self.assertContains(response, '1 pairs merged')
+        self.assertContains(response, '0 notes and 0 ratings were dropped')
+        self.assertContains(response, '1 selected pairs')
+        self.assertFalse(Artist.objects.filter(name='Prince & The Revolution').exists())
+        self.assertEqual(Show.objects.get().artist, self.prince)
+        husker.refresh_from_db()
+        self.assertEqual(husker.status, DuplicateCandidate.PENDING)
@@ -1,6 +1,8 @@
+import io
 import tempfile
 import filecmp
 import os 
+from unittest import mock
 
 from django.test import TestCase, Client
 
@@ -10,9 +12,16 @@ from django.contrib import auth
 from django.contrib.auth import authenticate
 from django.db.utils import IntegrityError
 from django.core.exceptions import ValidationError
-from django.db import transaction
-
-from lmn.models import Profile, Venue, Artist, Note, Show, ShowRating, Badge
+from django.db import transaction, connection
+from django.core.management import call_command
+from django.test.utils import CaptureQueriesContext
+
+from lmn.models import Profile, Venue, Artist, Note, Show, ShowRating, Badge, ScrapeJob, award_badges, clear_badge_cache
+from lmn.paginator import clear_count_cache
+from lmn.ingest import jobs
+from lmn.ingest.locks import acquire
+from lmn.ingest.replay import ReplayServer
+from lmn.scraping import FirstAvenue
 from django.contrib.auth.models import User
 
 import re, datetime
@@ -393,7 +402,19 @@ class TestUserProfile(TestCase):
         # for currently logged in user, in this case, bob
         response = self.client.get(reverse('user_profile', kwargs={'user_pk':3}))
         self.assertContains(response, 'You are logged in, <a href="/user/profile/2/">bob</a>')
-        
+
+
+    def test_rejected_profile_edit_leaves_logged_in_user_unchanged(self):
+        bob = User.objects.get(pk=2)
+        self.client.force_login(bob)
+        response = self.client.post(reverse('edit_user', kwargs={'user_pk':2}), 
+                                    {'first_name': 'Robert', 'last_name': bob.last_name, 'email': 'not an email', 
+                                     'profile-TOTAL_FORMS': 1, 'profile-INITIAL_FORMS': 0})
+
+        self.assertFalse(response.context['user_form'].is_valid())
+        self.assertEqual(response.context['user'].first_name, bob.first_name)
+        self.assertEqual(User.objects.get(pk=2).first_name, bob.first_name)
+
 
 class TestNotes(TestCase):
     fixtures = [ 'testing_users', 'testing_artists', 'testing_venues', 'testing_shows', 'testing_notes' ]  # Have to add artists and venues because of foreign key constrains in show
@@ -881,6 +902,11 @@ class TestBadges(TestCase):
         self.client.force_login(user)
 
 
+    def tearDown(self):
+        # The badges are rolled back at the end of the test, which doesn't send the signals that clear the cache
+        clear_badge_cache()
+
+
     def test_add_note_badge_awarded_appropriately(self):
         new_note_url = reverse('new_note', kwargs={'show_pk':1})
         response = self.client.post(new_note_url, {'text':'ok', 'title':'blah blah' }, follow=True)
@@ -923,7 +949,383 @@ class TestBadges(TestCase):
         self.assertEqual(user_badges, 2)
 
 
+    def test_badge_missed_earlier_is_awarded_with_next_note(self):
+        user = User.objects.get(pk=1)
+        Badge.objects.filter(number_notes__lte=2).delete()
+        Note.objects.create(show_id=1, user=user, title='t', text='t')
+        Note.objects.create(show_id=2, user=user, title='t', text='t')
+        self.assertEqual(user.profile.badges.count(), 0)
+
+        Badge.objects.create(name='First Note', description='Made 1 note!', number_notes=1)
+        note = Note.objects.create(show_id=3, user=user, title='t', text='t')
+        self.assertEqual(list(user.profile.badges.values_list('name', flat=True)), ['First Note'])
+
+        # Editing a note doesn't count it again, or look at badges
+        with CaptureQueriesContext(connection) as queries:
+            note.title = 'edited'
+            note.save()
+        self.assertFalse([query for query in queries if 'lmn_badge' in query['sql'] or 'lmn_profile' in query['sql']])
+
+
+    def test_awarding_costs_the_same_queries_however_many_notes(self):
+        user = User.objects.get(pk=1)
+        Note.objects.create(show_id=1, user=user, title='t', text='t')  # loads the badge cache
+        with self.assertNumQueries(2):  # the profile's note count, and one insert
+            award_badges(user.pk)
+
+
+    def test_recompute_badges_backfills_every_user(self):
+        Note.objects.bulk_create([Note(show_id=show, user_id=user, title='t', text='t') for show in (1, 2, 3) for user in (1, 2)])  # no signals
+        Note.objects.create(show_id=1, user_id=3, title='t', text='t')
+        self.assertEqual(Profile.objects.get(user=1).badges.count(), 0)
+
+        out = io.StringIO()
+        call_command('recompute_badges', stdout=out)
+
+        self.assertIn('4 badges awarded', out.getvalue())
+        self.assertEqual(Profile.objects.get(user=1).note_count, 3)
+        self.assertEqual(list(Profile.objects.get(user=2).badges.values_list('number_notes', flat=True).order_by('number_notes')), [1, 2])
+        self.assertEqual(Profile.objects.get(user=3).badges.count(), 1)
+
+
+class TestLeaderboards(TestCase):
+
+    fixtures = [ 'testing_users', 'testing_artists', 'testing_venues', 'testing_shows', 'testing_notes' ]
+
+    def test_most_notes_ranks_shows_by_stored_note_count(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('most_notes'))
+        shows = list(response.context['shows'])
+        self.assertEqual([(show.pk, show.note_count) for show in shows], [(1, 2), (2, 1)])
+
+
+    def test_note_counts_follow_notes_added_and_deleted(self):
+        Note.objects.get(pk=1).delete()
+        Note.objects.create(show=Show.objects.get(pk=3), user=User.objects.get(pk=1), title='t', text='t')
+
+        counts = dict(Show.objects.values_list('pk', 'note_count'))
+        self.assertEqual(counts, {1: 1, 2: 1, 3: 1})
+        self.assertEqual(Profile.objects.get(user=1).note_count, 1)
+        self.assertEqual(Profile.objects.get(user=2).note_count, 2)
+
+
+    def test_top_rated_pulls_shows_with_few_ratings_towards_the_average(self):
+        users = User.objects.order_by('pk')
+        for user, stars in zip(users, [5, 5, 4]):
+            ShowRating.objects.create(show_id=1, user=user, rating_out_of_five=stars)
+        ShowRating.objects.create(show_id=2, user=users[0], rating_out_of_five=1)
+        ShowRating.objects.create(show_id=3, user=users[0], rating_out_of_five=5)
+
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('top_rated'))
+
+        self.assertEqual([show.pk for show in response.context['shows']], [1, 3, 2])
+        self.assertContains(response, '4.7/5 from 3 ratings')
+
+
+    def test_top_rated_with_no_ratings(self):
+        response = self.client.get(reverse('top_rated'))
+        self.assertContains(response, 'No shows have been rated.')
+
+
+    def test_most_active_users(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('most_active_users'))
+        self.assertEqual([(profile.user.username, profile.note_count) for profile in response.context['profiles']], 
+                         [('bob', 2), ('alice', 1)])
+
+
+class TestListingQueryCounts(TestCase):
+    """ Every listing page runs the same number of queries however many rows it shows """
+
+    def setUp(self):
+        self.artist = Artist.objects.create(name='Dessa')
+        self.venue = Venue.objects.create(name='First Avenue', city='Minneapolis', state='MN')
+        self.user = User.objects.create_user(username='alice', email='alice@alice.com', password='qwertyuiop')
+        self.first_show = None
+        self.rows = 0
+        self.client.force_login(self.user)
+
+
+    def add_rows(self, count):
+        """ count more shows, each with a note and a rating from a new user, a note from alice, and seen by alice """
+        for n in range(self.rows, self.rows + count):
+            show = Show.objects.create(artist=self.artist, venue=self.venue, 
+                                       show_date=datetime.datetime(2021, 1, 1, tzinfo=timezone.utc) + datetime.timedelta(days=n))
+            self.first_show = self.first_show or show
+            fan = User.objects.create(username=f'fan{n}', email=f'fan{n}@fan.com')
+            Note.objects.create(show=self.first_show if n else show, user=fan, title='t', text='t')
+            ShowRating.objects.create(show=show, user=fan, rating_out_of_five=4)
+            Note.objects.create(show=show, user=self.user, title='t', text='t')
+            self.user.profile.shows_seen.add(show)
+            Artist.objects.create(name=f'Artist {n}')
+            Venue.objects.create(name=f'Venue {n}', city='Minneapolis', state='MN')
+        self.rows += count
+
+
+    def assertConstantQueries(self, url, expected):
+        # Each request counts the rows again, for the pages that count them
+        self.add_rows(3)
+        clear_count_cache()
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(url)
+        self.add_rows(6)
+        clear_count_cache()
+        with CaptureQueriesContext(connection) as more:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(few), len(more), f'{url} ran more queries for more rows:\n' + '\n'.join(query['sql'] for query in more))
+        self.assertEqual(len(more), expected, '\n'.join(query['sql'] for query in more))
+
+
+    def test_latest_shows(self):
+        self.assertConstantQueries(reverse('latest_shows'), 4)
+
+
+    def test_venues_for_artist(self):
+        self.assertConstantQueries(reverse('venues_for_artist', kwargs={'artist_pk': self.artist.pk}), 4)
+
+
+    def test_artists_at_venue(self):
+        self.assertConstantQueries(reverse('artists_at_venue', kwargs={'venue_pk': self.venue.pk}), 4)
+
+
+    def test_artist_list(self):
+        self.assertConstantQueries(reverse('artist_list'), 3)
+
+
+    def test_venue_list(self):
+        self.assertConstantQueries(reverse('venue_list'), 3)
+
+
+    def test_show_detail(self):
+        self.add_rows(1)
+        self.assertConstantQueries(reverse('show_detail', kwargs={'show_pk': self.first_show.pk}), 6)
+
+
+    def test_latest_notes(self):
+        self.assertConstantQueries(reverse('latest_notes'), 4)
+
+
+    def test_note_detail(self):
+        self.add_rows(1)
+        note = Note.objects.get(show=self.first_show, user=self.user)
+        self.assertConstantQueries(reverse('note_detail', kwargs={'note_pk': note.pk}), 4)
+
+
+    def test_user_profile(self):
+        self.assertConstantQueries(reverse('user_profile', kwargs={'user_pk': self.user.pk}), 6)
+
 
+    def test_leaderboards(self):
+        self.assertConstantQueries(reverse('most_notes'), 3)
+        self.assertConstantQueries(reverse('top_rated'), 3)
+        self.assertConstantQueries(reverse('most_active_users'), 3)
 
 
+class TestKeysetPagination(TestCase):
+
+    def setUp(self):
+        clear_count_cache()
+        self.artist = Artist.objects.create(name='Dessa')
+        self.venue = Venue.objects.create(name='First Avenue', city='Minneapolis', state='MN')
+        first_day = datetime.datetime(2021, 1, 1, tzinfo=timezone.utc)
+        # More than the 100 the latest shows used to stop at, and some on the same day as another, which only id tells apart
+        Show.objects.bulk_create([Show(artist=self.artist if n % 2 else Artist.objects.create(name=f'Artist {n}'), venue=self.venue, 
+                                       show_date=first_day + datetime.timedelta(days=n // 2)) for n in range(105)])
+        self.newest_first = list(Show.objects.order_by('-show_date', '-pk').values_list('pk', flat=True))
+
+
+    def tearDown(self):
+        clear_count_cache()
+
+
+    def get_page(self, url, cursor=''):
+        page = self.client.get(url, {'cursor': cursor}).context['shows']
+        return page, [show.pk for show in page], [number for number, cursor in page.page_links]
+
+
+    def walk(self, url, params=None):
+        """ The pks on every page following the next links, then on every page following the previous links back """
+        response = self.client.get(url, params)
+        forward = [[show.pk for show in response.context['shows']]]
+        while response.context['shows'].has_next():
+            response = self.client.get(url, {**(params or {}), 'cursor': response.context['shows'].next_cursor})
+            forward.append([show.pk for show in response.context['shows']])
+        backward = []
+        while response.context['shows'].has_previous():
+            response = self.client.get(url, {**(params or {}), 'cursor': response.context['shows'].previous_cursor})
+            backward.insert(0, [show.pk for show in response.context['shows']])
+        return forward, backward
+
+
+    def test_latest_shows_pages_through_every_show_once(self):
+        forward, backward = self.walk(reverse('latest_shows'))
+        self.assertEqual(len(forward), 11)
+        self.assertEqual([pk for page in forward for pk in page], self.newest_first)
+        self.assertEqual(backward, forward[:-1])
+
+
+    def test_artist_and_venue_show_lists(self):
+        forward, backward = self.walk(reverse('venues_for_artist', kwargs={'artist_pk': self.artist.pk}))
+        self.assertEqual([pk for page in forward for pk in page], 
+                         list(Show.objects.filter(artist=self.artist).order_by('-show_date', '-pk').values_list('pk', flat=True)))
+        self.assertEqual(backward, forward[:-1])
+
+        forward, backward = self.walk(reverse('artists_at_venue', kwargs={'venue_pk': self.venue.pk}))
+        self.assertEqual([pk for page in forward for pk in page], self.newest_first)
+
+
+    def test_latest_notes_keep_microseconds(self):
+        user = User.objects.create_user(username='alice', email='alice@alice.com', password='qwertyuiop')
+        for pk in self.newest_first[:15]:
+            Note.objects.create(show_id=pk, user=user, title='t', text='t')
+        response = self.client.get(reverse('latest_notes'))
+        response = self.client.get(reverse('latest_notes'), {'cursor': response.context['notes'].next_cursor})
+        self.assertEqual(len(response.context['notes']), 5)
+
+
+    def test_search_is_kept_in_page_links(self):
+        response = self.client.get(reverse('artist_list'), {'search_name': 'artist'})
+        self.assertEqual(len(response.context['artists']), 10)
+        self.assertContains(response, f'?search_name=artist&cursor={response.context["artists"].next_cursor}')
+
+        response = self.client.get(reverse('artist_list'), {'search_name': 'artist', 'cursor': response.context['artists'].next_cursor})
+        self.assertTrue(all(artist.name.startswith('Artist') for artist in response.context['artists']))
+
+
+    def test_navigator_links_the_pages_either_side(self):
+        url = reverse('latest_shows')
+        page, pks, numbers = self.get_page(url)
+        self.assertEqual((numbers, page.estimated_pages), ([1, 2, 3], 11))
+
+        page, pks, numbers = self.get_page(url, dict(page.page_links)[3])
+        self.assertEqual((page.number, pks, numbers), (3, self.newest_first[20:30], [1, 2, 3, 4, 5]))
+
+        page, pks, numbers = self.get_page(url, dict(page.page_links)[5])
+        self.assertEqual((pks, numbers), (self.newest_first[40:50], [3, 4, 5, 6, 7]))
+
+        back, pks, numbers = self.get_page(url, dict(page.page_links)[3])
+        self.assertEqual((back.number, pks), (3, self.newest_first[20:30]))
+
+        page, pks, numbers = self.get_page(url, page.last_cursor)
+        self.assertEqual((page.number, pks, numbers), (11, self.newest_first[-10:], [9, 10, 11]))
+        self.assertFalse(page.has_next())
+        self.assertIsNone(page.last_cursor)
+
+
+    def test_uncounted_lists_link_only_the_next_page_ahead(self):
+        url = reverse('venues_for_artist', kwargs={'artist_pk': self.artist.pk})
+        page, pks, numbers = self.get_page(url)
+        self.assertEqual((numbers, page.estimated_pages, page.last_cursor), ([1, 2], None, None))
+
+        page, pks, numbers = self.get_page(url, page.next_cursor)
+        self.assertEqual(numbers, [1, 2, 3])
+
+
+    def test_count_is_cached(self):
+        with CaptureQueriesContext(connection) as first:
+            self.client.get(reverse('latest_shows'))
+        Show.objects.filter(artist=self.artist).delete()
+        with CaptureQueriesContext(connection) as second:
+            response = self.client.get(reverse('latest_shows'))
+        self.assertEqual(len(first), len(second) + 1)
+        self.assertEqual(response.context['shows'].estimated_pages, 11)
+
+        clear_count_cache()
+        self.assertEqual(self.client.get(reverse('latest_shows')).context['shows'].estimated_pages, 6)
+
+
+    def test_bad_cursor_shows_the_first_page(self):
+        first_page = [show.pk for show in self.client.get(reverse('latest_shows')).context['shows']]
+        for cursor in ('nonsense', 'WyJuIiwxXQ', 'WyJ4IiwiMjAyMS0wMS0wMSIsMV0', '!!'):
+            response = self.client.get(reverse('latest_shows'), {'cursor': cursor})
+            self.assertEqual([show.pk for show in response.context['shows']], first_page)
+            self.assertFalse(response.context['shows'].has_previous())
+
+
+class TestScraperViews(TestCase):
+
+    def test_scraper_queues_job_and_returns_immediately(self):
+        response = self.client.get(reverse('admin_get_new_show'))
+        self.assertEqual(response.status_code, 202)
+
+        job = ScrapeJob.objects.get()
+        self.assertEqual(response.json()['job_id'], job.pk)
+        self.assertEqual(job.status, ScrapeJob.QUEUED)
+        self.assertEqual(Show.objects.count(), 0)  # nothing scraped during the request
+
+
+    def test_scraper_does_not_queue_second_job_while_one_is_waiting(self):
+        first = self.client.get(reverse('admin_get_new_show')).json()
+        second = self.client.get(reverse('admin_get_new_show')).json()
+        self.assertEqual(first['job_id'], second['job_id'])
+        self.assertEqual(ScrapeJob.objects.count(), 1)
+
+
+    def test_run_scrape_job_is_for_cron_and_staff_only(self):
+        jobs.enqueue_scrape()
+        response = self.client.get(reverse('run_scrape_job'))
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(ScrapeJob.objects.get().status, ScrapeJob.QUEUED)
+
+
+    def test_cron_runs_the_queued_job(self):
+        job, created = jobs.enqueue_scrape()
+        with ReplayServer() as server, \
+             mock.patch('lmn.ingest.jobs.load_sources', lambda: [FirstAvenue(url_template=server.url_template, requests_per_second=None)]):
+            response = self.client.get(reverse('run_scrape_job'), HTTP_X_APPENGINE_CRON='true')
+
+        self.assertEqual(response.json(), {'job_id': job.pk, 'status': ScrapeJob.FINISHED, 
+                                           'status_url': reverse('scrape_job_status', kwargs={'job_pk': job.pk})})
+        self.assertGreater(Show.objects.count(), 0)
+
+
+    def test_cron_with_nothing_queued(self):
+        response = self.client.get(reverse('run_scrape_job'), HTTP_X_APPENGINE_CRON='true')
+        self.assertEqual(response.json()['status'], 'idle')
+
+
+    def test_cron_leaves_job_to_the_run_holding_the_lock(self):
+        job, created = jobs.enqueue_scrape()
+        acquire(jobs.RUN_LOCK, 'another-worker')
+        response = self.client.get(reverse('run_scrape_job'), HTTP_X_APPENGINE_CRON='true')
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['job_id'], job.pk)
+        self.assertEqual(ScrapeJob.objects.get().status, ScrapeJob.QUEUED)
+
+
+    def test_job_status(self):
+        job = ScrapeJob.objects.create(status=ScrapeJob.RUNNING, pages_total=15, pages_completed=['first_avenue:0', 'first_avenue:1', 'first_avenue:2'], shows_inserted=30)
+        response = self.client.get(reverse('scrape_job_status', kwargs={'job_pk': job.pk}))
+        status = response.json()
+
+        self.assertEqual(status['status'], 'running')
+        self.assertEqual(status['pages_done'], 3)
+        self.assertEqual(status['pages_total'], 15)
+        self.assertEqual(status['shows_inserted'], 30)
+
+
+    def test_status_for_missing_job_is_404(self):
+        response = self.client.get(reverse('scrape_job_status', kwargs={'job_pk': 1000}))
+        self.assertEqual(response.status_code, 404)
+
+
+    def test_run_history_chart_has_a_bar_per_finished_run(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.login(username='admin', password='password')
+        now = datetime.datetime.now(timezone.utc)
+        for seconds in [10, 20, 40]:
+            ScrapeJob.objects.create(status=ScrapeJob.FINISHED, started=now - datetime.timedelta(seconds=seconds), finished=now)
+        ScrapeJob.objects.create(status=ScrapeJob.RUNNING, started=now)
+
+        response = self.client.get(reverse('admin:lmn_scrapejob_history'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['bars']), 3)
+        self.assertEqual(max(bar['height'] for bar in response.context['bars']), 240)  # the slowest run fills the chart
+
 
+    def test_run_history_chart_is_for_staff_only(self):
+        response = self.client.get(reverse('admin:lmn_scrapejob_history'))
+        self.assertEqual(response.status_code, 302)
@@ -22,6 +22,7 @@ urlpatterns = [
     path('notes/edit/<int:note_pk>/', views_notes.edit_note, name='edit_note'),
     path('notes/delete/<int:note_pk>/', views_notes.delete_note, name='delete_note'),
     path('notes/most_notes/', views_notes.most_notes, name='most_notes'),
+    path('notes/top_rated/', views_notes.top_rated, name='top_rated'),
 
     # Artist related
     path('artists/list/', views_artists.artist_list, name='artist_list'),
@@ -36,6 +37,7 @@ urlpatterns = [
     path('user/profile/<int:user_pk>/', views_users.user_profile, name='user_profile'),
     path('user/profile/edit/<int:user_pk>/', views_users.edit_user, name='edit_user'),
     path('user/profile/me/', views_users.my_user_profile, name='my_user_profile'),
+    path('user/most_active/', views_users.most_active_users, name='most_active_users'),
     path('goodbye/', views_users.goodbye, name="goodbye"),
     # Account related
     path('accounts/login/', auth_views.LoginView.as_view(template_name='registration/login.html'), name='login'),
@@ -44,5 +46,7 @@ urlpatterns = [
     
 
     # Scheduled task
-    path('scraper/', admin_views.get_new_show, name='admin_get_new_show')
+    path('scraper/', admin_views.get_new_show, name='admin_get_new_show'),
+    path('scraper/run/', admin_views.run_scrape_job, name='run_scrape_job'),
+    path('scraper/status/<int:job_pk>/', admin_views.scrape_job_status, name='scrape_job_status'),
 ]
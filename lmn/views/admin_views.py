@@ -1,9 +1,64 @@
-import requests
-from ..models import Show, Artist, Venue
-from django.http import HttpResponse
-from .. import scraping
+from django.contrib.auth.views import redirect_to_login
+from django.http import JsonResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+
+from ..models import ScrapeJob
+from ..ingest import jobs
+from ..ingest.locks import LockHeld
 
 
 def get_new_show(request):
-    scraping.scrape_first()
-    return HttpResponse('ok')
+    """ Queue a scrape and return straight away. The scrape itself is run by manage.py scrape. """
+    job, created = jobs.enqueue_scrape()
+    return JsonResponse({'job_id': job.pk,
+                         'status': job.status,
+                         'created': created,
+                         'status_url': reverse('scrape_job_status', kwargs={'job_pk': job.pk})
+                         }, status=202)
+
+
+def run_scrape_job(request):
+    """Run the oldest queued or interrupted scrape job, for App Engine cron (see cron.yaml), or staff.
+    App Engine drops the X-Appengine-Cron header from requests that don't come from its cron service.
+
+    A run cut off by the request deadline keeps its checkpoints, and its lease runs out, so a later call resumes it.
+    """
+    if request.headers.get('X-Appengine-Cron') != 'true' and not request.user.is_staff:
+        return redirect_to_login(request.get_full_path())
+
+    job = jobs.next_job()
+    if job is None:
+        return JsonResponse({'job_id': None, 'status': 'idle'})
+    try:
+        job = jobs.run_job(job)
+    except LockHeld as e:
+        return JsonResponse({'job_id': job.pk, 'status': 'held', 'held_by': str(e)}, status=409)
+    return JsonResponse({'job_id': job.pk,
+                         'status': job.status,
+                         'status_url': reverse('scrape_job_status', kwargs={'job_pk': job.pk})
+                         })
+
+
+def scrape_job_status(request, job_pk):
+    job = get_object_or_404(ScrapeJob, pk=job_pk)
+    return JsonResponse({'job_id': job.pk,
+                         'status': job.status,
+                         'pages_done': job.pages_done,
+                         'pages_total': job.pages_total,
+                         'pages_fetched': job.pages_fetched,
+                         'pages_skipped': job.pages_skipped,
+                         'bytes_fetched': job.bytes_fetched,
+                         'artists_inserted': job.artists_inserted,
+                         'artists_skipped': job.artists_skipped,
+                         'venues_inserted': job.venues_inserted,
+                         'venues_skipped': job.venues_skipped,
+                         'shows_inserted': job.shows_inserted,
+                         'shows_skipped': job.shows_skipped,
+                         'fetch_seconds': round(job.fetch_seconds, 3),
+                         'parse_seconds': round(job.parse_seconds, 3),
+                         'db_seconds': round(job.db_seconds, 3),
+                         'stopped_early': job.stopped_early,
+                         'elapsed_seconds': round(job.elapsed, 1),
+                         'error': job.error
+                         })
@@ -1,24 +1,21 @@
 from django.shortcuts import render
 
-from ..models import Artist, Show
+from ..models import Artist, Show, name_key
 from ..forms import ArtistSearchForm
-from ..paginator import paginate
+from ..paginator import keyset_paginate
 
 
 def venues_for_artist(request, artist_pk):   # pk = artist_pk
 
     """ Get all of the venues where this artist has played a show """
 
-    shows = Show.objects.filter(artist=artist_pk).order_by('-show_date')  # most recent first
+    shows = Show.objects.filter(artist=artist_pk).select_related('venue')
     artist = Artist.objects.get(pk=artist_pk)
 
-    (shows, paginator, page) = paginate(request, shows, 10)
+    shows = keyset_paginate(request, shows, 10, ('-show_date', '-id'))  # most recent first
 
     return render(request, 'lmn/venues/venue_list_for_artist.html', { 'shows' : shows, 
                                                             'artist': artist,
-                                                            'page_range': paginator.page_range, 
-                                                            'num_pages' : paginator.num_pages, 
-                                                            'current_page': page
                                                             })
 
 
@@ -26,16 +23,13 @@ def artist_list(request):
     form = ArtistSearchForm()
     search_name = request.GET.get('search_name')
     if search_name:
-        artists = Artist.objects.filter(name__icontains=search_name).order_by('name')
+        artists = Artist.objects.filter(name_key__contains=name_key(search_name))
     else:
-        artists = Artist.objects.all().order_by('name')
+        artists = Artist.objects.all()
 
-    (artists, paginator, page) = paginate(request, artists, 10)
+    artists = keyset_paginate(request, artists, 10, ('name', 'id'))
 
     return render(request, 'lmn/artists/artist_list.html', {'form': form, 
                                                             'search_term': search_name, 
                                                             'artists' : artists, 
-                                                            'page_range': paginator.page_range, 
-                                                            'num_pages' : paginator.num_pages, 
-                                                            'current_page': page
                                                             })
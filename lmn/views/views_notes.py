@@ -1,9 +1,10 @@
 from django.core import paginator
 from django.shortcuts import render, redirect, get_object_or_404
 
-from ..models import Note, Show, ShowRating
+from ..models import Note, Show, ShowRating, PRIOR_RATINGS
 from ..forms import NewNoteForm, NewShowRatingForm
-from ..paginator import paginate
+from ..paginator import keyset_paginate
+from .. import leaderboards
 
 from django.db.models import Avg, Count, Min, Sum
 from django.contrib.auth.decorators import login_required
@@ -56,31 +57,26 @@ def new_note(request, show_pk):
 
 
 def latest_notes(request):
-    notes = Note.objects.all().order_by('-posted_date')[:100]   # the 100 most recent notes
+    notes = Note.objects.select_related('show__artist', 'show__venue', 'user')
 
-    (notes, paginator, page) = paginate(request, notes, 10)
+    notes = keyset_paginate(request, notes, 10, ('-posted_date', '-id'), estimate_count=True)  # most recent first
 
-    return render(request, 'lmn/notes/note_list.html', {'notes' : notes, 
-                                                        'page_range': paginator.page_range, 
-                                                        'num_pages' : paginator.num_pages, 
-                                                        'current_page': page
-                                                        })
+    return render(request, 'lmn/notes/note_list.html', {'notes' : notes})
 
 
 def most_notes(request):
-    shows = Show.objects.annotate(num_notes=Count('note')).order_by('-num_notes')[:10]
-    total_notes = Note.objects.count()
-
-    if total_notes == 0:
-        shows = None
-
     # top 10 shows with most notes
+    shows = leaderboards.most_noted_shows()
     return render(request, 'lmn/notes/most_notes.html', {'shows': shows })  
-    
+
+
+def top_rated(request):
+    shows = leaderboards.top_rated_shows()
+    return render(request, 'lmn/notes/top_rated.html', {'shows': shows, 'prior_ratings': PRIOR_RATINGS})
 
 
 def note_detail(request, note_pk):
-    note = get_object_or_404(Note, pk=note_pk)
+    note = get_object_or_404(Note.objects.select_related('show__artist', 'show__venue', 'user'), pk=note_pk)
 
     if request.user.is_authenticated:
         rating_model = ShowRating.objects.filter(show=note.show, user=request.user).first()
@@ -100,7 +96,7 @@ def note_detail(request, note_pk):
 def edit_note(request, note_pk):
     note = get_object_or_404(Note, pk=note_pk)
 
-    if note.user != request.user: # return an error if a user attempts to edit a note that doesn't belong to them
+    if note.user_id != request.user.id: # return an error if a user attempts to edit a note that doesn't belong to them
         return HttpResponseForbidden()
 
     if request.method == 'POST':
@@ -120,8 +116,8 @@ def edit_note(request, note_pk):
 def delete_note(request, note_pk):
     note = get_object_or_404(Note, pk=note_pk)
 
-    if note.user == request.user:
+    if note.user_id == request.user.id:
         note.delete()
-        return redirect('user_profile', user_pk=note.user.pk) # redirects to the user's profile after deleting
+        return redirect('user_profile', user_pk=note.user_id) # redirects to the user's profile after deleting
     else:
         return HttpResponseForbidden()
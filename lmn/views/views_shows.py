@@ -3,29 +3,24 @@ from django.contrib.auth.decorators import login_required
 
 from ..models import Show, Note, ShowRating
 from ..forms import NewShowRatingForm
-from ..paginator import paginate
-from django.core.paginator import EmptyPage, Paginator, PageNotAnInteger, EmptyPage
+from ..paginator import keyset_paginate
 
 import time
 
 
 def latest_shows(request):
-    shows = Show.objects.all().order_by('-show_date')[:100]
+    shows = Show.objects.select_related('artist', 'venue')
 
-    (shows, paginator, page) = paginate(request, shows, 10)
+    shows = keyset_paginate(request, shows, 10, ('-show_date', '-id'), estimate_count=True)  # newest first
 
-    return render(request, 'lmn/shows/latest_shows.html', { 'shows' : shows, 
-                                                            'page_range': paginator.page_range, 
-                                                            'num_pages' : paginator.num_pages, 
-                                                            'current_page': page
-                                                            })
+    return render(request, 'lmn/shows/latest_shows.html', { 'shows' : shows })
 
 
 def show_detail(request, show_pk): 
     # Notes for show, most recent first
     time.sleep(0.01)
-    notes = Note.objects.filter(show=show_pk).order_by('-posted_date')
-    show = Show.objects.get(pk=show_pk) 
+    notes = Note.objects.filter(show=show_pk).select_related('show__artist', 'show__venue', 'user').order_by('-posted_date')
+    show = Show.objects.select_related('artist', 'venue').get(pk=show_pk) 
     
     if request.user.is_authenticated: # if the user is logged in, check to see if they've already rated the show
         user_rating = ShowRating.objects.filter(show=show, user=request.user).first()
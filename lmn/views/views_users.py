@@ -2,7 +2,8 @@ from django.shortcuts import render, redirect
 from django.contrib import messages
 
 from ..models import Note, Profile
-from ..forms import UserRegistrationForm, UserForm, NoteSearchForm
+from ..forms import UserRegistrationForm, UserForm, NoteSearchForm, ProfileForm
+from .. import leaderboards
 
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
@@ -14,8 +15,8 @@ from django.forms.models import inlineformset_factory
 
 def user_profile(request, user_pk):
     # Get user profile for any user on the site
-    user = User.objects.get(pk=user_pk)
-    user_notes = Note.objects.filter(user=user.pk).order_by('-posted_date')
+    user = User.objects.select_related('profile').get(pk=user_pk)
+    user_notes = Note.objects.filter(user=user.pk).select_related('show__artist', 'show__venue').order_by('-posted_date')
     search_name = None
     form = None
 
@@ -26,9 +27,9 @@ def user_profile(request, user_pk):
 
             if search_name:
                 #search for this note, display results
-                user_notes = Note.objects.filter(title__icontains=search_name).order_by('-posted_date')                  
+                user_notes = Note.objects.filter(title__icontains=search_name).select_related('show__artist', 'show__venue').order_by('-posted_date')                  
 
-    user_shows = user.profile.shows_seen.all()
+    user_shows = user.profile.shows_seen.select_related('artist', 'venue')
     user_badges = user.profile.badges.all()
 
     return render(request, 'lmn/users/user_profile.html', { 'user_profile': user, 
@@ -40,16 +41,22 @@ def user_profile(request, user_pk):
                                                             })
 
 
+def most_active_users(request):
+    profiles = leaderboards.most_active_users()
+    return render(request, 'lmn/users/most_active_users.html', {'profiles': profiles})
+
+
 @login_required() # only logged in users should access this
 def edit_user(request, user_pk):
-    # querying the User object with pk from url
+    # querying the User object with pk from url. Not request.user, even when it's the same user: 
+    # the form changes its instance, and a rejected edit mustn't show up in the rest of the page.
     user = User.objects.get(pk=user_pk)
 
     # prepopulate ProfileForm with retrieved user values from above.
     user_form = UserForm(instance=user)
 
     # The sorcery begins from here, see explanation below
-    ProfileInlineFormset = inlineformset_factory(User, Profile, fields=('profile_image', 'shows_seen', 'bio', 'badges'), can_delete=False)
+    ProfileInlineFormset = inlineformset_factory(User, Profile, form=ProfileForm, can_delete=False)
     formset = ProfileInlineFormset(instance=user)
 
     if request.user.is_authenticated and request.user.id == user.id:
@@ -1,6 +1,6 @@
-from ..models import Venue, Show
+from ..models import Venue, Show, name_key
 from ..forms import VenueSearchForm
-from ..paginator import paginate
+from ..paginator import keyset_paginate
 
 from django.shortcuts import render
 
@@ -11,31 +11,25 @@ def venue_list(request):
 
     if search_name:
         #search for this venue, display results
-        venues = Venue.objects.filter(name__icontains=search_name).order_by('name')
+        venues = Venue.objects.filter(name_key__contains=name_key(search_name))
     else:
-        venues = Venue.objects.all().order_by('name')   # Todo paginate
+        venues = Venue.objects.all()
     
-    (venues, paginator, page) = paginate(request, venues, 10)
+    venues = keyset_paginate(request, venues, 10, ('name', 'id'))
 
     return render(request, 'lmn/venues/venue_list.html', {'form': form, 
                                                           'search_term': search_name, 
-                                                          'venues' : venues, 
-                                                          'page_range': paginator.page_range, 
-                                                          'num_pages' : paginator.num_pages, 
-                                                          'current_page': page})
+                                                          'venues' : venues})
 
 
 def artists_at_venue(request, venue_pk):   # pk = venue_pk
     """ Get all of the artists who have played a show at the venue with pk provided """
 
-    shows = Show.objects.filter(venue=venue_pk).order_by('-show_date') 
+    shows = Show.objects.filter(venue=venue_pk).select_related('artist')
     venue = Venue.objects.get(pk=venue_pk)
 
-    (shows, paginator, page) = paginate(request, shows, 10)
+    shows = keyset_paginate(request, shows, 10, ('-show_date', '-id'))  # most recent first
 
     return render(request, 'lmn/artists/artist_list_for_venue.html', { 'venue': venue, 
                                                                        'shows': shows, 
-                                                                       'page_range': paginator.page_range, 
-                                                                       'num_pages' : paginator.num_pages, 
-                                                                       'current_page': page
                                                                        })            
@@ -50,6 +50,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'lmn.middleware.NPlusOneMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -168,3 +169,50 @@ LOGOUT_REDIRECT_URL = 'goodbye'
 
 
 DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
+
+
+# If set, every listing page the scraper fetches is kept in this directory, gzipped, so it can be parsed again by 
+# manage.py reparse. Off by default - App Engine's filesystem is read-only.
+PAGE_ARCHIVE_DIR = os.getenv('PAGE_ARCHIVE_DIR')
+
+
+# Report pages that run one query more than NPLUSONE_THRESHOLD times (see lmn/middleware.py): 
+# 'raise', 'banner' or 'log' them, or 'off'. Set NPLUSONE_MODE=log on staging.
+NPLUSONE_MODE = os.getenv('NPLUSONE_MODE', 'banner' if DEBUG else 'off')
+NPLUSONE_THRESHOLD = int(os.getenv('NPLUSONE_THRESHOLD', 5))
+
+
+# The scraper logs one line of JSON per page, with its timings and row counts. Only failures are logged unless 
+# it's run by manage.py scrape, which logs at INGEST_LOG_LEVEL. NPLUSONE_MODE=log logs to lmn.nplusone.
+INGEST_LOG_LEVEL = os.getenv('INGEST_LOG_LEVEL', 'INFO')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json': {
+            '()': 'lmn.ingest.logs.JsonFormatter',
+        },
+    },
+    'handlers': {
+        'ingest_console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'json',
+        },
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'lmn.ingest': {
+            'handlers': ['ingest_console'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+        'lmn.nplusone': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+    },
+}